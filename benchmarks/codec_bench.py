@@ -0,0 +1,68 @@
+"""Microbenchmark for the task codecs.
+
+Compares encode/decode time and stored bytes per task for each codec, for a
+small task and one with a larger payload. `decode` rebuilds the Task only
+(args stay raw); `full` also touches args/kwargs. Runs without Redis:
+
+    python benchmarks/codec_bench.py
+"""
+import os
+import sys
+import timeit
+
+_project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _project_root not in sys.path:
+    sys.path.insert(0, _project_root)
+
+from taskqueue.codec import BinaryCodec, JSONCodec, get_codec
+from taskqueue.task import Task
+
+CODECS = {"json": JSONCodec(), "binary": BinaryCodec()}
+
+SAMPLE_TASKS = {
+    "small": Task("send_email", args=("user@example.com",), kwargs={"template": "welcome"}),
+    "large": Task(
+        "index_document",
+        args=(12345,),
+        kwargs={"tokens": list(range(2000)), "meta": {f"field_{i}": "x" * 20 for i in range(50)}},
+    ),
+}
+
+
+def bench_codec(codec, task, number):
+    fields = task.to_hash(codec)
+    size = len(fields["data"]) + len(fields["payload"])
+
+    encode = timeit.timeit(lambda: task.to_hash(codec), number=number)
+    decode = timeit.timeit(lambda: Task.from_hash(fields), number=number)
+    full = timeit.timeit(lambda: Task.from_hash(fields).args, number=number)
+    return {
+        "bytes": size,
+        "encode_us": encode / number * 1e6,
+        "decode_us": decode / number * 1e6,
+        "full_decode_us": full / number * 1e6,
+    }
+
+
+def main(number=20000):
+    print(f"{'task':<8}{'codec':<8}{'bytes':>8}{'encode us':>12}{'decode us':>12}{'full us':>12}")
+    for task_label, task in SAMPLE_TASKS.items():
+        runs = number if task_label == "small" else max(1, number // 20)
+        for codec_label, codec in CODECS.items():
+            result = bench_codec(codec, task, runs)
+            print(
+                f"{task_label:<8}{codec_label:<8}{result['bytes']:>8}"
+                f"{result['encode_us']:>12.2f}{result['decode_us']:>12.2f}{result['full_decode_us']:>12.2f}"
+            )
+
+    # sanity check: every codec's output decodes back to the same task
+    for codec in CODECS.values():
+        for task in SAMPLE_TASKS.values():
+            fields = task.to_hash(codec)
+            assert get_codec(fields["data"]) is not None
+            restored = Task.from_hash(fields)
+            assert (restored.id, restored.args, restored.kwargs) == (task.id, task.args, task.kwargs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Starvation/latency benchmark for the scheduling policies.
+
+Simulates sustained overload on an `InMemoryBackend`: every round 4 high,
+1 medium and 1 low priority task arrive while workers only claim 5, so some
+level has to fall behind. Prints per-level queue wait (p50/p99), how many
+tasks were served and how old the oldest still-waiting task is. Strict
+priority starves the low level; the other policies keep it moving.
+
+The second table shows the cost of one claim with a small and a large
+backlog, to check the decision per dequeue doesn't grow with queue size.
+
+    python benchmarks/scheduling_bench.py
+"""
+import os
+import sys
+import time
+
+_project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _project_root not in sys.path:
+    sys.path.insert(0, _project_root)
+
+from taskqueue.scheduler import AgingPolicy, Scheduler, StrictPolicy, WeightedRoundRobinPolicy
+from taskqueue.storage.memory_backend import InMemoryBackend
+from taskqueue.task import Priority, Task, priority_name
+
+POLICIES = {
+    "strict": StrictPolicy,
+    "wrr": WeightedRoundRobinPolicy,
+    "aging": lambda: AgingPolicy(age_step=0.05),
+}
+
+ARRIVALS = {Priority.High: 4, Priority.Medium: 1, Priority.Low: 1} # per round
+CAPACITY = 5 # claims per round
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def simulate(policy, rounds, tick):
+    backend = InMemoryBackend()
+    scheduler = Scheduler(backend, policy)
+    waits = {prior: [] for prior in ARRIVALS}
+
+    for _ in range(rounds):
+        for prior, count in ARRIVALS.items():
+            backend.push_many([Task("job", priority=prior) for _ in range(count)])
+
+        now = time.time()
+        for task in scheduler.claim_next_tasks(CAPACITY):
+            waits[task.priority].append(now - task.created_at)
+            backend.mark_completed(task)
+        time.sleep(tick)
+
+    # whatever is left has been waiting since it was pushed
+    now = time.time()
+    oldest = dict.fromkeys(ARRIVALS, 0.0)
+    for task in iter(backend.pop, None):
+        oldest[task.priority] = max(oldest[task.priority], now - task.created_at)
+    return waits, oldest
+
+
+def claim_cost(policy, backlog, number=2000):
+    backend = InMemoryBackend()
+    for prior in ARRIVALS:
+        backend.push_many([Task("job", priority=prior) for _ in range(backlog)])
+    scheduler = Scheduler(backend, policy)
+
+    start = time.perf_counter()
+    for _ in range(number):
+        scheduler.claim_next_task()
+    return (time.perf_counter() - start) / number * 1e6
+
+
+def main(rounds=400, tick=0.002):
+    print(f"{'policy':<8}{'level':<8}{'served':>8}{'p50 ms':>10}{'p99 ms':>10}{'oldest left ms':>16}")
+    for label, make_policy in POLICIES.items():
+        waits, oldest = simulate(make_policy(), rounds, tick)
+        for prior in ARRIVALS:
+            print(
+                f"{label:<8}{priority_name(prior):<8}{len(waits[prior]):>8}"
+                f"{percentile(waits[prior], 50) * 1000:>10.1f}{percentile(waits[prior], 99) * 1000:>10.1f}"
+                f"{oldest[prior] * 1000:>16.1f}"
+            )
+
+    print()
+    print(f"{'policy':<8}{'us/claim, 1k backlog':>22}{'us/claim, 100k backlog':>24}")
+    for label, make_policy in POLICIES.items():
+        small = claim_cost(make_policy(), 1000)
+        large = claim_cost(make_policy(), 100000)
+        print(f"{label:<8}{small:>22.2f}{large:>24.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""Throughput/latency benchmark suite with JSON results and regression checks.
+
+Measures, for each payload size:
+
+  enqueue.<payload>              Queue.enqueue ops/s (one push per call)
+  enqueue_many.<payload>         Queue.enqueue_many ops/s (pipelined chunks)
+  dequeue.single.<payload>       claim ops/s with every task on one priority
+  dequeue.multi.<payload>        claim ops/s with tasks spread over three priorities
+  e2e.c<N>.<payload>             Worker throughput and enqueue-to-finish p50/p99
+                                 latency with concurrency N
+  codec.<codec>.<task>           encode/decode cost per task (see codec_bench.py)
+
+Every case runs `--repeat` times on a fresh, empty backend and the median is
+kept. The Redis backend gets its own throwaway `redis-server` subprocess
+(no persistence, random free port), so runs don't depend on whatever else is
+on the box; `--backend memory` runs against `InMemoryBackend` instead.
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --quick --compare results.json
+
+`--compare` reruns the suite and exits with status 1 if any metric is worse
+than the baseline by more than `--threshold` (10% by default); `--compare`
+with `--current other.json` only compares two saved files.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+_project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _project_root not in sys.path:
+    sys.path.insert(0, _project_root)
+
+from taskqueue import Priority, Queue, Worker
+from taskqueue.scheduler import Scheduler
+from taskqueue.storage.memory_backend import InMemoryBackend
+from taskqueue.storage.redis_backend import RedisBackend
+
+import codec_bench
+
+PAYLOADS = {
+    "100b": "x" * 100,
+    "10kb": "x" * 10_000,
+}
+
+FULL = dict(tasks=20_000, e2e_tasks=5_000, concurrency=(1, 4, 16), repeat=3)
+QUICK = dict(tasks=2_000, e2e_tasks=500, concurrency=(1, 4), repeat=1)
+
+# metrics where a bigger number is better; everything else (latencies) is lower-is-better
+HIGHER_IS_BETTER = ("ops_per_s",)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+@contextlib.contextmanager
+def redis_server(executable="redis-server"):
+    """Start a private, non-persistent redis-server and yield its port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    workdir = tempfile.mkdtemp(prefix="taskqueue-bench-")
+    process = subprocess.Popen(
+        [executable, "--port", str(port), "--bind", "127.0.0.1", "--save", "", "--appendonly", "no", "--dir", workdir],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        backend = RedisBackend(port=port)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                backend.ping()
+                break
+            except ConnectionError:
+                if time.monotonic() > deadline or process.poll() is not None:
+                    raise RuntimeError(f"{executable} did not start on port {port}")
+                time.sleep(0.05)
+        yield port
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+class BackendFactory:
+    """Hands out an empty backend per run."""
+
+    def __init__(self, kind, port=None):
+        self.kind = kind
+        self.port = port
+
+    def __call__(self):
+        if self.kind == "memory":
+            return InMemoryBackend()
+        backend = RedisBackend(port=self.port)
+        backend._redis.flushdb()
+        return backend
+
+
+def median_run(factory, repeat, run):
+    """Median of `repeat` runs of `run(backend)`, each returning a dict of metrics."""
+    runs = []
+    for _ in range(repeat):
+        backend = factory()
+        try:
+            runs.append(run(backend))
+        finally:
+            backend.close()
+    return {key: statistics.median(r[key] for r in runs) for key in runs[0]}
+
+
+def bench_enqueue(backend, payload, count):
+    queue = Queue(backend=backend)
+    start = time.perf_counter()
+    for _ in range(count):
+        queue.enqueue("bench", payload)
+    return {"ops_per_s": count / (time.perf_counter() - start)}
+
+
+def bench_enqueue_many(backend, payload, count):
+    queue = Queue(backend=backend)
+    start = time.perf_counter()
+    queue.enqueue_many(("bench", (payload,), {}) for _ in range(count))
+    return {"ops_per_s": count / (time.perf_counter() - start)}
+
+
+def bench_dequeue(backend, payload, count, priorities):
+    queue = Queue(backend=backend)
+    queue.enqueue_many({"name": "bench", "args": (payload,), "priority": priorities[i % len(priorities)]} for i in range(count))
+    scheduler = Scheduler(backend)
+    start = time.perf_counter()
+    claimed = 0
+    while scheduler.claim_next_task() is not None:
+        claimed += 1
+    elapsed = time.perf_counter() - start
+    assert claimed == count, f"claimed {claimed} of {count}"
+    return {"ops_per_s": count / elapsed}
+
+
+def bench_end_to_end(backend, payload, count, concurrency):
+    """Enqueue `count` no-op tasks while a Worker drains them."""
+    worker = Worker(backend=backend, concurrency=concurrency, poll_interval=0.05, heartbeat_interval=None, reap_interval=None, promote_interval=None)
+    latencies = []
+    done = threading.Event()
+    lock = threading.Lock()
+
+    @worker.task()
+    def bench(data):
+        pass
+
+    @worker.after_task
+    def record(task, outcome, error):
+        with lock:
+            latencies.append(time.time() - task.created_at)
+            if len(latencies) >= count:
+                done.set()
+
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    try:
+        queue = Queue(backend=backend)
+        start = time.perf_counter()
+        for _ in range(count):
+            queue.enqueue("bench", payload)
+        if not done.wait(timeout=300):
+            raise RuntimeError(f"only {len(latencies)} of {count} tasks finished")
+        elapsed = time.perf_counter() - start
+    finally:
+        worker.stop()
+        thread.join()
+
+    return {
+        "ops_per_s": count / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def run_suite(factory, settings):
+    results = {}
+    repeat = settings["repeat"]
+    tasks = settings["tasks"]
+
+    for label, payload in PAYLOADS.items():
+        print(f"  enqueue ({label})", file=sys.stderr)
+        results[f"enqueue.{label}"] = median_run(factory, repeat, lambda b: bench_enqueue(b, payload, tasks))
+        results[f"enqueue_many.{label}"] = median_run(factory, repeat, lambda b: bench_enqueue_many(b, payload, tasks))
+
+        print(f"  dequeue ({label})", file=sys.stderr)
+        results[f"dequeue.single.{label}"] = median_run(factory, repeat, lambda b: bench_dequeue(b, payload, tasks, [Priority.Medium]))
+        levels = [Priority.High, Priority.Medium, Priority.Low]
+        results[f"dequeue.multi.{label}"] = median_run(factory, repeat, lambda b: bench_dequeue(b, payload, tasks, levels))
+
+        for concurrency in settings["concurrency"]:
+            print(f"  end to end, concurrency {concurrency} ({label})", file=sys.stderr)
+            results[f"e2e.c{concurrency}.{label}"] = median_run(
+                factory, repeat, lambda b: bench_end_to_end(b, payload, settings["e2e_tasks"], concurrency)
+            )
+
+    print("  codecs", file=sys.stderr)
+    for task_label, task in codec_bench.SAMPLE_TASKS.items():
+        number = 20_000 if task_label == "small" else 1_000
+        for codec_label, codec in codec_bench.CODECS.items():
+            result = codec_bench.bench_codec(codec, task, number)
+            results[f"codec.{codec_label}.{task_label}"] = {key: value for key, value in result.items() if key != "bytes"}
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=_project_root, stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, threshold):
+    """Print every shared metric with its change; returns the regressions."""
+    regressions = []
+    print(f"{'metric':<40}{'baseline':>12}{'current':>12}{'change':>9}")
+    for case in sorted(set(baseline["results"]) & set(current["results"])):
+        for metric, old in baseline["results"][case].items():
+            new = current["results"][case].get(metric)
+            if new is None or not old:
+                continue
+            change = (new - old) / old
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions.append((case, metric, old, new))
+            print(f"{case + ' ' + metric:<40}{old:>12.2f}{new:>12.2f}{change:>+9.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=("auto", "redis", "memory"), default="auto",
+                        help="auto uses redis if redis-server is on PATH, else memory")
+    parser.add_argument("--redis-server", default="redis-server", help="redis-server executable")
+    parser.add_argument("--quick", action="store_true", help="smaller runs, for a fast sanity check")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare against a saved results file")
+    parser.add_argument("--current", metavar="RESULTS", help="with --compare: compare this saved file instead of running")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown flagged as a regression")
+    args = parser.parse_args(argv)
+
+    if args.current:
+        if not args.compare:
+            parser.error("--current needs --compare")
+        with open(args.current) as f:
+            current = json.load(f)
+    else:
+        kind = args.backend
+        if kind == "auto":
+            kind = "redis" if shutil.which(args.redis_server) else "memory"
+        settings = QUICK if args.quick else FULL
+
+        print(f"running {'quick' if args.quick else 'full'} suite on {kind}", file=sys.stderr)
+        with (redis_server(args.redis_server) if kind == "redis" else contextlib.nullcontext()) as port:
+            results = run_suite(BackendFactory(kind, port), settings)
+
+        current = {
+            "meta": {
+                "backend": kind,
+                "settings": settings,
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            },
+            "results": results,
+        }
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(current, f, indent=2)
+        if not args.compare:
+            json.dump(current, sys.stdout, indent=2)
+            print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("backend") != current["meta"].get("backend"):
+            print("warning: baseline and current ran on different backends", file=sys.stderr)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
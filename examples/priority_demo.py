@@ -35,10 +35,6 @@ demo_log.addHandler(
     RichHandler(console=console, show_path=False, show_time=True, markup=True)
 )
 
-counters = {"completed": 0, "failed": 0}
-counters_lock = threading.Lock()
-
-
 PRIORITY_COLOURS = {"high": "red", "medium": "yellow", "low": "cyan"}
 
 
@@ -61,24 +57,23 @@ def build_stats_table(stats: dict) -> Panel:
         Text("Processing", style="bold magenta"),
         str(stats.get("processing", 0)),
     )
+    table.add_row(
+        Text("Scheduled", style="bold blue"),
+        str(stats.get("scheduled", 0)),
+    )
 
     table.add_row("", "")  
 
-    #  Running totals tracked locally by handlers 
-    with counters_lock:
-        completed = counters["completed"]
-        failed = counters["failed"]
-
-    table.add_row(Text("Completed", style="bold green"),  str(completed))
-    table.add_row(Text("Failed",    style="bold red"),    str(failed))
+    #  Running totals kept by the backend 
+    table.add_row(Text("Completed", style="bold green"),  str(stats.get("completed", 0)))
+    table.add_row(Text("Retried",   style="bold yellow"), str(stats.get("retried", 0)))
+    table.add_row(Text("Failed",    style="bold red"),    str(stats.get("failed", 0)))
 
     return Panel(table, title="[bold]Queue Stats[/bold]", border_style="bright_black")
 
 def simple_handler(*args, **kwargs):
     name = kwargs.get("_name", "unknown")
     time.sleep(1.0)
-    with counters_lock:
-        counters["completed"] += 1
     demo_log.info("[green]✓[/green] %s", name)
 
 
@@ -101,14 +96,8 @@ def make_flaky_handler(backend):
 
         if task.retry_count == 0:
             # Simulate a failure on the first attempt only
-            with counters_lock:
-                counters["failed"] += 1
             raise RuntimeError("simulated failure")
 
-        with counters_lock:
-            counters["completed"] += 1
-            counters["failed"] = max(0, counters["failed"] - 1)
-
         demo_log.info("[green]✓[/green] flaky_task succeeded on retry")
 
     return flaky_handler
@@ -158,7 +147,8 @@ def main():
                 stats = backend.get_stats()
                 live.update(build_stats_table(stats))
 
-                if stats.get("total", 0) == 0 and stats.get("processing", 0) == 0:
+                # flaky_task waits out its retry backoff in the scheduled set
+                if stats.get("total", 0) == 0 and stats.get("processing", 0) == 0 and stats.get("scheduled", 0) == 0:
                     break
 
                 time.sleep(0.25) 
@@ -1,19 +1,51 @@
-from dotenv import load_dotenv
-load_dotenv()
-
-from .task import Task, TaskStatus, Priority
-from .queue import Queue
-from .worker import Worker
-from .storage import storage_backend, RedisBackend
+import importlib
 
 __version__ = "0.1.0"
 
-__all__ = [
-    "Task",
-    "TaskStatus",
-    "Priority",
-    "Queue",
-    "Worker",
-    "storage_backend",
-    "RedisBackend",
-]
+# public name -> module defining it. Nothing is imported until a name is first
+# used, so `import taskqueue` is cheap and has no side effects: no redis
+# import, no connections, no environment loading.
+_EXPORTS = {
+    "Task": ".task",
+    "TaskStatus": ".task",
+    "Priority": ".task",
+    "Queue": ".queue",
+    "BufferedProducer": ".producer",
+    "Worker": ".worker",
+    "AsyncWorker": ".async_worker",
+    "Supervisor": ".supervisor",
+    "Reaper": ".reaper",
+    "WorkerMetrics": ".metrics",
+    "Promoter": ".scheduler",
+    "SchedulingPolicy": ".scheduler",
+    "StrictPolicy": ".scheduler",
+    "WeightedRoundRobinPolicy": ".scheduler",
+    "AgingPolicy": ".scheduler",
+    "storage_backend": ".storage",
+    "async_storage_backend": ".storage",
+    "RedisBackend": ".storage",
+    "AsyncRedisBackend": ".storage",
+    "InMemoryBackend": ".storage",
+    "StreamsBackend": ".storage",
+    "ShardedBackend": ".storage",
+    "get_connection_pool": ".storage",
+    "TaskCodec": ".codec",
+    "JSONCodec": ".codec",
+    "BinaryCodec": ".codec",
+    "CompressedCodec": ".codec",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value # later lookups don't come through here
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,4 @@
+import sys
+from taskqueue.cli import main
+
+sys.exit(main())
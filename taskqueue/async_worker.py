@@ -0,0 +1,203 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import inspect
+import logging
+from taskqueue.scheduler import retry_delay
+from taskqueue.storage.async_redis_backend import AsyncRedisBackend
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncWorker:
+    """Worker that runs handlers on an asyncio event loop.
+
+    `async def` handlers run as coroutines, up to `max_in_flight` at a time
+    in a single thread. Plain functions are still accepted and are offloaded
+    to a thread pool so they don't block the loop.
+
+    Without a `backend`, an `AsyncRedisBackend` is built on a blocking pool
+    sized to `max_in_flight`; it connects on first use.
+    """
+
+    def __init__(self, backend=None, redis_host='localhost', redis_port=6379, redis_db=0, redis_password=None, redis_unix_socket=None, max_in_flight=1000, poll_interval=1.0, claim_batch=100, sync_threads=None, heartbeat_interval=10.0, reap_interval=5.0, reap_batch=100, promote_interval=0.5, promote_batch=500, retry_backoff=1.0, retry_backoff_max=300.0, retry_jitter=True, policy=None):
+        """Initialize the worker."""
+        if backend is not None:
+            self._backend = backend
+        else:
+            # one connection per in-flight task plus the claim and maintenance loops;
+            # past that, callers wait for a free connection instead of opening more
+            self._backend = AsyncRedisBackend(host=redis_host, port=redis_port, db=redis_db, password=redis_password, unix_socket_path=redis_unix_socket, max_connections=max_in_flight + 2)
+
+        self._handlers = {}
+        self._max_in_flight = max_in_flight
+        self._poll_interval = poll_interval # also the blocking claim timeout while idle
+        self._claim_batch = claim_batch # most tasks claimed per round trip
+        self._sync_threads = sync_threads # thread pool size for sync handlers, None = executor default
+        self._heartbeat_interval = heartbeat_interval # extend leases of held tasks this often
+        self._reap_interval = reap_interval # reclaim tasks of dead workers this often, None disables
+        self._reap_batch = reap_batch
+        self._promote_interval = promote_interval # move due delayed tasks this often, None disables
+        self._promote_batch = promote_batch
+        self._retry_backoff = retry_backoff # see Worker
+        self._retry_backoff_max = retry_backoff_max
+        self._retry_jitter = retry_jitter
+        self._policy = policy # SchedulingPolicy for claims, None = strict priority
+        self._executor = None
+        self._claimed = {} # task id -> task, everything this worker holds a lease on
+        self._in_flight = set()
+        self._maintenance = None
+        self._running = False
+
+    def task(self, name=None):
+        def decorator(func):
+            task_name = name or func.__name__
+            self._handlers[task_name] = func
+            return func
+
+        return decorator
+
+    def register(self, name, handler):
+        """Register a task handler (coroutine function or plain function)."""
+        self._handlers[name] = handler
+        logger.debug("Task handler '%s' registered.", name)
+
+    async def _call_handler(self, handler, task):
+        if inspect.iscoroutinefunction(handler):
+            return await handler(*task.args, **task.kwargs)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(handler, *task.args, **task.kwargs))
+
+    async def _run_task(self, task):
+        try:
+            await self._process_task(task)
+        finally:
+            self._claimed.pop(task.id, None)
+
+    async def _process_task(self, task):
+        """Process one claimed task; mirrors `Worker._process_task`."""
+        handler = self._handlers.get(task.name)
+        if not handler:
+            logger.error("No handlers for task '%s'. Moving on", task.name)
+            await self._backend.mark_failed(task, error=f"no handler registered for '{task.name}'")
+            return
+
+        try:
+            logger.debug("Processing task (%s)", task.name)
+            result = await self._call_handler(handler, task)
+            await self._backend.mark_completed(task, result=result)
+
+        except Exception as e:
+            logger.error("Task (%s) failed. Error: %s", task.name, e)
+            try:
+                if task.can_retry:
+                    task.increment_retry()
+                    delay = retry_delay(task.retry_count, self._retry_backoff, self._retry_backoff_max, self._retry_jitter)
+                    await self._backend.requeue(task, delay=delay)
+                else:
+                    logger.warning("Max retries reached for task (%s)", task.name)
+                    await self._backend.mark_failed(task, error=f"{type(e).__name__}: {e}")
+            except Exception as e:
+                logger.error("Failed to record failure for task (%s): %s", task.name, e)
+
+    async def _claim_loop(self):
+        while self._running:
+            if len(self._in_flight) >= self._max_in_flight:
+                await asyncio.wait(self._in_flight, return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            count = min(self._claim_batch, self._max_in_flight - len(self._in_flight))
+            try:
+                tasks = await self._backend.claim_many(count, timeout=self._poll_interval, policy=self._policy)
+            except Exception as e:
+                logger.error("Error found in worker loop: %s", e)
+                await asyncio.sleep(self._poll_interval)
+                continue
+
+            for task in tasks:
+                self._claimed[task.id] = task
+                running = asyncio.create_task(self._run_task(task))
+                self._in_flight.add(running)
+                running.add_done_callback(self._in_flight.discard)
+
+    async def _maintenance_loop(self):
+        """Heartbeat, reap and promote delayed tasks, like `Worker`.
+
+        Keeps going while in-flight tasks drain; cancelled by _shutdown.
+        """
+        loop = asyncio.get_running_loop()
+        next_heartbeat = next_reap = next_promote = loop.time()
+        while True:
+            now = loop.time()
+            try:
+                if self._heartbeat_interval and now >= next_heartbeat:
+                    next_heartbeat = now + self._heartbeat_interval
+                    await self._backend.extend_lease(list(self._claimed.values()))
+
+                if self._reap_interval and now >= next_reap:
+                    next_reap = now + self._reap_interval
+                    while await self._backend.reap_expired(self._reap_batch) >= self._reap_batch:
+                        pass
+
+                if self._promote_interval and now >= next_promote:
+                    next_promote = now + self._promote_interval
+                    while await self._backend.promote_due(self._promote_batch) >= self._promote_batch:
+                        pass
+            except Exception as e:
+                logger.error("Error found in maintenance loop: %s", e)
+
+            intervals = [i for i in (self._heartbeat_interval, self._reap_interval, self._promote_interval) if i]
+            await asyncio.sleep(min(intervals))
+
+    async def run_async(self):
+        if self._running:
+            logger.warning("Worker is already running.")
+            return
+
+        self._running = True
+        self._executor = ThreadPoolExecutor(max_workers=self._sync_threads)
+
+        logger.info("Async worker started with max in flight: %s", self._max_in_flight)
+        logger.info("Registered task handlers : %s", list(self._handlers.keys()))
+
+        if self._heartbeat_interval or self._reap_interval or self._promote_interval:
+            self._maintenance = asyncio.create_task(self._maintenance_loop())
+
+        try:
+            await self._claim_loop()
+        finally:
+            await self._shutdown()
+
+    def run(self):
+        """Run the worker on a new event loop until stopped."""
+        try:
+            asyncio.run(self.run_async())
+        except KeyboardInterrupt:
+            logger.info("Shuting down")
+
+    def stop(self):
+        """Ask the claim loop to exit; in-flight tasks are allowed to finish."""
+        self._running = False
+
+    async def _shutdown(self):
+        logger.info("Shutting worker down")
+        self._running = False
+
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+        if self._maintenance:
+            self._maintenance.cancel()
+            self._maintenance = None
+
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+        try:
+            await self._backend.close()
+        except Exception:
+            pass
+
+        logger.info("Worker shutdown complete")
@@ -0,0 +1,56 @@
+"""Command line entry point.
+
+    python -m taskqueue worker app.tasks:worker --processes 4 --concurrency 8
+
+imports `app.tasks` once, then runs its `worker` in 4 supervised, forked
+processes of 8 handler threads each (see `Supervisor`).
+"""
+import argparse
+import importlib
+import logging
+from taskqueue.supervisor import Supervisor
+
+
+def load_worker(target):
+    """Import "module:attribute" and return the worker it names.
+
+    The attribute may be dotted, and may be a function returning the worker.
+    """
+    module_name, _, attribute = target.partition(':')
+    if not module_name or not attribute:
+        raise ValueError(f"expected 'module:attribute', got {target!r}")
+    obj = importlib.import_module(module_name)
+    for part in attribute.split('.'):
+        obj = getattr(obj, part)
+    if not hasattr(obj, 'run') and callable(obj):
+        obj = obj()
+    if not (hasattr(obj, 'run') and hasattr(obj, 'stop')):
+        raise ValueError(f"{target} is not a Worker or AsyncWorker")
+    return obj
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m taskqueue", description="Task queue tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    worker_parser = commands.add_parser("worker", help="run a worker in supervised processes")
+    worker_parser.add_argument("target", help="module:attribute of a Worker or AsyncWorker, or of a function returning one")
+    worker_parser.add_argument("-p", "--processes", type=int, default=1, help="worker processes to fork (default 1)")
+    worker_parser.add_argument("-c", "--concurrency", type=int, help="tasks run at once per process (Worker only; default: as built)")
+    worker_parser.add_argument("--shutdown-timeout", type=float, default=30.0, help="seconds to let running tasks finish on SIGTERM")
+    worker_parser.add_argument("--log-level", default="INFO", help="logging level (default INFO)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s")
+    try:
+        worker = load_worker(args.target)
+    except (ImportError, AttributeError, ValueError) as e:
+        worker_parser.error(f"cannot load {args.target}: {e}")
+
+    if args.concurrency is not None:
+        if not hasattr(worker, 'set_concurrency'):
+            worker_parser.error("--concurrency needs a Worker; size an AsyncWorker with max_in_flight")
+        worker.set_concurrency(args.concurrency)
+
+    Supervisor(worker, processes=args.processes, shutdown_timeout=args.shutdown_timeout).run()
+    return 0
@@ -0,0 +1,216 @@
+from abc import ABC, abstractmethod
+import json
+import struct
+import zlib
+
+try:
+    import msgpack
+except ImportError: # optional, only used to make BinaryCodec payloads smaller/faster
+    msgpack = None
+
+try:
+    import lz4.frame
+except ImportError: # optional, faster (de)compression for CompressedCodec
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError: # optional, better ratio than zlib at similar speed
+    zstandard = None
+
+
+class TaskCodec(ABC):
+    """Encodes the immutable parts of a task for storage.
+
+    A task is stored as two blobs: `data` (id, name, priority, created_at,
+    max_retries) and `payload` (args and kwargs). Every codec marks its blobs
+    with a leading format byte so `get_codec()` can pick the right decoder for
+    any stored record, whichever codec wrote it.
+    """
+
+    format_byte = None
+
+    @abstractmethod
+    def encode_data(self, task) -> bytes:
+        pass
+
+    @abstractmethod
+    def decode_data(self, raw) -> dict:
+        """Return the fields of `data` as `Task` keyword arguments.
+
+        `created_at` may come back as epoch seconds or, for old records, an
+        ISO string; `Task` normalises either.
+        """
+        pass
+
+    @abstractmethod
+    def encode_payload(self, args, kwargs) -> bytes:
+        pass
+
+    @abstractmethod
+    def decode_payload(self, raw):
+        """Return an `(args, kwargs)` tuple."""
+        pass
+
+
+class JSONCodec(TaskCodec):
+    """Plain JSON documents, readable with redis-cli. The default."""
+
+    format_byte = ord('{') # every JSON blob here is an object
+
+    def encode_data(self, task):
+        data = {
+            'id': task.id,
+            'name': task.name,
+            'priority': task.priority,
+            'created_at': task.created_at,
+            'max_retries': task.max_retries,
+        }
+        return json.dumps(data).encode()
+
+    def decode_data(self, raw):
+        return json.loads(raw)
+
+    def encode_payload(self, args, kwargs):
+        return json.dumps({'args': args, 'kwargs': kwargs}).encode()
+
+    def decode_payload(self, raw):
+        payload = json.loads(raw)
+        return tuple(payload['args']), payload['kwargs']
+
+
+class BinaryCodec(TaskCodec):
+    """Compact struct-packed header plus msgpack (or compact JSON) payload.
+
+    Decoding `data` only unpacks the fixed header and two short strings;
+    the payload stays raw until a caller touches `Task.args`/`Task.kwargs`.
+
+    data:    version | priority int64 | max_retries uint32 | created_at float64
+             | name length uint16 | id length uint16 | name | id
+    payload: version | body format | body
+    """
+
+    format_byte = 0x01 # version 1
+    HEADER = struct.Struct('<BqIdHH')
+    PAYLOAD_HEADER = struct.Struct('<BB')
+    BODY_JSON = 0
+    BODY_MSGPACK = 1
+
+    def encode_data(self, task):
+        name = task.name.encode()
+        task_id = task.id.encode()
+        header = self.HEADER.pack(
+            self.format_byte,
+            task.priority,
+            task.max_retries,
+            task.created_at,
+            len(name),
+            len(task_id),
+        )
+        return header + name + task_id
+
+    def decode_data(self, raw):
+        _, priority, max_retries, created_at, name_len, id_len = self.HEADER.unpack_from(raw)
+        offset = self.HEADER.size
+        name = bytes(raw[offset:offset + name_len]).decode()
+        offset += name_len
+        task_id = bytes(raw[offset:offset + id_len]).decode()
+        return {
+            'id': task_id,
+            'name': name,
+            'priority': priority,
+            'created_at': created_at,
+            'max_retries': max_retries,
+        }
+
+    def encode_payload(self, args, kwargs):
+        if msgpack is not None:
+            body = msgpack.packb([list(args), kwargs], use_bin_type=True)
+            return self.PAYLOAD_HEADER.pack(self.format_byte, self.BODY_MSGPACK) + body
+
+        body = json.dumps([args, kwargs], separators=(',', ':')).encode()
+        return self.PAYLOAD_HEADER.pack(self.format_byte, self.BODY_JSON) + body
+
+    def decode_payload(self, raw):
+        _, body_format = self.PAYLOAD_HEADER.unpack_from(raw)
+        body = raw[self.PAYLOAD_HEADER.size:]
+
+        if body_format == self.BODY_MSGPACK:
+            if msgpack is None:
+                raise ValueError("task payload was written with msgpack, which is not installed")
+            args, kwargs = msgpack.unpackb(body, raw=False)
+        else:
+            args, kwargs = json.loads(body)
+        return tuple(args), kwargs
+
+
+# algorithm -> (id byte, compress, decompress), for the libraries installed
+_COMPRESSORS = {'zlib': (0, zlib.compress, zlib.decompress)}
+if lz4 is not None:
+    _COMPRESSORS['lz4'] = (1, lz4.frame.compress, lz4.frame.decompress)
+if zstandard is not None:
+    _COMPRESSORS['zstd'] = (2, zstandard.compress, zstandard.decompress)
+
+
+class CompressedCodec(TaskCodec):
+    """Wraps another codec and compresses payloads of at least `min_size` bytes.
+
+    `algorithm` is 'zlib', 'lz4', 'zstd' (the last two if installed) or
+    'auto' for the best one available. Payloads that don't shrink are kept
+    as the wrapped codec wrote them. `data` is never compressed, so status
+    reads stay cheap.
+
+    compressed payload: format byte | algorithm | compressed inner payload
+    """
+
+    format_byte = 0x02
+    HEADER = struct.Struct('<BB')
+
+    def __init__(self, codec=None, algorithm='auto', min_size=1024):
+        if algorithm == 'auto':
+            algorithm = next(name for name in ('zstd', 'lz4', 'zlib') if name in _COMPRESSORS)
+        if algorithm not in _COMPRESSORS:
+            raise ValueError(f"compression {algorithm!r} is not available (have {sorted(_COMPRESSORS)})")
+        self.codec = codec or JSONCodec()
+        self.algorithm = algorithm
+        self.min_size = min_size
+        self._algorithm_id, self._compress, _ = _COMPRESSORS[algorithm]
+
+    def encode_data(self, task):
+        return self.codec.encode_data(task)
+
+    def decode_data(self, raw):
+        return get_codec(raw).decode_data(raw)
+
+    def encode_payload(self, args, kwargs):
+        return self.compress(self.codec.encode_payload(args, kwargs))
+
+    def compress(self, raw):
+        """Compress an already encoded payload, if it is big enough and it helps."""
+        if len(raw) < self.min_size:
+            return raw
+        compressed = self.HEADER.pack(self.format_byte, self._algorithm_id) + self._compress(bytes(raw))
+        return compressed if len(compressed) < len(raw) else raw
+
+    def decode_payload(self, raw):
+        _, algorithm_id = self.HEADER.unpack_from(raw)
+        for known_id, _, decompress in _COMPRESSORS.values():
+            if known_id == algorithm_id:
+                inner = decompress(bytes(raw[self.HEADER.size:]))
+                return get_codec(inner).decode_payload(inner)
+        name = {1: 'lz4', 2: 'zstd'}.get(algorithm_id, algorithm_id)
+        raise ValueError(f"task payload was compressed with {name}, which is not installed")
+
+
+_CODECS = {codec.format_byte: codec for codec in (JSONCodec(), BinaryCodec(), CompressedCodec(algorithm='zlib'))}
+
+
+def get_codec(raw) -> TaskCodec:
+    """Return the codec that wrote `raw`, based on its leading format byte."""
+    if not raw:
+        raise ValueError("cannot decode an empty task blob")
+    first = raw[0] if isinstance(raw, (bytes, bytearray)) else ord(raw[0])
+    try:
+        return _CODECS[first]
+    except KeyError:
+        raise ValueError(f"unknown task codec format byte: {first:#x}")
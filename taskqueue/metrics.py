@@ -0,0 +1,134 @@
+from bisect import bisect_left
+import threading
+
+# Upper bounds in seconds, doubling from 0.5ms to about a minute.
+DEFAULT_BUCKETS = tuple(0.0005 * 2 ** i for i in range(18))
+
+
+class Histogram:
+    """Fixed-bucket histogram; recording a value is one bisect and two adds.
+
+    Not thread-safe on its own; `WorkerMetrics` serialises access.
+    """
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # the last slot holds values above every bound
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (the max for the overflow bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+        }
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class WorkerMetrics:
+    """Counters and latency histograms collected by a `Worker`.
+
+    Per task name: `queue_wait` (claim time minus `created_at`), `run`
+    (handler time) and `end_to_end` (finish time minus `created_at`). Per
+    backend operation: round-trip time. Plus plain counters such as claims
+    and empty polls. Read them with `snapshot()` or `prometheus()`.
+    """
+
+    TASK_HISTOGRAMS = ('queue_wait', 'run', 'end_to_end')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self._tasks = {} # task name -> {histogram name -> Histogram}
+        self._backend = {} # operation -> Histogram
+        self._counters = {}
+
+    def incr(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    def observe_task(self, task_name, histogram, seconds):
+        with self._lock:
+            histograms = self._tasks.get(task_name)
+            if histograms is None:
+                histograms = self._tasks[task_name] = {name: Histogram(self._buckets) for name in self.TASK_HISTOGRAMS}
+            histograms[histogram].observe(seconds)
+
+    def observe_backend(self, operation, seconds):
+        with self._lock:
+            histogram = self._backend.get(operation)
+            if histogram is None:
+                histogram = self._backend[operation] = Histogram(self._buckets)
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        """Plain dict of everything recorded so far (seconds for times)."""
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'tasks': {
+                    name: {metric: histogram.snapshot() for metric, histogram in histograms.items()}
+                    for name, histograms in self._tasks.items()
+                },
+                'backend': {operation: histogram.snapshot() for operation, histogram in self._backend.items()},
+            }
+
+    def prometheus(self, prefix='taskqueue'):
+        """Everything recorded so far in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for counter, value in sorted(self._counters.items()):
+                name = f"{prefix}_worker_{counter}_total"
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name} {value}")
+
+            for metric in self.TASK_HISTOGRAMS:
+                name = f"{prefix}_task_{metric}_seconds"
+                lines.append(f"# TYPE {name} histogram")
+                for task_name, histograms in sorted(self._tasks.items()):
+                    self._histogram_lines(lines, name, f'task="{_escape(task_name)}"', histograms[metric])
+
+            name = f"{prefix}_backend_call_seconds"
+            lines.append(f"# TYPE {name} histogram")
+            for operation, histogram in sorted(self._backend.items()):
+                self._histogram_lines(lines, name, f'operation="{_escape(operation)}"', histogram)
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _histogram_lines(lines, name, labels, histogram):
+        cumulative = 0
+        for bound, count in zip(histogram.bounds, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+        lines.append(f"{name}_count{{{labels}}} {histogram.count}")
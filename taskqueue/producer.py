@@ -0,0 +1,243 @@
+from collections import deque
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from taskqueue.task import Task
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedProducer:
+    """Buffers pushes and writes them to the backend from a background thread.
+
+    `put` only appends to an in-memory buffer, so callers never wait on the
+    network. The flusher thread ships the buffer with `push_many` (one
+    pipeline on Redis) once `flush_size` tasks are waiting or the oldest has
+    waited `flush_interval` seconds. At most `max_buffered` tasks are held;
+    beyond that `put` blocks until the flusher catches up, raising
+    `TimeoutError` after `put_timeout` seconds if one is set.
+
+    If the backend is unreachable, batches stay buffered and are retried
+    every `retry_interval` seconds. With `spill_path`, they are appended to
+    that file (JSON lines, so task arguments must be JSON-serialisable)
+    instead, which frees the buffer; until the next retry, new batches go
+    straight to the file without waiting on the backend. Spilled tasks are
+    pushed again once the backend is back, including by a later process
+    using the same path.
+    Delivery is at-least-once: a batch whose reply was lost is sent again.
+
+    Used by `Queue(buffered=True)`; `Queue.flush()`/`close()` wrap `flush`
+    and `close`, and leaving a `with Queue(...)` block closes it.
+    """
+
+    def __init__(self, backend, flush_size=500, flush_interval=0.05, max_buffered=10000, put_timeout=None, spill_path=None, retry_interval=1.0):
+        if flush_size < 1 or max_buffered < flush_size:
+            raise ValueError("need 1 <= flush_size <= max_buffered")
+        self._backend = backend
+        self._flush_size = flush_size
+        self._flush_interval = flush_interval
+        self._max_buffered = max_buffered
+        self._put_timeout = put_timeout
+        self._spill_path = spill_path
+        self._retry_interval = retry_interval
+        self._pending = deque() # (task, eta, dedup_ttl, buffered at)
+        self._in_flight = 0 # tasks the flusher took but hasn't written yet
+        self._cond = threading.Condition() # guards the above; notified on every change
+        self._spill_lock = threading.Lock()
+        self._spilled = bool(spill_path) and os.path.exists(spill_path) and os.path.getsize(spill_path) > 0
+        self._retry_at = 0.0 # monotonic time before which the flusher doesn't retry
+        self._spill_failing = False # last spill failed, so don't count on the file until the retry
+        self._flush_requested = False
+        self._closed = False
+        self._stopping = False # flusher exits without writing what is left
+        self._thread = None
+
+    def put(self, task, eta=None, dedup_ttl=None):
+        """Buffer `task` for a later `push` (see `storage_backend.push` for the arguments)."""
+        deadline = None if self._put_timeout is None else time.monotonic() + self._put_timeout
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("producer is closed")
+            while len(self._pending) + self._in_flight >= self._max_buffered:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"producer buffer is full ({self._max_buffered} tasks)")
+                self._cond.wait(remaining)
+
+            self._pending.append((task, eta, dedup_ttl, time.monotonic()))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="taskqueue-producer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+            if len(self._pending) >= self._flush_size:
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until everything buffered so far is written (or spilled); False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self._flush_requested = False
+            return True
+
+    def close(self, timeout=30.0):
+        """Flush, then stop the flusher.
+
+        Tasks still buffered after `timeout` seconds are spilled if there is
+        a spill file, and dropped with an error log otherwise.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+        atexit.unregister(self.close)
+
+        self.flush(timeout)
+        with self._cond:
+            left = [(task, eta, dedup_ttl) for task, eta, dedup_ttl, _ in self._pending]
+            self._pending.clear()
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(self._retry_interval)
+
+        if left and not (self._spill_path and self._spill(left)):
+            logger.error("Dropping %s buffered tasks that could not be written", len(left))
+
+    @property
+    def buffered(self):
+        """Tasks not yet written, including the batch being written."""
+        with self._cond:
+            return len(self._pending) + self._in_flight
+
+    def _take_batch(self):
+        """Block until a batch is due; returns (batch, spill only).
+
+        A batch of [] means "retry the spill file", None means "stop". While
+        the backend is down, batches are due at once for the spill file.
+        """
+        with self._cond:
+            while not self._stopping:
+                now = time.monotonic()
+                backend_due = now >= self._retry_at
+                spill_only = not backend_due and bool(self._spill_path) and not self._spill_failing
+                wait = None
+                if self._pending and (backend_due or spill_only):
+                    age = now - self._pending[0][3]
+                    if len(self._pending) >= self._flush_size or self._flush_requested or self._closed or age >= self._flush_interval:
+                        batch = [self._pending.popleft()[:3] for _ in range(min(self._flush_size, len(self._pending)))]
+                        self._in_flight = len(batch)
+                        return batch, spill_only
+                    wait = self._flush_interval - age
+                elif self._spilled and backend_due:
+                    return [], False
+                elif self._pending or self._spilled:
+                    wait = self._retry_at - now
+                self._cond.wait(wait)
+            return None, False
+
+    def _run(self):
+        while True:
+            batch, spill_only = self._take_batch()
+            if batch is None:
+                return
+
+            failed = False
+            if spill_only:
+                # the backend is down until the next retry: free the buffer without asking it
+                unwritten = [] if self._spill(batch) else batch
+            else:
+                unwritten = self._write(batch) if batch else []
+                failed = bool(unwritten)
+                if failed and self._spill_path and self._spill(unwritten):
+                    unwritten = []
+                if not failed and self._spilled:
+                    # the backend answers again: time to send what was spilled
+                    failed = not self._replay_spill()
+            with self._cond:
+                # unwritten tasks go back to the front, in order, for the next attempt
+                for task, eta, dedup_ttl in reversed(unwritten):
+                    self._pending.appendleft((task, eta, dedup_ttl, time.monotonic()))
+                if failed:
+                    self._retry_at = time.monotonic() + self._retry_interval
+                self._in_flight = 0
+                self._cond.notify_all()
+
+    def _write(self, batch):
+        """Push `batch`, one push_many per (eta, dedup_ttl); returns what could not be written."""
+        groups = {}
+        for task, eta, dedup_ttl in batch:
+            groups.setdefault((eta, dedup_ttl), []).append(task)
+
+        written = set()
+        try:
+            for (eta, dedup_ttl), tasks in groups.items():
+                self._backend.push_many(tasks, eta=eta, dedup_ttl=dedup_ttl)
+                written.add((eta, dedup_ttl))
+        except Exception as e:
+            logger.error("Failed to write %s buffered tasks: %s", len(batch), e)
+            return [item for item in batch if (item[1], item[2]) not in written]
+        return []
+
+    def _spill(self, items):
+        try:
+            with self._spill_lock, open(self._spill_path, 'a') as f:
+                for task, eta, dedup_ttl in items:
+                    record = json.loads(task.to_json())
+                    record['dedup_key'] = task.dedup_key
+                    f.write(json.dumps({'task': record, 'eta': eta, 'dedup_ttl': dedup_ttl}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except (OSError, TypeError, ValueError) as e:
+            logger.error("Failed to spill %s tasks to %s: %s", len(items), self._spill_path, e)
+            self._spill_failing = True
+            return False
+        self._spill_failing = False
+        self._spilled = True
+        logger.warning("Spilled %s tasks to %s", len(items), self._spill_path)
+        return True
+
+    def _replay_spill(self):
+        """Push spilled tasks; whatever fails stays in the file for the next try.
+
+        Returns True once the file is empty.
+        """
+        with self._spill_lock:
+            try:
+                with open(self._spill_path) as f:
+                    lines = [line for line in f if line.strip()]
+            except FileNotFoundError:
+                self._spilled = False
+                return True
+
+            sent = 0
+            try:
+                while sent < len(lines):
+                    chunk = [json.loads(line) for line in lines[sent:sent + self._flush_size]]
+                    unwritten = self._write([(Task(**record['task']), record['eta'], record['dedup_ttl']) for record in chunk])
+                    if unwritten:
+                        break
+                    sent += len(chunk)
+            finally:
+                # rewrite the file with what is left, atomically
+                tmp_path = f"{self._spill_path}.tmp"
+                with open(tmp_path, 'w') as f:
+                    f.writelines(lines[sent:])
+                os.replace(tmp_path, self._spill_path)
+
+            if sent:
+                logger.info("Replayed %s spilled tasks from %s", sent, self._spill_path)
+            if sent == len(lines):
+                os.remove(self._spill_path)
+                self._spilled = False
+                return True
+            return False
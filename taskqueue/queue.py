@@ -1,44 +1,152 @@
-from taskqueue.task import Task, Priority
+from taskqueue.task import Task, TaskStatus, Priority, _to_epoch
 from taskqueue.storage.redis_backend import RedisBackend
-from typing import Union, Optional
+from taskqueue.producer import BufferedProducer
+from datetime import datetime
+from itertools import islice
+import time
+from typing import Iterable, List, Union, Optional
 
 class Queue:
-    def __init__(self, backend=None, redis_host='localhost', redis_port=6379, redis_db=0, redis_password=None):
-        """Initialize the queue."""
+    def __init__(self, backend=None, redis_host='localhost', redis_port=6379, redis_db=0, redis_password=None, async_backend=None, redis_unix_socket=None, buffered=False, flush_size=500, flush_interval=0.05, max_buffered=10000, put_timeout=None, spill_path=None):
+        """Initialize the queue.
+
+        Queues built with the same Redis settings share one connection pool
+        (see `get_connection_pool`), and nothing connects until first use.
+
+        With `buffered=True`, `enqueue` returns as soon as the task is
+        buffered and a background thread writes batches of up to
+        `flush_size` tasks at least every `flush_interval` seconds; see
+        `BufferedProducer` for `max_buffered`, `put_timeout` and
+        `spill_path`. Call `flush()` to wait for the writes, or `close()`
+        (or leave the `with` block) when done.
+        """
         if backend is not None:
                 self._backend = backend
         else:
-            self._backend = RedisBackend(host = redis_host, port = redis_port, db = redis_db, password = redis_password)
-                    
+            self._backend = RedisBackend(host = redis_host, port = redis_port, db = redis_db, password = redis_password, unix_socket_path = redis_unix_socket)
+
+        # only created when enqueue_async is first used
+        self._async_backend = async_backend
+        self._redis_settings = dict(host=redis_host, port=redis_port, db=redis_db, password=redis_password, unix_socket_path=redis_unix_socket)
 
-    def enqueue(self, task_name, *args, priority: Union[str,int] = "medium", max_retries: int = 3, **kwargs):
+        self._producer = None
+        if buffered:
+            self._producer = BufferedProducer(
+                self._backend, flush_size=flush_size, flush_interval=flush_interval,
+                max_buffered=max_buffered, put_timeout=put_timeout, spill_path=spill_path,
+            )
+                    
 
+    @staticmethod
+    def _resolve_priority(priority):
         if isinstance(priority, str): # checks if priority is of type string
             priority_lower = priority.lower()
 
             if priority_lower == "low":
-                priority = Priority.Low
+                return Priority.Low
 
             elif priority_lower == "medium":
-                priority = Priority.Medium
+                return Priority.Medium
             
             elif priority_lower == "high":
-                priority = Priority.High
+                return Priority.High
             
             else:
                 #default to medium
-                priority = Priority.Medium
-    
+                return Priority.Medium
+        return priority
+
+    @staticmethod
+    def _resolve_eta(eta, countdown):
+        # eta: datetime or epoch seconds; countdown: seconds from now
+        if eta is not None and countdown is not None:
+            raise ValueError("pass either eta or countdown, not both")
+        if countdown is not None:
+            return time.time() + countdown
+        if eta is not None:
+            return _to_epoch(eta)
+        return None
+
+    def enqueue(self, task_name, *args, priority: Union[str,int] = "medium", max_retries: int = 3, eta: Optional[Union[datetime, float]] = None, countdown: Optional[float] = None, dedup_key: Optional[str] = None, dedup_ttl: Optional[float] = None, **kwargs):
+        """Enqueue a task; with `eta` or `countdown` it only becomes available once due.
+
+        With `dedup_key`, nothing is pushed while another task with the same
+        key is queued, scheduled or running (for at most `dedup_ttl`
+        seconds); the returned task then carries that task's id (in buffered
+        mode, only once it has been flushed).
+        """
         task = Task(
             name = task_name,
             args = args,
             kwargs=kwargs,
-            priority=priority,
-            max_retries=max_retries
+            priority=self._resolve_priority(priority),
+            max_retries=max_retries,
+            dedup_key=dedup_key
         )
 
-        self._backend.push(task) #private attribute
+        if self._producer is not None:
+            self._producer.put(task, eta=self._resolve_eta(eta, countdown), dedup_ttl=dedup_ttl)
+        else:
+            self._backend.push(task, eta=self._resolve_eta(eta, countdown), dedup_ttl=dedup_ttl) #private attribute
         return task # to look it up later if needed
+
+    async def enqueue_async(self, task_name, *args, priority: Union[str,int] = "medium", max_retries: int = 3, eta: Optional[Union[datetime, float]] = None, countdown: Optional[float] = None, dedup_key: Optional[str] = None, dedup_ttl: Optional[float] = None, **kwargs):
+        """Same as `enqueue`, without blocking the event loop (for async web services)."""
+        if self._async_backend is None:
+            from taskqueue.storage.async_redis_backend import AsyncRedisBackend
+            self._async_backend = AsyncRedisBackend(**self._redis_settings)
+
+        task = Task(
+            name = task_name,
+            args = args,
+            kwargs=kwargs,
+            priority=self._resolve_priority(priority),
+            max_retries=max_retries,
+            dedup_key=dedup_key
+        )
+
+        await self._async_backend.push(task, eta=self._resolve_eta(eta, countdown), dedup_ttl=dedup_ttl)
+        return task
+
+    def _task_from_spec(self, spec):
+        """Build a Task from a dict spec or a (name, args, kwargs) tuple."""
+        if isinstance(spec, dict):
+            return Task(
+                name=spec["name"],
+                args=tuple(spec.get("args", ())),
+                kwargs=spec.get("kwargs", {}),
+                priority=self._resolve_priority(spec.get("priority", "medium")),
+                max_retries=spec.get("max_retries", 3),
+                dedup_key=spec.get("dedup_key"),
+            )
+
+        spec = tuple(spec)
+        args = spec[1] if len(spec) > 1 else () # args/kwargs are optional
+        kwargs = spec[2] if len(spec) > 2 else {}
+        return Task(name=spec[0], args=tuple(args), kwargs=kwargs, priority=Priority.Medium)
+
+    def enqueue_many(self, specs: Iterable, chunk_size: int = 1000, dedup_ttl: Optional[float] = None) -> List[str]:
+        """Enqueue many tasks, writing them to the backend in chunks.
+
+        `specs` may be any iterable (including a generator) of dicts with a
+        `name` key and optional `args`, `kwargs`, `priority`, `max_retries`
+        and `dedup_key`, or `(name, args, kwargs)` tuples. Only one chunk is
+        held in memory at a time. Returns the ids of the enqueued tasks in
+        input order; a deduplicated spec gets the id of the task it matched,
+        whether that was queued earlier or earlier in the same chunk.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+
+        task_ids = []
+        tasks = (self._task_from_spec(spec) for spec in specs)
+        while True:
+            chunk = list(islice(tasks, chunk_size))
+            if not chunk:
+                break
+            self._backend.push_many(chunk, dedup_ttl=dedup_ttl)
+            task_ids.extend(task.id for task in chunk)
+        return task_ids
     
     def get_length(self, priority = None): # Allows for all or specific priority queues
         """Get the number of tasks in the queue."""
@@ -50,6 +158,19 @@ class Queue:
         """Retrieve a task by its ID."""
         return self._backend.get_task(task_id)
     
+    def get_result(self, task_id, timeout: Optional[float] = None):
+        """Wait for a task to finish and return its handler's return value.
+
+        Raises `TimeoutError` if it doesn't finish within `timeout` seconds
+        (or its record already expired) and `RuntimeError` if it failed.
+        """
+        task = self._backend.wait_for_result(task_id, timeout)
+        if task is None:
+            raise TimeoutError(f"task {task_id} did not finish within {timeout} seconds")
+        if task.status == TaskStatus.FAILED:
+            raise RuntimeError(f"task {task_id} failed: {task.error}")
+        return task.result
+
     def get_stats(self):
         """Get statistics about the queue."""
         return self._backend.get_stats()
@@ -58,11 +179,31 @@ class Queue:
         """Clear all tasks from the queue."""
         self._backend.clear()
 
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """In buffered mode, wait until every buffered task is written; False on timeout."""
+        if self._producer is None:
+            return True
+        return self._producer.flush(timeout)
+
+    def close(self):
+        """Write out buffered tasks, then close the backend."""
+        if self._producer is not None:
+            self._producer.close()
+        self._backend.close()
+
     def __enter__(self):
         return self # returns object to be used in with statement
     
     def __exit__(self, exc_type, exc_value, traceback): # parameters define the exception type, value and traceback
-        self._backend.close() # ensures backend connection is closed
+        self.close() # flushes buffered tasks and closes the backend connection
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self._async_backend is not None:
+            await self._async_backend.close()
+        self.close()
 
 
 
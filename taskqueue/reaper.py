@@ -0,0 +1,48 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Reaper:
+    """Reclaims tasks whose worker stopped renewing their lease.
+
+    Each pass asks the backend for expired leases in batches of `batch_size`
+    and sends them back through the retry logic: requeued while retries
+    remain, marked failed after that. Runs inside `Worker` by default, or
+    standalone:
+
+        reaper = Reaper(RedisBackend())
+        reaper.run() # until reaper.stop()
+    """
+
+    def __init__(self, backend, interval=5.0, batch_size=100):
+        self._backend = backend
+        self._interval = interval
+        self._batch_size = batch_size
+        self._stopped = threading.Event()
+
+    def run_once(self):
+        """Reap until no expired leases are left; returns how many were reclaimed."""
+        total = 0
+        while True:
+            reaped = self._backend.reap_expired(self._batch_size)
+            total += reaped
+            if reaped < self._batch_size:
+                break
+
+        if total:
+            logger.warning("Reclaimed %s tasks with expired leases", total)
+        return total
+
+    def run(self):
+        self._stopped.clear()
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("Error found in reaper: %s", e)
+            self._stopped.wait(self._interval)
+
+    def stop(self):
+        self._stopped.set()
@@ -1,13 +1,169 @@
-from .task import Task, Priority
+from abc import ABC, abstractmethod
+import logging
+import random
+import threading
+from .task import Task, Priority, DEFAULT_PRIORITIES
+
+logger = logging.getLogger(__name__)
+
+
+def retry_delay(retry_count, base=1.0, maximum=300.0, jitter=True):
+    """Seconds to wait before retry number `retry_count` (1 for the first retry).
+
+    Doubles from `base` up to `maximum`. With `jitter`, the delay is drawn
+    from the upper half of that range so tasks that failed together (say, on
+    the same outage) don't all come back at the same instant.
+    """
+    if not base:
+        return 0.0
+    delay = min(maximum, base * 2 ** max(retry_count - 1, 0))
+    if jitter:
+        delay = random.uniform(delay / 2, delay)
+    return delay
+
+
+class SchedulingPolicy(ABC):
+    """Decides which priority levels a claim takes its tasks from.
+
+    `plan()` returns `(level, quota)` pairs, highest priority first. A claim
+    takes up to `quota` tasks from each level in turn, then tops up to its
+    count from the levels in the same order, so capacity is never left idle
+    while any level has work. Policies with `age_step` set also let tasks
+    that waited long enough jump ahead; backends apply that where they can
+    see the queue heads (inside the claim script for Redis).
+    """
+
+    age_step = None # seconds of waiting worth one priority level
+
+    @abstractmethod
+    def plan(self, levels, count):
+        """Quotas for a claim of `count` tasks over the sorted `levels`."""
+        pass
+
+
+class StrictPolicy(SchedulingPolicy):
+    """Always drain higher priorities first. The default."""
+
+    def plan(self, levels, count):
+        return [(level, count) for level in levels]
+
+
+class WeightedRoundRobinPolicy(SchedulingPolicy):
+    """Share claims between levels in proportion to `weights`.
+
+    With the default weights, busy High/Medium/Low queues get 4:2:1 of the
+    claims, so low priority work keeps moving under sustained high priority
+    load. Levels missing from `weights` get weight 1. Uses smooth weighted
+    round-robin, so the levels interleave instead of arriving in bursts.
+    """
+
+    def __init__(self, weights=None):
+        self.weights = dict(weights or {Priority.High: 4, Priority.Medium: 2, Priority.Low: 1})
+        if any(weight < 1 for weight in self.weights.values()):
+            raise ValueError("weights must be positive integers")
+        self._current = {}
+        self._lock = threading.Lock() # one scheduler is shared by all worker threads
+
+    def plan(self, levels, count):
+        quotas = dict.fromkeys(levels, 0)
+        with self._lock:
+            for _ in range(count):
+                total = 0
+                chosen = None
+                for level in levels:
+                    weight = self.weights.get(level, 1)
+                    self._current[level] = self._current.get(level, 0) + weight
+                    total += weight
+                    if chosen is None or self._current[level] > self._current[chosen]:
+                        chosen = level
+                self._current[chosen] -= total
+                quotas[chosen] += 1
+        return [(level, quotas[level]) for level in levels]
+
+
+class AgingPolicy(SchedulingPolicy):
+    """Strict priority, but a waiting task moves up one level every `age_step` seconds.
+
+    Each dequeue compares the oldest task of every level, so a low priority
+    task waits at most about `age_step` seconds per level it has to climb.
+    """
+
+    def __init__(self, age_step=10.0):
+        if age_step <= 0:
+            raise ValueError("age_step must be positive")
+        self.age_step = age_step
+
+    def plan(self, levels, count):
+        return [(level, count) for level in levels]
+
 
 class Scheduler:
-    def __init__(self, backend):
+    def __init__(self, backend, policy=None):
         self.backend = backend
+        self.policy = policy or StrictPolicy()
 
-    def get_next_task(self):
-        # Priority constants on Task use `High`, `Medium`, `Low` (capitalized)
-        for priority in [Priority.High, Priority.Medium, Priority.Low]:
+    def get_next_task(self, timeout=None):
+        # with a timeout, let the backend block across all priorities at once
+        if timeout is not None:
+            return self.backend.pop_blocking(timeout)
+
+        # visit levels in the order the policy prefers for a single task
+        levels = getattr(self.backend, 'priorities', DEFAULT_PRIORITIES)
+        plan = self.policy.plan(levels, 1)
+        preferred = [level for level, quota in plan if quota] + [level for level, quota in plan if not quota]
+        for priority in preferred:
             task = self.backend.pop(priority)
             if task:
                 return task
-        return None
\ No newline at end of file
+        return None
+
+    def claim_next_task(self, timeout=None):
+        # pop + mark processing in a single backend call
+        return self.backend.claim(timeout, policy=self.policy)
+
+    def claim_next_tasks(self, count, timeout=None):
+        # batch claim for the worker's prefetch buffer
+        return self.backend.claim_many(count, timeout, policy=self.policy)
+
+
+class Promoter:
+    """Moves delayed tasks (eta/countdown, retry backoff) onto their queues.
+
+    The backend keeps delayed tasks indexed by due time, so each pass only
+    reads the due head of the index, `batch_size` at a time, however many
+    timers are still pending. Runs inside `Worker` by default, or standalone:
+
+        promoter = Promoter(RedisBackend())
+        promoter.run() # until promoter.stop()
+    """
+
+    def __init__(self, backend, interval=0.5, batch_size=500):
+        self._backend = backend
+        self._interval = interval
+        self._batch_size = batch_size
+        self._stopped = threading.Event()
+
+    def run_once(self):
+        """Promote until nothing due is left; returns how many were promoted."""
+        total = 0
+        while True:
+            promoted = self._backend.promote_due(self._batch_size)
+            total += promoted
+            if promoted < self._batch_size:
+                break
+
+        if total:
+            logger.debug("Promoted %s due tasks", total)
+        return total
+
+    def run(self):
+        self._stopped.clear()
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("Error found in promoter: %s", e)
+            self._stopped.wait(self._interval)
+
+    def stop(self):
+        self._stopped.set()
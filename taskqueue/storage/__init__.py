@@ -1,5 +1,29 @@
+import importlib
 
-from .base import storage_backend
-from .redis_backend import RedisBackend
+# public name -> module defining it, imported on first use (see taskqueue/__init__.py)
+_EXPORTS = {
+    "storage_backend": ".base",
+    "async_storage_backend": ".base",
+    "RedisBackend": ".redis_backend",
+    "AsyncRedisBackend": ".async_redis_backend",
+    "InMemoryBackend": ".memory_backend",
+    "StreamsBackend": ".streams_backend",
+    "ShardedBackend": ".sharded_backend",
+    "HashRing": ".sharded_backend",
+    "get_connection_pool": ".connection",
+}
 
-__all__ = ["storage_backend", "RedisBackend"]
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
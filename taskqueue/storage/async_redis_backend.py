@@ -0,0 +1,192 @@
+import redis.asyncio as aioredis
+from taskqueue.storage.base import async_storage_backend
+import time
+import redis
+from taskqueue.storage.redis_backend import RedisLayout, CLAIM_SCRIPT, REAP_SCRIPT, PROMOTE_SCRIPT, MIGRATE_PROCESSING_SCRIPT
+from taskqueue.task import Task, TaskStatus
+from taskqueue.codec import JSONCodec
+
+
+class AsyncRedisBackend(RedisLayout, async_storage_backend):
+    """`RedisBackend` on `redis.asyncio`, sharing its key layout and claim script.
+
+    Tasks written by either backend can be read and claimed by the other.
+    No connection is made until the first command. With `max_connections`
+    the pool blocks when exhausted instead of raising; `client` or
+    `connection_pool` inject your own (async pools are tied to one event
+    loop, so they are not shared process-wide like the sync ones).
+
+    Out-of-band payloads (`payload_threshold`) can't be loaded lazily from
+    a sync `task.args`, so `claim_many` fetches them along with the claim;
+    tasks from `get_task` carry status and results only.
+    """
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, codec=None, max_connections=None, lease_ttl=30.0, priorities=None, completed_ttl=None, failed_ttl=None, client=None, connection_pool=None, unix_socket_path=None, key_prefix=None, payload_threshold=None, compression='auto'):
+        self._codec = codec or JSONCodec()
+        self._init_keys(key_prefix)
+        self._init_payloads(payload_threshold, compression)
+        self._init_levels(priorities)
+        self._lease_ttl = lease_ttl
+        self._completed_ttl = completed_ttl
+        self._failed_ttl = failed_ttl
+        self._owns_client = client is None
+        self._owns_pool = client is None and connection_pool is None
+        if self._owns_pool:
+            pool_class = aioredis.BlockingConnectionPool if max_connections else aioredis.ConnectionPool
+            if unix_socket_path:
+                connection_pool = pool_class(connection_class=aioredis.UnixDomainSocketConnection, path=unix_socket_path, db=db, password=password, max_connections=max_connections)
+            else:
+                connection_pool = pool_class(host=host, port=port, db=db, password=password, max_connections=max_connections)
+        self._redis = client if client is not None else aioredis.Redis(connection_pool=connection_pool)
+        self._claim_script = self._redis.register_script(CLAIM_SCRIPT)
+        self._reap_script = self._redis.register_script(REAP_SCRIPT)
+        self._promote_script = self._redis.register_script(PROMOTE_SCRIPT)
+        self._migrate_processing_script = self._redis.register_script(MIGRATE_PROCESSING_SCRIPT)
+
+    async def push(self, task, eta=None, dedup_ttl=None):
+        await self.push_many([task], eta=eta, dedup_ttl=dedup_ttl)
+
+    async def push_many(self, tasks, eta=None, dedup_ttl=None):
+        if not tasks:
+            return
+
+        pipe = self._redis.pipeline(transaction=False)
+        deduped = self._queue_push(pipe, tasks, eta, dedup_ttl)
+        results = await pipe.execute()
+        if deduped:
+            self._apply_dedup(tasks, results[-1])
+
+    async def claim(self, timeout=None, policy=None):
+        tasks = await self.claim_many(1, timeout=timeout, policy=policy)
+        return tasks[0] if tasks else None
+
+    async def claim_many(self, count, timeout=None, policy=None):
+        script_keys, script_args = self._claim_request(count, policy)
+        claimed = await self._claim_script(keys=script_keys, args=script_args)
+
+        deadline = time.monotonic() + (timeout or 0)
+        while not claimed and timeout:
+            # same wake-up wait as RedisBackend.claim_many
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or await self._redis.brpop(self.READY_KEY, timeout=remaining) is None:
+                break
+            script_keys, script_args = self._claim_request(count, policy, woken=True)
+            claimed = await self._claim_script(keys=script_keys, args=script_args)
+
+        records = self._claimed_records(claimed)
+        await self._prefetch_payloads(records)
+        return [self._task_from_fields(fields) for fields in records]
+
+    async def _prefetch_payloads(self, records):
+        # these tasks are about to run: fetch their out-of-band payloads in one round trip
+        external = [fields for fields in records if b'payload_key' in fields and b'payload' not in fields]
+        if not external:
+            return
+        pipe = self._redis.pipeline(transaction=False)
+        for fields in external:
+            pipe.get(fields[b'payload_key'])
+        for fields, payload in zip(external, await pipe.execute()):
+            if payload is not None:
+                fields[b'payload'] = payload
+
+    async def release(self, tasks):
+        if not tasks:
+            return
+
+        pipe = self._redis.pipeline(transaction=False)
+        self._queue_release(pipe, tasks)
+        await pipe.execute()
+
+    async def extend_lease(self, tasks, ttl=None):
+        if not tasks:
+            return
+
+        pipe = self._redis.pipeline(transaction=False)
+        self._queue_extend_lease(pipe, tasks, ttl)
+        await pipe.execute()
+
+    async def reap_expired(self, batch_size=100):
+        keys, args = self._reap_request(batch_size)
+        task_ids = await self._reap_script(keys=keys, args=args)
+        if not task_ids:
+            return 0
+
+        pipe = self._redis.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.hgetall(self._get_task_key(task_id))
+        records = await pipe.execute()
+
+        tasks = []
+        pipe = self._redis.pipeline(transaction=False)
+        for task_id, fields in zip(task_ids, records):
+            if fields:
+                tasks.append(self._task_from_fields(fields))
+            else:
+                pipe.zrem(self.PROCESSING_KEY, task_id) # record is gone
+        self._queue_reaped(pipe, tasks)
+        await pipe.execute()
+        return len(task_ids)
+
+    async def get_task(self, task_id):
+        task_key = self._get_task_key(task_id)
+        try:
+            fields = await self._redis.hgetall(task_key)
+        except aioredis.ResponseError:
+            # WRONGTYPE: record still in the old JSON string layout
+            task_data = await self._redis.get(task_key)
+            return Task.from_json(task_data) if task_data else None
+
+        if not fields:
+            return None
+
+        return self._task_from_fields(fields)
+
+    async def requeue(self, task, delay=None):
+        pipe = self._redis.pipeline(transaction=False)
+        self._queue_requeue(pipe, task, delay)
+        await pipe.execute()
+
+    async def promote_due(self, batch_size=500):
+        return await self._promote_script(keys=self._promote_keys(), args=self._promote_args(batch_size))
+
+    async def _transition(self, task, status, result=None, error=None):
+        pipe = self._redis.pipeline(transaction=False)
+        self._queue_transition(pipe, task, status, result, error)
+        await pipe.execute()
+
+    async def mark_processing(self, task):
+        await self._transition(task, TaskStatus.PROCESSING)
+
+    async def mark_completed(self, task, result=None):
+        await self._transition(task, TaskStatus.COMPLETED, result=result)
+
+    async def mark_failed(self, task, error=None):
+        await self._transition(task, TaskStatus.FAILED, error=error)
+
+    async def wait_for_result(self, task_id, timeout=None):
+        task = await self.get_task(task_id)
+        if task is not None and task.status in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+            return task
+        if timeout is not None and timeout <= 0:
+            return None
+
+        done_key = self._get_done_key(task_id)
+        if await self._redis.brpoplpush(done_key, done_key, timeout=timeout or 0) is None:
+            return None
+        return self._finished_task(await self._redis.hgetall(self._get_task_key(task_id)))
+
+    async def get_stats(self):
+        for attempt in range(2):
+            pipe = self._redis.pipeline() # MULTI: every count comes from the same instant
+            self._queue_stats(pipe)
+            try:
+                return self._stats_from_results(await pipe.execute())
+            except redis.ResponseError as e:
+                # the pre-lease processing SET: convert it (see RedisBackend) and read again
+                if attempt or 'WRONGTYPE' not in str(e):
+                    raise
+                await self._migrate_processing_script(keys=[self.PROCESSING_KEY], args=[time.time()])
+
+    async def close(self):
+        if self._owns_client:
+            await self._redis.aclose(close_connection_pool=self._owns_pool)
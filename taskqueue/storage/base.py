@@ -1,19 +1,73 @@
 
 from abc import ABC, abstractmethod
-from typing import Optional
-from taskqueue.task import Task
+from collections import Counter
+from typing import List, Optional
+import time
+from taskqueue.task import Task, TaskStatus, priority_name, resolve_level, _to_str
+
+# Lifetime counters every backend keeps, by event.
+COUNTER_EVENTS = ('enqueued', 'completed', 'failed', 'retried')
+
+
+def _counter_fields(event, tasks, levels):
+    """Flat counter increments for `event` happening to `tasks`.
+
+    Each task bumps the `event` total plus `event:priority:<level>` and
+    `event:task:<name>`; the result is aggregated so a batch costs one
+    increment per distinct field. Priorities are clamped onto the backend's
+    `levels` the same way its queues are, so the counts match them.
+    """
+    fields = Counter()
+    for task in tasks:
+        fields[event] += 1
+        fields[f"{event}:priority:{priority_name(resolve_level(task.priority, levels))}"] += 1
+        fields[f"{event}:task:{task.name}"] += 1
+    return fields
+
+
+def _counters_from_fields(fields):
+    """Shape flat counter fields into the counter part of `get_stats()`."""
+    stats = dict.fromkeys(COUNTER_EVENTS, 0)
+    stats['by_priority'] = {}
+    stats['by_task'] = {}
+    for field, value in fields.items():
+        event, *scope = _to_str(field).split(':', 2)
+        if not scope:
+            stats[event] = int(value)
+            continue
+        kind, name = scope
+        group = stats['by_priority' if kind == 'priority' else 'by_task'].setdefault(name, dict.fromkeys(COUNTER_EVENTS, 0))
+        group[event] = int(value)
+    return stats
 
 
 class storage_backend(ABC):
     @abstractmethod
-    def push(self, task: Task):
+    def push(self, task: Task, eta: Optional[float] = None, dedup_ttl: Optional[float] = None):
         """Push a task onto the queue.
 
         Args:
             task: The `Task` instance to be enqueued.
+            eta: Optional epoch seconds; a task due in the future is held
+                back until `promote_due` moves it onto its queue.
+            dedup_ttl: Longest time in seconds a task's `dedup_key` is held.
+
+        A task with a `dedup_key` is only pushed if no queued, scheduled or
+        running task holds the same key; otherwise nothing is written and
+        `task.id` is set to the id of the task holding it. The key is freed
+        when its task completes or fails, or after `dedup_ttl` seconds.
         """
         pass
 
+    def push_many(self, tasks: List[Task], eta: Optional[float] = None, dedup_ttl: Optional[float] = None):
+        """Push several tasks at once, deduplicating as `push` does (also within the batch).
+
+        Backends should override this to batch the writes; the default just
+        pushes one task at a time.
+        """
+        for task in tasks:
+            self.push(task, eta=eta, dedup_ttl=dedup_ttl)
+
     @abstractmethod
     def pop(self, priority: Optional[int] = None) -> Optional[Task]:
         """Pop a task from the queue.
@@ -23,6 +77,78 @@ class storage_backend(ABC):
         """
         pass
 
+    def pop_blocking(self, timeout: float = 1.0) -> Optional[Task]:
+        """Pop the highest-priority task, waiting up to `timeout` seconds.
+
+        Backends with a native blocking primitive should override this. The
+        default falls back to a single `pop()` followed by a sleep, which is
+        the old polling behaviour.
+        """
+        task = self.pop()
+        if task is None:
+            time.sleep(timeout)
+        return task
+
+    def claim(self, timeout: Optional[float] = None, policy=None) -> Optional[Task]:
+        """Take the highest-priority task and mark it as processing.
+
+        Backends should override this to do the pop and the status change in
+        one atomic step. If `timeout` is given, wait up to that many seconds
+        for a task to arrive. `policy` is a `SchedulingPolicy` choosing
+        between priority levels; the default is strict priority order, which
+        is also all this fallback implementation supports.
+        """
+        task = self.pop() if timeout is None else self.pop_blocking(timeout)
+        if task is not None:
+            self.mark_processing(task)
+        return task
+
+    def claim_many(self, count: int, timeout: Optional[float] = None, policy=None) -> List[Task]:
+        """Claim up to `count` tasks, ordered by `policy` (see `claim`).
+
+        The default claims one task at a time; only the first claim waits for
+        `timeout`.
+        """
+        tasks = []
+        task = self.claim(timeout, policy=policy)
+        while task is not None:
+            tasks.append(task)
+            if len(tasks) >= count:
+                break
+            task = self.claim(policy=policy)
+        return tasks
+
+    def release(self, tasks: List[Task]):
+        """Return claimed tasks that were never started back to the queue.
+
+        Unlike `requeue`, this is not a retry. The default simply requeues.
+        """
+        for task in tasks:
+            self.requeue(task)
+
+    def extend_lease(self, tasks: List[Task], ttl: Optional[float] = None):
+        """Heartbeat: extend the in-flight lease of tasks that are still running.
+
+        Backends without leases have nothing to extend.
+        """
+        pass
+
+    def reap_expired(self, batch_size: int = 100) -> int:
+        """Requeue or fail up to `batch_size` tasks whose lease expired.
+
+        Returns the number reclaimed. Backends without leases have nothing to
+        reap.
+        """
+        return 0
+
+    def promote_due(self, batch_size: int = 500) -> int:
+        """Move delayed tasks whose due time has passed onto their queues.
+
+        Returns the number promoted. Backends without delayed tasks have
+        nothing to promote.
+        """
+        return 0
+
     @abstractmethod
     def get_task(self, task_id: str) -> Optional[Task]:
         """Retrieve a task by its ID.
@@ -42,18 +168,51 @@ class storage_backend(ABC):
         pass
 
     @abstractmethod
-    def mark_completed(self, task: Task):
-        """Mark a task as completed and clear any in-flight tracking."""
+    def mark_completed(self, task: Task, result=None):
+        """Mark a task as completed and clear any in-flight tracking.
+
+        A non-None `result` (the handler's return value) is stored with the
+        task for `wait_for_result`/`Queue.get_result`.
+        """
         pass
 
     @abstractmethod
-    def mark_failed(self, task: Task):
-        """Mark a task as failed and clear any in-flight tracking."""
+    def mark_failed(self, task: Task, error: Optional[str] = None):
+        """Mark a task as failed and clear any in-flight tracking, storing `error` if given."""
         pass
 
+    def wait_for_result(self, task_id: str, timeout: Optional[float] = None) -> Optional[Task]:
+        """Wait until a task is completed or failed and return it.
+
+        Returns `None` if it didn't finish within `timeout` seconds (or its
+        record expired). Backends should override this to wait on a
+        notification; the default polls `get_task`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            task = self.get_task(task_id)
+            if task is not None and task.status in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+                return task
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(0.1)
+
+    def purge_finished(self, older_than: float = 0, ttl: Optional[float] = None, batch_size: int = 500) -> int:
+        """Delete completed/failed task records last updated over `older_than` seconds ago.
+
+        With `ttl`, records without an expiry are given one instead of being
+        deleted. Returns the number of records affected. Backends that keep
+        no finished records have nothing to purge.
+        """
+        return 0
+
     @abstractmethod
-    def requeue(self, task: Task):
-        """Requeue a task for later processing (usually after retry increment)."""
+    def requeue(self, task: Task, delay: Optional[float] = None):
+        """Requeue a task for later processing (usually after retry increment).
+
+        With `delay`, the task becomes available again only after that many
+        seconds.
+        """
         pass
 
     @abstractmethod
@@ -68,7 +227,12 @@ class storage_backend(ABC):
 
     @abstractmethod
     def get_stats(self) -> dict:
-        """Return a dictionary of queue/processing statistics."""
+        """Return a dictionary of queue/processing statistics.
+
+        Besides the current queue lengths this includes the lifetime
+        `enqueued`/`completed`/`failed`/`retried` counters, in total and
+        under `by_priority` and `by_task`.
+        """
         pass
 
     @abstractmethod
@@ -76,3 +240,86 @@ class storage_backend(ABC):
         """Close connections to the backend and cleanup resources."""
         pass
 
+
+
+class async_storage_backend(ABC):
+    """Asyncio counterpart of `storage_backend` for `AsyncWorker` and `Queue.enqueue_async`.
+
+    Covers the subset of operations a producer or worker needs; every method
+    is a coroutine.
+    """
+
+    @abstractmethod
+    async def push(self, task: Task, eta: Optional[float] = None, dedup_ttl: Optional[float] = None):
+        """Push a task onto the queue, held back until `eta` if given; dedups like `storage_backend.push`."""
+        pass
+
+    @abstractmethod
+    async def push_many(self, tasks: List[Task], eta: Optional[float] = None, dedup_ttl: Optional[float] = None):
+        """Push several tasks at once."""
+        pass
+
+    @abstractmethod
+    async def claim(self, timeout: Optional[float] = None, policy=None) -> Optional[Task]:
+        """Take the next task, as chosen by `policy`, and mark it as processing."""
+        pass
+
+    @abstractmethod
+    async def claim_many(self, count: int, timeout: Optional[float] = None, policy=None) -> List[Task]:
+        """Claim up to `count` tasks, ordered by `policy` (strict priority by default)."""
+        pass
+
+    @abstractmethod
+    async def release(self, tasks: List[Task]):
+        """Return claimed tasks that were never started back to the queue."""
+        pass
+
+    @abstractmethod
+    async def extend_lease(self, tasks: List[Task], ttl: Optional[float] = None):
+        """Heartbeat: extend the in-flight lease of tasks that are still running."""
+        pass
+
+    @abstractmethod
+    async def reap_expired(self, batch_size: int = 100) -> int:
+        """Requeue or fail up to `batch_size` tasks whose lease expired."""
+        pass
+
+    @abstractmethod
+    async def promote_due(self, batch_size: int = 500) -> int:
+        """Move delayed tasks whose due time has passed onto their queues."""
+        pass
+
+    @abstractmethod
+    async def get_task(self, task_id: str) -> Optional[Task]:
+        """Retrieve a task by its ID, or `None` if it is not found."""
+        pass
+
+    @abstractmethod
+    async def mark_completed(self, task: Task, result=None):
+        """Mark a task as completed, storing a non-None `result`."""
+        pass
+
+    @abstractmethod
+    async def mark_failed(self, task: Task, error: Optional[str] = None):
+        """Mark a task as failed, storing `error` if given."""
+        pass
+
+    @abstractmethod
+    async def wait_for_result(self, task_id: str, timeout: Optional[float] = None) -> Optional[Task]:
+        """Wait until a task is completed or failed; `None` on timeout."""
+        pass
+
+    @abstractmethod
+    async def requeue(self, task: Task, delay: Optional[float] = None):
+        """Requeue a task for later processing, after `delay` seconds if given."""
+        pass
+
+    @abstractmethod
+    async def get_stats(self) -> dict:
+        """Return a dictionary of queue/processing statistics."""
+        pass
+
+    @abstractmethod
+    async def close(self):
+        """Close connections to the backend and cleanup resources."""
+        pass
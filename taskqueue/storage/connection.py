@@ -0,0 +1,62 @@
+import os
+import threading
+import redis
+
+DEFAULT_MAX_CONNECTIONS = 50
+DEFAULT_POOL_TIMEOUT = 20.0
+
+_pools = {} # (pid, settings) -> BlockingConnectionPool
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(host='localhost', port=6379, db=0, password=None, unix_socket_path=None, max_connections=None, timeout=DEFAULT_POOL_TIMEOUT):
+    """Return the process-wide pool for these connection settings.
+
+    Backends built with the same settings share one `BlockingConnectionPool`,
+    so many `Queue` objects in a web process reuse the same sockets instead
+    of each opening their own. When all `max_connections` are in use, callers
+    wait up to `timeout` seconds for one to be returned rather than opening
+    more. Connections are opened on first use, not here. Pools are keyed by
+    pid so a forked child never reuses its parent's sockets.
+    """
+    max_connections = max_connections or DEFAULT_MAX_CONNECTIONS
+    key = (os.getpid(), host, port, db, password, unix_socket_path, max_connections, timeout)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            if unix_socket_path:
+                pool = redis.BlockingConnectionPool(
+                    connection_class=redis.UnixDomainSocketConnection, path=unix_socket_path,
+                    db=db, password=password, max_connections=max_connections, timeout=timeout,
+                )
+            else:
+                pool = redis.BlockingConnectionPool(
+                    host=host, port=port, db=db, password=password,
+                    max_connections=max_connections, timeout=timeout,
+                )
+            _pools[key] = pool
+        return pool
+
+
+def reset_connection_pools():
+    """Disconnect and forget every shared pool (e.g. in tests or after settings change)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.disconnect()
+
+
+def make_client(client=None, connection_pool=None, **settings):
+    """Return (client, owned) for a backend.
+
+    An injected `client` is used as is and `owned` is False, so the backend
+    leaves closing it to the caller. Otherwise the client runs on
+    `connection_pool`, or on the shared pool for `settings` (see
+    `get_connection_pool`).
+    """
+    if client is not None:
+        return client, False
+    if connection_pool is None:
+        connection_pool = get_connection_pool(**settings)
+    return redis.Redis(connection_pool=connection_pool), True
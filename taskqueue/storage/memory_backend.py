@@ -0,0 +1,351 @@
+from collections import Counter, deque
+import copy
+import heapq
+import itertools
+import threading
+import time
+from taskqueue.storage.base import storage_backend, _counter_fields, _counters_from_fields
+from taskqueue.task import TaskStatus, DEFAULT_PRIORITIES, priority_name, resolve_level
+from taskqueue.scheduler import StrictPolicy
+
+
+class InMemoryBackend(storage_backend):
+    """In-process backend for tests, single-box deployments and benchmarks.
+
+    Queues are per-priority deques of (task id, enqueued at) guarded by one
+    condition variable, which
+    also wakes blocked `claim`/`pop_blocking` callers when work arrives. The
+    id -> task map has its own lock so lookups never wait on queue traffic.
+    Tasks are copied on the way in and out, like a real store, so callers
+    only change stored state through the backend methods. Delayed tasks wait
+    in a heap ordered by due time until `promote_due` moves them. Finished
+    records with a TTL wait in a heap ordered by expiry and are dropped as
+    later tasks are pushed or finish.
+
+    Safe to share between `Worker` threads, but not across processes.
+    """
+
+    DEDUP_TTL = 3600 # same default as RedisBackend
+
+    def __init__(self, priorities=None, completed_ttl=None, failed_ttl=None):
+        self.priorities = sorted(set(priorities or DEFAULT_PRIORITIES)) # lower numbers run first
+        if not self.priorities:
+            raise ValueError("at least one priority level is required")
+        self._queues = {prior: deque() for prior in self.priorities}
+        self._processing = set()
+        self._delayed = [] # heap of (due, seq, task id, priority)
+        self._delayed_seq = itertools.count() # tie-breaker, keeps equal due times FIFO
+        self._queue_cond = threading.Condition() # guards _queues, _processing and _delayed
+        self._tasks = {}
+        self._finished = {} # task id -> (finished at, expires at or None)
+        self._expiring = [] # heap of (expires at, task id); may hold stale entries, _expire_finished skips them
+        self._dedup = {} # dedup key -> (task id, expires at)
+        self._counters = Counter() # flat counter fields, same as RedisBackend's counters hash
+        # guards _tasks, _finished, _dedup and _counters; notified whenever a task finishes
+        self._tasks_lock = threading.Condition()
+        self._completed_ttl = completed_ttl # seconds finished records are kept, None = forever
+        self._failed_ttl = failed_ttl
+
+    def _get_queue(self, priority): # same clamping as RedisBackend
+        return self._queues[resolve_level(priority, self.priorities)]
+
+    def _store(self, task):
+        with self._tasks_lock:
+            self._tasks[task.id] = copy.copy(task)
+            self._finished.pop(task.id, None)
+
+    def _load(self, task_id):
+        with self._tasks_lock:
+            task = self._get_live(task_id)
+        return copy.copy(task) if task is not None else None
+
+    def _get_live(self, task_id):
+        # caller holds _tasks_lock; drops the record if its TTL ran out
+        finished = self._finished.get(task_id)
+        if finished and finished[1] is not None and finished[1] <= time.time():
+            self._tasks.pop(task_id, None)
+            self._finished.pop(task_id, None)
+            return None
+        return self._tasks.get(task_id)
+
+    def _expire_finished(self):
+        # caller holds _tasks_lock; drops finished records whose TTL ran out,
+        # so they go away even if nobody reads them again
+        now = time.time()
+        while self._expiring and self._expiring[0][0] <= now:
+            _, task_id = heapq.heappop(self._expiring)
+            finished = self._finished.get(task_id)
+            if finished and finished[1] is not None and finished[1] <= now: # not re-pushed or given a later TTL
+                self._tasks.pop(task_id, None)
+                del self._finished[task_id]
+
+    def _finish(self, task, status, result=None, error=None):
+        now = time.time()
+        ttl = self._completed_ttl if status == TaskStatus.COMPLETED else self._failed_ttl
+        with self._tasks_lock:
+            stored = self._tasks.get(task.id)
+            if stored is not None:
+                if result is not None:
+                    stored.result = task.result = result
+                if error is not None:
+                    stored.error = task.error = error
+            # under the same lock hold as the outcome, so readers never see one without the other
+            self._set_state(task, status, status)
+            self._finished[task.id] = (now, now + ttl if ttl else None)
+            if ttl:
+                heapq.heappush(self._expiring, (now + ttl, task.id))
+            self._expire_finished()
+            if task.dedup_key is not None and self._dedup.get(task.dedup_key, (None,))[0] == task.id:
+                del self._dedup[task.dedup_key]
+            self._tasks_lock.notify_all() # wake wait_for_result callers
+        with self._queue_cond:
+            self._processing.discard(task.id)
+
+    def _set_state(self, task, status, event=None):
+        task.status = status
+        with self._tasks_lock:
+            stored = self._tasks.get(task.id)
+            if stored is not None:
+                stored.status = status
+                stored.retry_count = task.retry_count
+            if event:
+                self._counters.update(_counter_fields(event, [task], self.priorities))
+
+    def _pop_id(self, priority=None):
+        # caller holds _queue_cond
+        if priority is not None:
+            queue = self._get_queue(priority)
+            return queue.popleft()[0] if queue else None
+
+        for prior in self.priorities:
+            queue = self._queues[prior]
+            if queue:
+                return queue.popleft()[0]
+        return None
+
+    def _take_ids(self, count, policy):
+        # caller holds _queue_cond; same rules as the Redis claim script
+        task_ids = []
+        if policy.age_step:
+            now = time.time()
+            while len(task_ids) < count:
+                heads = [(prior - (now - queue[0][1]) / policy.age_step, prior) for prior, queue in self._queues.items() if queue]
+                if not heads:
+                    break
+                _, best = min(heads)
+                task_ids.append(self._queues[best].popleft()[0])
+            return task_ids
+
+        plan = policy.plan(self.priorities, count)
+        for prior, quota in plan + [(prior, count) for prior, _ in plan]:
+            queue = self._queues[prior]
+            while queue and quota > 0 and len(task_ids) < count:
+                task_ids.append(queue.popleft()[0])
+                quota -= 1
+        return task_ids
+
+    def _wait_for(self, take, timeout):
+        # caller holds _queue_cond; calls take() until it returns something or time runs out
+        deadline = None if timeout is None else time.monotonic() + timeout
+        result = take()
+        while not result and timeout:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._queue_cond.wait(remaining)
+            result = take()
+        return result
+
+    def _schedule(self, task, due):
+        # caller holds _queue_cond
+        heapq.heappush(self._delayed, (due, next(self._delayed_seq), task.id, task.priority))
+
+    def push(self, task, eta=None, dedup_ttl=None):
+        self.push_many([task], eta=eta, dedup_ttl=dedup_ttl)
+
+    def _claim_dedup_keys(self, tasks, dedup_ttl):
+        # caller holds _tasks_lock; returns the tasks that won their dedup key
+        now = time.time()
+        pushed = []
+        for task in tasks:
+            if task.dedup_key is not None:
+                holder = self._dedup.get(task.dedup_key)
+                if holder and holder[1] > now:
+                    task.id = holder[0]
+                    continue
+                self._dedup[task.dedup_key] = (task.id, now + (dedup_ttl or self.DEDUP_TTL))
+            pushed.append(task)
+        return pushed
+
+    def push_many(self, tasks, eta=None, dedup_ttl=None):
+        delayed = eta is not None and eta > time.time()
+        with self._tasks_lock:
+            tasks = self._claim_dedup_keys(tasks, dedup_ttl)
+            for task in tasks:
+                if delayed:
+                    task.status = TaskStatus.SCHEDULED
+                self._tasks[task.id] = copy.copy(task)
+                self._finished.pop(task.id, None)
+            self._counters.update(_counter_fields('enqueued', tasks, self.priorities))
+            self._expire_finished()
+
+        with self._queue_cond:
+            for task in tasks:
+                if delayed:
+                    self._schedule(task, eta)
+                else:
+                    self._get_queue(task.priority).append((task.id, time.time()))
+            if not delayed:
+                self._queue_cond.notify(len(tasks))
+
+    def pop(self, priority=None):
+        with self._queue_cond:
+            task_id = self._pop_id(priority)
+        return self._load(task_id) if task_id is not None else None
+
+    def pop_blocking(self, timeout=1.0):
+        with self._queue_cond:
+            task_id = self._wait_for(self._pop_id, timeout)
+        return self._load(task_id) if task_id is not None else None
+
+    def claim(self, timeout=None, policy=None):
+        tasks = self.claim_many(1, timeout=timeout, policy=policy)
+        return tasks[0] if tasks else None
+
+    def claim_many(self, count, timeout=None, policy=None):
+        policy = policy or StrictPolicy()
+        with self._queue_cond:
+            task_ids = self._wait_for(lambda: self._take_ids(count, policy), timeout)
+            self._processing.update(task_ids)
+
+        tasks = []
+        for task_id in task_ids:
+            task = self._load(task_id)
+            if task is None:
+                continue
+            self._set_state(task, TaskStatus.PROCESSING)
+            tasks.append(task)
+        return tasks
+
+    def release(self, tasks):
+        for task in tasks:
+            self._set_state(task, TaskStatus.ENQUEUED)
+
+        with self._queue_cond:
+            # appendleft in reverse so the first task claimed is the next one popped
+            for task in reversed(tasks):
+                self._processing.discard(task.id)
+                self._get_queue(task.priority).appendleft((task.id, time.time()))
+            self._queue_cond.notify(len(tasks))
+
+    def get_task(self, task_id):
+        return self._load(task_id)
+
+    def update_task(self, task):
+        self._store(task)
+
+    def mark_processing(self, task):
+        self._set_state(task, TaskStatus.PROCESSING)
+        with self._queue_cond:
+            self._processing.add(task.id)
+
+    def mark_completed(self, task, result=None):
+        self._finish(task, TaskStatus.COMPLETED, result=result)
+
+    def mark_failed(self, task, error=None):
+        self._finish(task, TaskStatus.FAILED, error=error)
+
+    def wait_for_result(self, task_id, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._tasks_lock:
+            while True:
+                stored = self._get_live(task_id)
+                if stored is not None and stored.status in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+                    return copy.copy(stored)
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._tasks_lock.wait(remaining)
+
+    def purge_finished(self, older_than=0, ttl=None, batch_size=500):
+        cutoff = time.time() - older_than
+        purged = 0
+        with self._tasks_lock:
+            for task_id, (finished_at, expires_at) in list(self._finished.items()):
+                if self._get_live(task_id) is None or finished_at > cutoff: # already expired, or too recent
+                    continue
+                if not ttl:
+                    self._tasks.pop(task_id, None)
+                    del self._finished[task_id]
+                    purged += 1
+                elif expires_at is None:
+                    self._finished[task_id] = (finished_at, time.time() + ttl)
+                    heapq.heappush(self._expiring, (time.time() + ttl, task_id))
+                    purged += 1
+        return purged
+
+    def requeue(self, task, delay=None):
+        if delay:
+            self._set_state(task, TaskStatus.SCHEDULED, 'retried')
+            with self._queue_cond:
+                self._processing.discard(task.id)
+                self._schedule(task, time.time() + delay)
+            return
+
+        self._set_state(task, TaskStatus.ENQUEUED, 'retried') # reset status before pushing back
+        with self._queue_cond:
+            self._processing.discard(task.id)
+            self._get_queue(task.priority).append((task.id, time.time()))
+            self._queue_cond.notify()
+
+    def promote_due(self, batch_size=500):
+        now = time.time()
+        promoted = []
+        with self._queue_cond:
+            while self._delayed and self._delayed[0][0] <= now and len(promoted) < batch_size:
+                _, _, task_id, priority = heapq.heappop(self._delayed)
+                self._get_queue(priority).append((task_id, now))
+                promoted.append(task_id)
+            self._queue_cond.notify(len(promoted))
+
+        with self._tasks_lock:
+            for task_id in promoted:
+                stored = self._tasks.get(task_id)
+                if stored is not None:
+                    stored.status = TaskStatus.ENQUEUED
+        return len(promoted)
+
+    def get_processing_tasks(self):
+        with self._queue_cond:
+            task_ids = list(self._processing)
+        tasks = [self._load(task_id) for task_id in task_ids]
+        return [task for task in tasks if task is not None]
+
+    def get_processing_count(self):
+        with self._queue_cond:
+            return len(self._processing)
+
+    def get_queue_length(self, priority=None):
+        with self._queue_cond:
+            if priority is not None:
+                return len(self._get_queue(priority))
+            return sum(len(queue) for queue in self._queues.values())
+
+    def get_stats(self):
+        with self._queue_cond:
+            stats = {priority_name(prior): len(queue) for prior, queue in self._queues.items()}
+            processing = len(self._processing)
+            scheduled = len(self._delayed)
+        total = sum(stats.values())
+        stats['processing'] = processing
+        stats['scheduled'] = scheduled
+        stats['total'] = total
+        with self._tasks_lock:
+            counters = dict(self._counters)
+        stats.update(_counters_from_fields(counters))
+        return stats
+
+    def close(self):
+        # wake anyone blocked in claim so they notice the shutdown
+        with self._queue_cond:
+            self._queue_cond.notify_all()
@@ -1,40 +1,680 @@
+import json
 import redis
-from taskqueue.storage.base import storage_backend
-from taskqueue.task import Task, TaskStatus, Priority
-import json 
+import time
+from taskqueue.storage.base import storage_backend, _counter_fields, _counters_from_fields
+from taskqueue.storage.connection import make_client
+from taskqueue.task import Task, TaskStatus, DEFAULT_PRIORITIES, priority_name, resolve_level
+from taskqueue.codec import JSONCodec, CompressedCodec
+from taskqueue.scheduler import StrictPolicy
 
-class RedisBackend(storage_backend):
-    def __init__(self, host='localhost', port=6379, db=0, password=None):
-        try:
-            self._redis = redis.Redis(host=host, port=port, db=db, password=password, decode_responses=True)
-            self._redis.ping() # check if connection is successful
+# Converts a legacy JSON string record into the hash layout, keeping the
+# whole document under `data` so it never has to be re-encoded in Lua.
+LUA_MIGRATE_RECORD = """
+local function migrate_record(task_key)
+    local data = redis.call('GET', task_key)
+    local decoded = cjson.decode(data)
+    redis.call('DEL', task_key)
+    redis.call('HSET', task_key, 'data', data, 'status', decoded['status'] or 'pending', 'retry_count', decoded['retry_count'] or 0)
+end
+"""
+
+# Converts the processing SET written by workers from before leases into the
+# lease zset, if that is what the key still holds. Every member gets an
+# already expired lease, so the reaper requeues tasks stuck there. Claims and
+# reaps run it first, so a rolling upgrade needs no manual step.
+LUA_MIGRATE_PROCESSING = """
+local function migrate_processing(processing, now)
+    if redis.call('TYPE', processing)['ok'] ~= 'set' then
+        return 0
+    end
+    local members = redis.call('SMEMBERS', processing)
+    redis.call('DEL', processing)
+    for _, task_id in ipairs(members) do
+        redis.call('ZADD', processing, now, task_id)
+    end
+    return #members
+end
+"""
+
+# Pops up to ARGV[2] ids, sets each one's status to processing and leases it
+# in the processing zset, all in one server-side step. Lists are visited as the
+# scheduling policy planned: first up to each list's quota, then topping up in
+# the same order. With an age step, each pop instead takes from the list whose
+# oldest task has the best priority after aging.
+# Every claimed id also takes one wake-up token off the ready list, less the
+# one a blocked caller already popped, so tokens keep tracking queued tasks.
+# KEYS: priority lists (in plan order), then the processing zset, then the
+# ready list
+# ARGV[1]: task key prefix, ARGV[2]: max tasks, ARGV[3]: current time,
+# ARGV[4]: lease expiry, ARGV[5]: age step in seconds (0 disables aging),
+# ARGV[6]: wake-up tokens the caller already popped (0 or 1), then one
+# quota per list, then one priority level per list
+CLAIM_SCRIPT = LUA_MIGRATE_RECORD + LUA_MIGRATE_PROCESSING + """
+local processing = KEYS[#KEYS - 1]
+local ready = KEYS[#KEYS]
+local lists = #KEYS - 2
+local limit = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+migrate_processing(processing, now)
+local age_step = tonumber(ARGV[5])
+local claimed = {}
+
+local function claim(task_id)
+    local task_key = ARGV[1] .. task_id
+    local key_type = redis.call('TYPE', task_key)['ok']
+    if key_type == 'string' then
+        migrate_record(task_key)
+    elseif key_type ~= 'hash' then
+        return
+    end
+    redis.call('HSET', task_key, 'status', 'processing', 'updated_at', ARGV[3])
+    redis.call('ZADD', processing, ARGV[4], task_id)
+    table.insert(claimed, redis.call('HGETALL', task_key))
+end
+
+local function take(i, quota)
+    while #claimed < limit and quota > 0 do
+        local task_id = redis.call('RPOP', KEYS[i])
+        if not task_id then
+            return
+        end
+        claim(task_id)
+        quota = quota - 1
+    end
+end
+
+if age_step > 0 then
+    while #claimed < limit do
+        local best, best_rank
+        for i = 1, lists do
+            local head = redis.call('LINDEX', KEYS[i], -1)
+            if head then
+                -- pcall: legacy string records have no enqueued_at and count as new
+                local since = tonumber(redis.pcall('HGET', ARGV[1] .. head, 'enqueued_at')) or now
+                local rank = tonumber(ARGV[6 + lists + i]) - (now - since) / age_step
+                if not best or rank < best_rank then
+                    best, best_rank = i, rank
+                end
+            end
+        end
+        if not best then
+            break
+        end
+        take(best, 1)
+    end
+else
+    for i = 1, lists do
+        take(i, tonumber(ARGV[6 + i]))
+    end
+    for i = 1, lists do
+        take(i, limit)
+    end
+end
+
+local tokens = #claimed - tonumber(ARGV[6])
+if tokens > 0 then
+    redis.call('LTRIM', ready, 0, -tokens - 1)
+end
+return claimed
+"""
+
+# KEYS: task keys to convert from JSON strings to hashes
+MIGRATE_SCRIPT = LUA_MIGRATE_RECORD + """
+local migrated = 0
+for _, task_key in ipairs(KEYS) do
+    if redis.call('TYPE', task_key)['ok'] == 'string' then
+        migrate_record(task_key)
+        migrated = migrated + 1
+    end
+end
+return migrated
+"""
+
+# Hands expired leases to the caller, re-leasing them for ARGV[3] seconds so
+# concurrent reapers don't pick the same ids and a reaper that dies mid-batch
+# only delays them. Records still in the legacy string layout (a worker from
+# before hashes died holding them) are converted, so the caller can HGETALL.
+# KEYS[1]: processing zset; ARGV[1]: current time, ARGV[2]: batch size,
+# ARGV[3]: grace, ARGV[4]: task key prefix
+REAP_SCRIPT = LUA_MIGRATE_RECORD + LUA_MIGRATE_PROCESSING + """
+migrate_processing(KEYS[1], ARGV[1])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+local until_ts = tonumber(ARGV[1]) + tonumber(ARGV[3])
+for _, task_id in ipairs(expired) do
+    redis.call('ZADD', KEYS[1], until_ts, task_id)
+    if redis.call('TYPE', ARGV[4] .. task_id)['ok'] == 'string' then
+        migrate_record(ARGV[4] .. task_id)
+    end
+end
+return expired
+"""
+
+# KEYS[1]: processing key; ARGV[1]: current time
+MIGRATE_PROCESSING_SCRIPT = LUA_MIGRATE_PROCESSING + """
+return migrate_processing(KEYS[1], ARGV[1])
+"""
+
+# Moves up to ARGV[3] due ids from each delayed zset onto its priority list.
+# ZRANGEBYSCORE with LIMIT only touches the due head of each zset, so the cost
+# of a tick does not grow with the number of timers still pending.
+# KEYS: delayed zsets followed by their priority lists, in the same order,
+# then the ready list; ARGV[1]: task key prefix, ARGV[2]: current time,
+# ARGV[3]: batch size, ARGV[4]: most wake-up tokens kept
+PROMOTE_SCRIPT = """
+local pairs_count = (#KEYS - 1) / 2
+local promoted = 0
+for i = 1, pairs_count do
+    local due = redis.call('ZRANGEBYSCORE', KEYS[i], '-inf', ARGV[2], 'LIMIT', 0, ARGV[3])
+    if #due > 0 then
+        redis.call('ZREM', KEYS[i], unpack(due))
+        redis.call('LPUSH', KEYS[pairs_count + i], unpack(due))
+        for _, task_id in ipairs(due) do
+            redis.call('HSET', ARGV[1] .. task_id, 'status', 'enqueued', 'updated_at', ARGV[2], 'enqueued_at', ARGV[2])
+        end
+        promoted = promoted + #due
+    end
+end
+if promoted > 0 then
+    for i = 1, math.min(promoted, tonumber(ARGV[4])) do
+        redis.call('LPUSH', KEYS[#KEYS], 1)
+    end
+    redis.call('LTRIM', KEYS[#KEYS], 0, ARGV[4] - 1)
+end
+return promoted
+"""
+
+# Deletes (or, with a TTL, expires) finished task records last updated at or
+# before ARGV[1], along with their out-of-band payloads. Legacy string records
+# and unfinished tasks are left alone.
+# KEYS: task keys; ARGV[1]: cutoff time, ARGV[2]: ttl in seconds (0 deletes)
+PURGE_SCRIPT = """
+local ttl = tonumber(ARGV[2])
+local purged = 0
+for _, task_key in ipairs(KEYS) do
+    if redis.call('TYPE', task_key)['ok'] == 'hash' then
+        local fields = redis.call('HMGET', task_key, 'status', 'updated_at', 'payload_key')
+        local finished = fields[1] == 'completed' or fields[1] == 'failed'
+        if finished and (tonumber(fields[2]) or 0) <= tonumber(ARGV[1]) then
+            if ttl == 0 then
+                redis.call('DEL', task_key)
+                if fields[3] then
+                    redis.call('DEL', fields[3])
+                end
+                purged = purged + 1
+            elseif redis.call('TTL', task_key) == -1 then
+                redis.call('EXPIRE', task_key, ttl)
+                if fields[3] then
+                    redis.call('EXPIRE', fields[3], ttl)
+                end
+                purged = purged + 1
+            end
+        end
+    end
+end
+return purged
+"""
+
+# Push with deduplication: a task whose dedup key is already held by another
+# task is skipped and that task's id returned instead. Run as one EVAL so the
+# SET NX and the push can't be split by a concurrent enqueue.
+# KEYS[1]: counters hash, KEYS[2]: ready list (LPUSH only), then per task:
+# task key, queue list (or delayed zset), dedup key (the task key again when
+# the task has none), payload key (the task key again when the payload is
+# inline)
+# ARGV[1]: dedup ttl in seconds, ARGV[2]: 'LPUSH', 'XADD' (streams) or
+# 'ZADD' (delayed), ARGV[3]: due time for ZADD, then per task: id, has dedup
+# key ('1'/'0'), out-of-band payload or '', field count, hash fields and
+# values, counter field count, counter fields
+# Returns per task the id of the task holding its dedup key, or '' if pushed.
+DEDUP_PUSH_SCRIPT = """
+local existing = {}
+local a = 4
+for k = 3, #KEYS, 4 do
+    local task_id = ARGV[a]
+    local has_dedup = ARGV[a + 1] == '1'
+    local payload = ARGV[a + 2]
+    local fields_start = a + 4
+    local fields_end = fields_start + tonumber(ARGV[a + 3]) - 1
+    local counters_start = fields_end + 2
+    local counters_end = counters_start + tonumber(ARGV[fields_end + 1]) - 1
+    a = counters_end + 1
+
+    local holder = false
+    if has_dedup and not redis.call('SET', KEYS[k + 2], task_id, 'NX', 'EX', ARGV[1]) then
+        holder = redis.call('GET', KEYS[k + 2])
+    end
+    if holder then
+        table.insert(existing, holder)
+    else
+        if payload ~= '' then
+            redis.call('SET', KEYS[k + 3], payload)
+        end
+        redis.call('HSET', KEYS[k], unpack(ARGV, fields_start, fields_end))
+        if ARGV[2] == 'LPUSH' then
+            redis.call('LPUSH', KEYS[k + 1], task_id)
+            redis.call('LPUSH', KEYS[2], 1)
+        elseif ARGV[2] == 'XADD' then
+            redis.call('XADD', KEYS[k + 1], '*', 'id', task_id)
+        else
+            redis.call('ZADD', KEYS[k + 1], ARGV[3], task_id)
+        end
+        for c = counters_start, counters_end do
+            redis.call('HINCRBY', KEYS[1], ARGV[c], 1)
+        end
+        table.insert(existing, '')
+    end
+end
+return existing
+"""
+
+# Frees a dedup key once its task finished, unless it expired and another
+# task has taken it since. KEYS[1]: dedup key, ARGV[1]: task id
+DEDUP_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+LEASE_EXPIRED_ERROR = "lease expired: the worker stopped renewing it"
+
+class RedisLayout:
+    """Key layout and command building shared by the sync and async backends.
+
+    Methods taking a `pipe` only queue commands on it; the backend decides
+    how (and whether asynchronously) to execute the pipeline.
+    """
 
-        except redis.ConnectionError as e:
-            raise ConnectionError(f"failed to connect to redis server: {e}")
-        
     QUEUE_KEY = "task_queue:queue"
     TASK_KEY = "task_queue:task"
-    PROCESSING_KEY = "task_queue:processing"
-    
-    Priority_queues = {
-        Priority.High: f"{QUEUE_KEY}:high",
-        Priority.Medium: f"{QUEUE_KEY}:medium",
-        Priority.Low: f"{QUEUE_KEY}:low",
-    }
+    PROCESSING_KEY = "task_queue:processing" # zset: task id -> lease expiry (epoch seconds)
+    DELAYED_KEY = "task_queue:delayed" # zsets: task id -> due time (epoch seconds), one per priority
+    COUNTERS_KEY = "task_queue:counters" # hash of lifetime event counters, see _counter_fields
+    DONE_KEY = "task_queue:done" # per task list, gets an entry when the task finishes
+    DEDUP_KEY = "task_queue:dedup" # dedup key -> id of the queued or running task holding it
+    PAYLOAD_KEY = "task_queue:payload" # task id -> payload too large to keep in the task hash
+    READY_KEY = "task_queue:ready" # list of wake-up tokens, one per queued task; idle claims block on it
+    READY_MAX = 10000 # most wake-up tokens kept, however long the queues get
+    DEDUP_TTL = 3600 # default seconds a dedup key is held at most
+    PUSH_COMMAND = 'LPUSH' # how DEDUP_PUSH_SCRIPT queues a ready task
+    DONE_TTL = 3600 # seconds a finish notification is kept when records don't expire
+    REAP_GRACE = 30.0 # seconds a reaper owns the ids it picked up
+    KEY_PREFIX = "task_queue" # every *_KEY above starts with this
+    KEY_NAMES = ('QUEUE_KEY', 'TASK_KEY', 'PROCESSING_KEY', 'DELAYED_KEY', 'COUNTERS_KEY', 'DONE_KEY', 'DEDUP_KEY', 'PAYLOAD_KEY', 'READY_KEY')
+
+    def _init_keys(self, key_prefix):
+        # swap the default prefix for a per-instance one, e.g. "task_queue:{shard1}"
+        # so a shard's keys share a Redis Cluster hash slot
+        if key_prefix is None or key_prefix == self.KEY_PREFIX:
+            return
+        for name in self.KEY_NAMES:
+            default = getattr(type(self), name)
+            setattr(self, name, key_prefix + default[len(self.KEY_PREFIX):])
+
+    def _init_payloads(self, payload_threshold, compression):
+        # encoded payloads of at least payload_threshold bytes are compressed and
+        # stored under their own key, so the task hash stays small
+        self._payload_threshold = payload_threshold
+        self._compressor = CompressedCodec(self._codec, compression, min_size=0) if payload_threshold is not None else None
+
+    def _init_levels(self, priorities):
+        # one list (and delayed zset) per level; lower numbers run first
+        self.priorities = sorted(set(priorities or DEFAULT_PRIORITIES))
+        if not self.priorities:
+            raise ValueError("at least one priority level is required")
         
     def _get_queue_key(self, priority): # selects queue based on priority
-        return self.Priority_queues.get(priority, self.Priority_queues[Priority.Medium]) # defaults to medium if none preexisting
+        # levels the backend doesn't have are clamped onto the nearest one
+        return f"{self.QUEUE_KEY}:{priority_name(resolve_level(priority, self.priorities))}"
+
+    def _get_delayed_key(self, priority): # same clamping as _get_queue_key
+        return f"{self.DELAYED_KEY}:{priority_name(resolve_level(priority, self.priorities))}"
 
     def _get_task_key(self, task_id):
+        if isinstance(task_id, bytes):
+            task_id = task_id.decode()
         return f"{self.TASK_KEY}:{task_id}"
-    
-    def push(self, task):
-        queue_key = self._get_queue_key(task.priority)
+
+    def _get_done_key(self, task_id):
+        if isinstance(task_id, bytes):
+            task_id = task_id.decode()
+        return f"{self.DONE_KEY}:{task_id}"
+
+    def _get_push_key(self, priority):
+        # where DEDUP_PUSH_SCRIPT sends ready tasks, with PUSH_COMMAND
+        return self._get_queue_key(priority)
+
+    def _get_dedup_key(self, dedup_key):
+        return f"{self.DEDUP_KEY}:{dedup_key}"
+
+    def _get_payload_key(self, task_id):
+        if isinstance(task_id, bytes):
+            task_id = task_id.decode()
+        return f"{self.PAYLOAD_KEY}:{task_id}"
+
+    def _queue_wake(self, pipe, count):
+        # one token per task that just became claimable, queued after the ids
+        # themselves so a woken claim finds them
+        if count:
+            pipe.lpush(self.READY_KEY, *[1] * min(count, self.READY_MAX))
+            pipe.ltrim(self.READY_KEY, 0, self.READY_MAX - 1)
+
+    def _get_queue_keys(self):
+        # highest priority first
+        return [self._get_queue_key(prior) for prior in self.priorities]
+
+    def _get_delayed_keys(self):
+        return [self._get_delayed_key(prior) for prior in self.priorities]
+
+    def _promote_keys(self):
+        return self._get_delayed_keys() + self._get_queue_keys() + [self.READY_KEY]
+
+    def _promote_args(self, batch_size):
+        return [f"{self.TASK_KEY}:", time.time(), batch_size, self.READY_MAX]
+
+    @staticmethod
+    def _decode_fields(fields):
+        # hash field names arrive as bytes; values are left for the codec
+        return {field.decode(): value for field, value in fields.items()}
+
+    # how tasks fetch an out-of-band payload; None on asyncio, which prefetches instead
+    _fetch_payload = None
+
+    def _task_from_fields(self, fields):
+        # a task from HGETALL fields; a large payload stays on the server until args are read
+        return Task.from_hash(self._decode_fields(fields), self._fetch_payload)
+
+    def _task_fields(self, task, **extra):
+        """Hash fields for `task`, plus the payload to store apart (or None)."""
+        fields = task.to_hash(self._codec)
+        fields.update(extra)
+        if self._payload_threshold is None or len(fields['payload']) < self._payload_threshold:
+            return fields, None
+        payload = self._compressor.compress(fields.pop('payload'))
+        fields['payload_key'] = self._get_payload_key(task.id)
+        return fields, payload
+
+    def _queue_write_task(self, pipe, task, **extra):
+        # the payload goes first, so a claimer never sees a record without it
+        fields, payload = self._task_fields(task, **extra)
+        if payload is not None:
+            pipe.set(fields['payload_key'], payload)
+        pipe.hset(self._get_task_key(task.id), mapping=fields)
+
+    def _claim_request(self, count, policy=None, woken=False):
+        """Keys and args for CLAIM_SCRIPT, as planned by `policy`.
+
+        `woken`: the caller already popped a wake-up token for this claim.
+        """
+        policy = policy or StrictPolicy()
+        plan = policy.plan(self.priorities, count)
+        now = time.time()
+        keys = [self._get_queue_key(level) for level, _ in plan] + [self.PROCESSING_KEY, self.READY_KEY]
+        args = [f"{self.TASK_KEY}:", count, now, now + self._lease_ttl, policy.age_step or 0, 1 if woken else 0]
+        args += [quota for _, quota in plan]
+        args += [level for level, _ in plan]
+        return keys, args
+
+    @staticmethod
+    def _claimed_records(claimed):
+        # HGETALL comes back from Lua as a flat [field, value, ...] list
+        return [dict(zip(flat_fields[::2], flat_fields[1::2])) for flat_fields in claimed or []]
+
+    def _tasks_from_claimed(self, claimed):
+        return [self._task_from_fields(fields) for fields in self._claimed_records(claimed)]
+
+    def _set_state(self, pipe, task, **extra):
+        # only the mutable fields; data/payload were written once by push()
+        pipe.hset(self._get_task_key(task.id), mapping={
+            'status': task.status,
+            'retry_count': task.retry_count,
+            'updated_at': time.time(),
+            **extra,
+        })
+
+    def _queue_count(self, pipe, event, tasks):
+        # counters ride in the same pipeline as the transition they count
+        for field, amount in _counter_fields(event, tasks, self.priorities).items():
+            pipe.hincrby(self.COUNTERS_KEY, field, amount)
+
+    def _queue_push(self, pipe, tasks, eta=None, dedup_ttl=None):
+        # one HSET per task and a single multi-value LPUSH per priority list;
+        # with a future eta the ids go to the delayed zsets instead.
+        # Returns True if it queued DEDUP_PUSH_SCRIPT, whose reply goes to _apply_dedup.
+        if any(task.dedup_key is not None for task in tasks):
+            self._queue_dedup_push(pipe, tasks, eta, dedup_ttl)
+            return True
+
+        self._queue_count(pipe, 'enqueued', tasks)
+        if eta is not None and eta > time.time():
+            ids_by_delayed = {}
+            for task in tasks:
+                task.status = TaskStatus.SCHEDULED
+                self._queue_write_task(pipe, task)
+                ids_by_delayed.setdefault(self._get_delayed_key(task.priority), {})[task.id] = eta
+
+            for delayed_key, due in ids_by_delayed.items():
+                pipe.zadd(delayed_key, due)
+            return
+
+        ids_by_queue = {}
+        now = time.time()
+        for task in tasks:
+            # enqueued_at lets AgingPolicy see how long the head of a list has waited
+            self._queue_write_task(pipe, task, enqueued_at=now)
+            ids_by_queue.setdefault(self._get_queue_key(task.priority), []).append(task.id)
+
+        for queue_key, task_ids in ids_by_queue.items():
+            pipe.lpush(queue_key, *task_ids)
+        self._queue_wake(pipe, len(tasks))
+        return False
+
+    def _queue_dedup_push(self, pipe, tasks, eta, dedup_ttl):
+        # the whole batch goes through the script so list order still follows `tasks`
+        delayed = eta is not None and eta > time.time()
+        now = time.time()
+        keys = [self.COUNTERS_KEY, self.READY_KEY]
+        args = [int(dedup_ttl or self.DEDUP_TTL), 'ZADD' if delayed else self.PUSH_COMMAND, eta if delayed else '']
+        for task in tasks:
+            task_key = self._get_task_key(task.id)
+            if delayed:
+                task.status = TaskStatus.SCHEDULED
+                fields, payload = self._task_fields(task)
+                keys += [task_key, self._get_delayed_key(task.priority)]
+            else:
+                fields, payload = self._task_fields(task, enqueued_at=now)
+                keys += [task_key, self._get_push_key(task.priority)]
+            has_dedup = task.dedup_key is not None
+            keys.append(self._get_dedup_key(task.dedup_key) if has_dedup else task_key)
+            keys.append(fields['payload_key'] if payload is not None else task_key)
+
+            counters = list(_counter_fields('enqueued', [task], self.priorities))
+            args += [task.id, '1' if has_dedup else '0', payload if payload is not None else '', 2 * len(fields)]
+            for field, value in fields.items():
+                args += [field, value]
+            args += [len(counters)] + counters
+        pipe.eval(DEDUP_PUSH_SCRIPT, len(keys), *keys, *args)
+
+    @staticmethod
+    def _apply_dedup(tasks, existing):
+        # tasks that lost to an already queued duplicate take on its id
+        for task, holder in zip(tasks, existing):
+            if holder:
+                task.id = holder.decode() if isinstance(holder, bytes) else holder
+
+    def _queue_release(self, pipe, tasks):
+        # RPUSH in reverse so the first task claimed is the next one popped
+        for task in reversed(tasks):
+            task.status = TaskStatus.ENQUEUED
+            self._set_state(pipe, task)
+            pipe.zrem(self.PROCESSING_KEY, task.id)
+            pipe.rpush(self._get_queue_key(task.priority), task.id)
+        self._queue_wake(pipe, len(tasks))
+
+    def _queue_requeue(self, pipe, task, delay=None):
+        pipe.zrem(self.PROCESSING_KEY, task.id)
+        self._queue_count(pipe, 'retried', [task])
+        if delay:
+            # back off: the promoter moves it to the list once it is due
+            task.status = TaskStatus.SCHEDULED
+            self._set_state(pipe, task)
+            pipe.zadd(self._get_delayed_key(task.priority), {task.id: time.time() + delay})
+            return
+
+        task.status = TaskStatus.ENQUEUED  # reset status before pushing back
+        self._set_state(pipe, task)
+        pipe.hset(self._get_task_key(task.id), 'enqueued_at', time.time())
+        pipe.lpush(self._get_queue_key(task.priority), task.id)
+        self._queue_wake(pipe, 1)
+
+    def _queue_transition(self, pipe, task, status, result=None, error=None):
+        # processing takes a lease, every other status gives it up
+        task.status = status
+        if status in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+            pipe.zrem(self.PROCESSING_KEY, task.id)
+            self._queue_count(pipe, status, [task])
+            self._queue_finish(pipe, task, result, error)
+            return
+
+        self._set_state(pipe, task)
+        if status == TaskStatus.PROCESSING:
+            pipe.zadd(self.PROCESSING_KEY, {task.id: time.time() + self._lease_ttl})
+        else:
+            pipe.zrem(self.PROCESSING_KEY, task.id)
+
+    def _queue_finish(self, pipe, task, result=None, error=None):
+        """Write the final status with the outcome, start the record's TTL and wake result waiters.
+
+        Status, result and error go in one HSET, so a reader that sees the
+        task finished also sees its result.
+        """
         task_key = self._get_task_key(task.id)
+        outcome = {}
+        if result is not None:
+            task.result = result
+            # default=repr: an unserialisable return value must not fail the task
+            outcome['result'] = json.dumps(result, default=repr)
+        if error is not None:
+            task.error = error
+            outcome['error'] = error
+        self._set_state(pipe, task, **outcome)
+
+        ttl = self._completed_ttl if task.status == TaskStatus.COMPLETED else self._failed_ttl
+        if ttl:
+            pipe.expire(task_key, int(ttl))
+            pipe.expire(self._get_payload_key(task.id), int(ttl)) # no-op for inline payloads
+
+        if task.dedup_key is not None:
+            # a new enqueue with the same key may run again from here on
+            pipe.eval(DEDUP_RELEASE_SCRIPT, 1, self._get_dedup_key(task.dedup_key), task.id)
+
+        # waiters BRPOPLPUSH this list onto itself, so the entry stays for all of them
+        done_key = self._get_done_key(task.id)
+        pipe.lpush(done_key, task.status)
+        pipe.expire(done_key, int(min(ttl, self.DONE_TTL) if ttl else self.DONE_TTL))
+
+    def _finished_task(self, fields):
+        # a task from HGETALL fields, if it has finished
+        if fields:
+            task = self._task_from_fields(fields)
+            if task.status in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+                return task
+        return None
+
+    def _queue_extend_lease(self, pipe, tasks, ttl):
+        # XX: never resurrect a lease the task already gave up or had reaped
+        deadline = time.time() + (ttl or self._lease_ttl)
+        pipe.zadd(self.PROCESSING_KEY, {task.id: deadline for task in tasks}, xx=True)
+
+    def _reap_request(self, batch_size):
+        return [self.PROCESSING_KEY], [time.time(), batch_size, self.REAP_GRACE, f"{self.TASK_KEY}:"]
+
+    def _queue_reaped(self, pipe, tasks):
+        """Queue the retry-or-fail outcome for tasks whose lease expired."""
+        for task in tasks:
+            if task.can_retry:
+                task.increment_retry()
+                self._queue_requeue(pipe, task)
+            else:
+                self._queue_transition(pipe, task, TaskStatus.FAILED, error=LEASE_EXPIRED_ERROR)
+
+    def _queue_stats(self, pipe):
+        for queue_key in self._get_queue_keys():
+            pipe.llen(queue_key)
+        pipe.zcard(self.PROCESSING_KEY)
+        for delayed_key in self._get_delayed_keys():
+            pipe.zcard(delayed_key)
+        pipe.hgetall(self.COUNTERS_KEY)
+
+    def _stats_from_results(self, results):
+        # per level counts, keyed by name ('high', 'medium', 'low' by default)
+        levels = len(self.priorities)
+        stats = {priority_name(prior): count for prior, count in zip(self.priorities, results)}
+        stats['processing'] = results[levels]
+        stats['scheduled'] = sum(results[levels + 1:-1])
+        stats['total'] = sum(results[:levels])
+        stats.update(_counters_from_fields(results[-1]))
+        return stats
+
+
+class RedisBackend(RedisLayout, storage_backend):
+    """Backend on Redis lists, hashes and sorted sets.
+
+    Nothing connects until the first command. By default every backend with
+    the same settings shares one process-wide `BlockingConnectionPool` of
+    `max_connections`; pass `client` or `connection_pool` to bring your own,
+    or `unix_socket_path` to connect over a unix socket. `key_prefix`
+    replaces the "task_queue" namespace of every key.
+
+    With `payload_threshold`, encoded payloads of at least that many bytes
+    are compressed (`compression`: 'zlib', 'lz4', 'zstd' or 'auto', see
+    `CompressedCodec`) and stored under a key of their own. Claims, status
+    changes and monitoring then only move the small task hash; the payload
+    is fetched when a handler reads `task.args`/`task.kwargs`.
+    """
 
-        # store task payload and push id onto the appropriate priority list
-        self._redis.set(task_key, task.to_json())
-        self._redis.lpush(queue_key, task.id)
+    def __init__(self, host='localhost', port=6379, db=0, password=None, codec=None, lease_ttl=30.0, priorities=None, completed_ttl=None, failed_ttl=None, client=None, connection_pool=None, unix_socket_path=None, max_connections=None, key_prefix=None, payload_threshold=None, compression='auto'):
+        # responses stay as bytes so binary codecs round-trip; ids are decoded by hand
+        self._codec = codec or JSONCodec()
+        self._init_keys(key_prefix) # "task_queue" unless several queues share a server
+        self._init_payloads(payload_threshold, compression) # None keeps every payload in the task hash
+        self._init_levels(priorities) # priority levels with their own list, High/Medium/Low by default
+        self._lease_ttl = lease_ttl # seconds a claimed task may go without a heartbeat
+        self._completed_ttl = completed_ttl # seconds finished records are kept, None = forever
+        self._failed_ttl = failed_ttl
+        self._redis, self._owns_client = make_client(
+            client, connection_pool, host=host, port=port, db=db, password=password,
+            unix_socket_path=unix_socket_path, max_connections=max_connections,
+        )
+
+        self._claim_script = self._redis.register_script(CLAIM_SCRIPT)
+        self._migrate_script = self._redis.register_script(MIGRATE_SCRIPT)
+        self._reap_script = self._redis.register_script(REAP_SCRIPT)
+        self._migrate_processing_script = self._redis.register_script(MIGRATE_PROCESSING_SCRIPT)
+        self._promote_script = self._redis.register_script(PROMOTE_SCRIPT)
+        self._purge_script = self._redis.register_script(PURGE_SCRIPT)
+    
+    def push(self, task, eta=None, dedup_ttl=None):
+        # store task fields and push id onto the appropriate priority list
+        self.push_many([task], eta=eta, dedup_ttl=dedup_ttl)
+
+    def push_many(self, tasks, eta=None, dedup_ttl=None):
+        """Store a batch of tasks in one pipelined round trip.
+
+        Task hashes are written in one pipeline with a single multi-value
+        LPUSH per priority list, so list order matches the order of `tasks`.
+        With a future `eta` (epoch seconds) they wait in the delayed zsets
+        until `promote_due` moves them. Tasks with a `dedup_key` go through
+        DEDUP_PUSH_SCRIPT in the same round trip; see storage_backend.
+        """
+        if not tasks:
+            return
+
+        pipe = self._redis.pipeline(transaction=False)
+        deduped = self._queue_push(pipe, tasks, eta, dedup_ttl)
+        results = pipe.execute()
+        if deduped:
+            self._apply_dedup(tasks, results[-1])
 
     def pop(self, priority=None):
         """Pop a task from the specified priority queue, or highest available."""
@@ -44,8 +684,7 @@ class RedisBackend(storage_backend):
             queue_key = self._get_queue_key(priority)
             task_id = self._redis.rpop(queue_key)
         else:
-            for prior in [Priority.High, Priority.Medium, Priority.Low]:
-                queue_key = self._get_queue_key(prior)
+            for queue_key in self._get_queue_keys():
                 task_id = self._redis.rpop(queue_key)
                 if task_id:
                     break
@@ -53,36 +692,113 @@ class RedisBackend(storage_backend):
         if not task_id:
             return None
 
-        task_key = self._get_task_key(task_id)
-        task_data = self._redis.get(task_key)
-        if not task_data:
+        return self.get_task(task_id)
+
+    def pop_blocking(self, timeout=1.0):
+        """Pop the highest available task, blocking up to `timeout` seconds.
+
+        BRPOP checks its keys in the order given, so passing the priority
+        lists High -> Medium -> Low keeps strict priority ordering while idle
+        workers wait on the server instead of polling.
+        """
+        result = self._redis.brpop(self._get_queue_keys(), timeout=timeout)
+        if not result:
             return None
 
-        task = Task.from_json(task_data)
-        return task
+        _, task_id = result
+        return self.get_task(task_id)
     
+    def claim(self, timeout=None, policy=None):
+        """Atomically pop the next task and mark it processing.
+
+        One script call replaces the RPOPs, HGETALL, HSET and SADD of pop() +
+        mark_processing(); `policy` picks the priority level (strict by
+        default). With a timeout, an idle claim blocks on the ready list,
+        which gets a token for every task queued on any level, and runs the
+        script again once one arrives. Ids only ever leave their queue inside
+        the script, so a worker dying while it waits loses nothing.
+        """
+        tasks = self.claim_many(1, timeout=timeout, policy=policy)
+        return tasks[0] if tasks else None
+
+    def claim_many(self, count, timeout=None, policy=None):
+        """Claim up to `count` tasks in a single round trip (see claim())."""
+        script_keys, script_args = self._claim_request(count, policy)
+        claimed = self._claim_script(keys=script_keys, args=script_args)
+
+        deadline = time.monotonic() + (timeout or 0)
+        while not claimed and timeout:
+            # another worker may take the task first; then wait for the next token
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._redis.brpop(self.READY_KEY, timeout=remaining) is None:
+                break
+            script_keys, script_args = self._claim_request(count, policy, woken=True)
+            claimed = self._claim_script(keys=script_keys, args=script_args)
+
+        return self._tasks_from_claimed(claimed)
+
+    def release(self, tasks):
+        """Hand claimed but unstarted tasks back to the front of their queues."""
+        if not tasks:
+            return
+
+        pipe = self._redis.pipeline(transaction=False)
+        self._queue_release(pipe, tasks)
+        pipe.execute()
+
     def get_task(self, task_id): #getting task data by id
 
         task_key = self._get_task_key(task_id)
-        task_data = self._redis.get(task_key)
+        try:
+            fields = self._redis.hgetall(task_key)
+        except redis.ResponseError:
+            # WRONGTYPE: record still in the old JSON string layout
+            task_data = self._redis.get(task_key)
+            return Task.from_json(task_data) if task_data else None
 
-        if not task_data:
+        if not fields:
             return None
         
-        return Task.from_json(task_data)
+        return self._task_from_fields(fields)
+
+    def _fetch_payload(self, payload_key):
+        return self._redis.get(payload_key)
     
-    def requeue(self, task):
-        self._redis.srem(self.PROCESSING_KEY, task.id)
-        task.status = TaskStatus.ENQUEUED  # reset status before pushing back
-        self.update_task(task)
-        queue_key = self._get_queue_key(task.priority)
-        self._redis.lpush(queue_key, task.id)
+    def requeue(self, task, delay=None):
+        pipe = self._redis.pipeline(transaction=False)
+        self._queue_requeue(pipe, task, delay)
+        pipe.execute()
+
+    def promote_due(self, batch_size=500):
+        """Move up to `batch_size` due tasks per priority onto their lists.
+
+        Returns the number of tasks promoted.
+        """
+        return self._promote_script(keys=self._promote_keys(), args=self._promote_args(batch_size))
+
+    def ping(self):
+        """Check the server is reachable; raises ConnectionError if not."""
+        try:
+            self._redis.ping()
+        except redis.ConnectionError as e:
+            raise ConnectionError(f"failed to connect to redis server: {e}")
 
     def close(self):
-        self._redis.close()
+        # shared pools stay open for the other backends using them
+        if self._owns_client:
+            self._redis.close()
+
+    def _read_processing(self, read):
+        # a read that meets the pre-lease processing SET converts it and tries again
+        try:
+            return read()
+        except redis.ResponseError as e:
+            if 'WRONGTYPE' not in str(e) or not self.migrate_processing_set():
+                raise
+            return read()
 
     def get_processing_tasks(self): 
-        task_ids = self._redis.smembers(self.PROCESSING_KEY)
+        task_ids = self._read_processing(lambda: self._redis.zrange(self.PROCESSING_KEY, 0, -1))
         tasks = []
         for task_id in task_ids:
             task = self.get_task(task_id)
@@ -91,27 +807,126 @@ class RedisBackend(storage_backend):
         return tasks
     
     def get_processing_count(self):
-        return self._redis.scard(self.PROCESSING_KEY)
+        return self._read_processing(lambda: self._redis.zcard(self.PROCESSING_KEY))
+
+    def extend_lease(self, tasks, ttl=None):
+        """Push back the lease expiry of tasks this worker is still running."""
+        if not tasks:
+            return
+
+        pipe = self._redis.pipeline(transaction=False)
+        self._queue_extend_lease(pipe, tasks, ttl)
+        pipe.execute()
+
+    def reap_expired(self, batch_size=100):
+        """Requeue (or fail, once out of retries) tasks whose lease expired.
+
+        Returns the number of tasks reclaimed in this batch.
+        """
+        keys, args = self._reap_request(batch_size)
+        task_ids = self._reap_script(keys=keys, args=args)
+        if not task_ids:
+            return 0
+
+        pipe = self._redis.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.hgetall(self._get_task_key(task_id))
+        records = pipe.execute()
+
+        tasks = []
+        pipe = self._redis.pipeline(transaction=False)
+        for task_id, fields in zip(task_ids, records):
+            if fields:
+                tasks.append(self._task_from_fields(fields))
+            else:
+                pipe.zrem(self.PROCESSING_KEY, task_id) # record is gone
+        self._queue_reaped(pipe, tasks)
+        pipe.execute()
+        return len(task_ids)
     
     def update_task(self, task):
+        """Rewrite the full task record, payload included."""
         task_key = self._get_task_key(task.id)
-        self._redis.set(task_key, task.to_json())
+        pipe = self._redis.pipeline() # MULTI so readers never see a half-written record
+        pipe.delete(task_key, self._get_payload_key(task.id))
+        self._queue_write_task(pipe, task)
+        pipe.execute()
+
+    def _transition(self, task, status, result=None, error=None):
+        pipe = self._redis.pipeline(transaction=False)
+        self._queue_transition(pipe, task, status, result, error)
+        pipe.execute()
 
     def mark_processing(self, task):
         # add to processing set and update status
-        task.status = TaskStatus.PROCESSING
-        self.update_task(task)
-        self._redis.sadd(self.PROCESSING_KEY, task.id)
+        self._transition(task, TaskStatus.PROCESSING)
+
+    def mark_completed(self, task, result=None):
+        self._transition(task, TaskStatus.COMPLETED, result=result)
+
+    def mark_failed(self, task, error=None):
+        self._transition(task, TaskStatus.FAILED, error=error)
+
+    def wait_for_result(self, task_id, timeout=None):
+        """Block until the task finishes, on its done list rather than by polling."""
+        task = self.get_task(task_id)
+        if task is not None and task.status in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+            return task
+        if timeout is not None and timeout <= 0:
+            return None
+
+        done_key = self._get_done_key(task_id)
+        if self._redis.brpoplpush(done_key, done_key, timeout=timeout or 0) is None:
+            return None
+        return self._finished_task(self._redis.hgetall(self._get_task_key(task_id)))
+
+    def purge_finished(self, older_than=0, ttl=None, batch_size=500):
+        """Delete (or, with `ttl`, expire) finished task records; see storage_backend.
+
+        Walks the keyspace with SCAN, so it is safe to run against a live
+        instance. Returns the number of records purged or given a TTL.
+        """
+        cutoff = time.time() - older_than
+        ttl = int(ttl) if ttl else 0
+        purged = 0
+        batch = []
+        for task_key in self._redis.scan_iter(match=f"{self.TASK_KEY}:*", count=batch_size):
+            batch.append(task_key)
+            if len(batch) >= batch_size:
+                purged += self._purge_script(keys=batch, args=[cutoff, ttl])
+                batch = []
+        if batch:
+            purged += self._purge_script(keys=batch, args=[cutoff, ttl])
+        return purged
+
+    def migrate_string_tasks(self, batch_size=500):
+        """Convert task records stored as JSON strings to the hash layout.
+
+        Safe to run while workers are live: each batch is converted by a
+        script, and claim() also converts legacy records it meets. Returns the
+        number of records converted.
+        """
+        migrated = 0
+        batch = []
+        for task_key in self._redis.scan_iter(match=f"{self.TASK_KEY}:*", count=batch_size):
+            batch.append(task_key)
+            if len(batch) >= batch_size:
+                migrated += self._migrate_script(keys=batch)
+                batch = []
+        if batch:
+            migrated += self._migrate_script(keys=batch)
+        return migrated
 
-    def mark_completed(self, task):
-        task.status = TaskStatus.COMPLETED
-        self.update_task(task)
-        self._redis.srem(self.PROCESSING_KEY, task.id)
+    def migrate_processing_set(self):
+        """Convert the old processing SET to the lease zset.
 
-    def mark_failed(self, task):
-        task.status = TaskStatus.FAILED
-        self.update_task(task)
-        self._redis.srem(self.PROCESSING_KEY, task.id)
+        Claims, reaps and stats do this on their own when they meet the
+        old SET; this is for converting ahead of time. Every converted
+        task gets an already expired lease, so the next
+        reap_expired() requeues anything that was stuck. Returns the number of
+        tasks converted.
+        """
+        return self._migrate_processing_script(keys=[self.PROCESSING_KEY], args=[time.time()])
 
     def get_queue_length(self, priority=None):
         if priority is not None:
@@ -119,16 +934,13 @@ class RedisBackend(storage_backend):
             return self._redis.llen(queue_key)
         # sum of all priority queues
         total = 0
-        for prior in [Priority.High, Priority.Medium, Priority.Low]:
-            total += self._redis.llen(self._get_queue_key(prior))
+        for queue_key in self._get_queue_keys():
+            total += self._redis.llen(queue_key)
         return total
 
     def get_stats(self):
-        return {
-            'high': self._redis.llen(self.Priority_queues[Priority.High]),
-            'medium': self._redis.llen(self.Priority_queues[Priority.Medium]),
-            'low': self._redis.llen(self.Priority_queues[Priority.Low]),
-            'processing': self.get_processing_count(),
-            'total': self.get_queue_length()
-        }
-        
\ No newline at end of file
+        def read():
+            pipe = self._redis.pipeline() # MULTI: every count comes from the same instant
+            self._queue_stats(pipe)
+            return pipe.execute()
+        return self._stats_from_results(self._read_processing(read))
@@ -0,0 +1,308 @@
+from bisect import bisect
+from collections import defaultdict
+import hashlib
+import itertools
+import math
+import threading
+import time
+from taskqueue.storage.base import storage_backend
+from taskqueue.storage.redis_backend import RedisLayout, RedisBackend
+
+
+def _hash(key):
+    # stable across processes, unlike hash()
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring mapping keys onto node names.
+
+    Each node owns `replicas` points on the ring, so keys spread evenly and
+    adding or removing a node only moves the keys between it and its
+    neighbours (about 1/N of them) instead of reshuffling everything.
+    """
+
+    def __init__(self, nodes=(), replicas=128):
+        self.replicas = replicas
+        self._points = [] # sorted ring positions
+        self._owners = [] # node name at the same index
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            index = bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node):
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def get(self, key):
+        if not self._points:
+            raise ValueError("hash ring has no nodes")
+        index = bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+def _merge_stats(into, stats):
+    # sum counts key by key, recursing into by_priority/by_task
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            _merge_stats(into.setdefault(key, {}), value)
+        else:
+            into[key] = into.get(key, 0) + value
+    return into
+
+
+class ShardedBackend(storage_backend):
+    """Spreads tasks over several backends ("shards") by consistent hashing.
+
+    A task lives entirely on the shard its id hashes to: record, queue entry,
+    lease and counters. Every shard is a complete backend whose keys carry
+    the shard name as a hash tag (`task_queue:{name}:...`), so the scripts
+    that touch several keys at once stay on one node, including on Redis
+    Cluster. Adding a shard only changes where about 1/N of new task ids go;
+    tasks already queued stay put and are still claimed, because workers
+    read from every shard.
+
+    Claims are fair: each call starts at the next shard in turn and asks
+    every shard for its share before topping up from the rest. With a
+    timeout, an idle worker blocks on one shard at a time (on all of its
+    priority levels) for `block_slice` seconds, so work landing on another
+    shard waits at most about `block_slice * (shards - 1)` seconds. A single
+    shard is blocked on for the whole timeout.
+    """
+
+    def __init__(self, shards, replicas=128, block_slice=0.1):
+        if not isinstance(shards, dict):
+            shards = {f"shard{i}": shard for i, shard in enumerate(shards)}
+        if not shards:
+            raise ValueError("at least one shard is required")
+        self._shards = dict(shards) # name -> backend
+        self._ring = HashRing(self._shards, replicas)
+        self._block_slice = block_slice
+        self._rotation = itertools.count() # start shard of the next claim
+        self._owners = {} # task id -> shard name, for tasks claimed through this backend
+        self._lock = threading.Lock() # serialises add_shard
+
+    @staticmethod
+    def shard_prefix(name):
+        """Key prefix for shard `name`, with the name as a Redis Cluster hash tag."""
+        return f"{RedisLayout.KEY_PREFIX}:{{{name}}}"
+
+    @classmethod
+    def from_nodes(cls, nodes, backend_class=RedisBackend, replicas=128, block_slice=0.1, **options):
+        """One shard per Redis node.
+
+        `nodes` are dicts of connection settings (`host`, `port`, `db`,
+        `password`, `unix_socket_path`, optionally `name`) or "host:port"
+        strings. Shard names default to "host:port", so a node keeps its
+        share of the ring however the list is reordered. `options` go to
+        every `backend_class`.
+        """
+        shards = {}
+        for node in nodes:
+            if isinstance(node, str):
+                host, _, port = node.rpartition(':')
+                node = {'host': host, 'port': int(port)}
+            node = dict(node)
+            name = node.pop('name', None) or node.get('unix_socket_path') or f"{node.get('host', 'localhost')}:{node.get('port', 6379)}"
+            shards[name] = backend_class(key_prefix=cls.shard_prefix(name), **node, **options)
+        return cls(shards, replicas=replicas, block_slice=block_slice)
+
+    @classmethod
+    def from_cluster(cls, client, shards=16, backend_class=RedisBackend, replicas=128, block_slice=0.1, **options):
+        """`shards` logical shards on one Redis Cluster client.
+
+        Each shard's hash tag maps it to a cluster slot, so the cluster
+        spreads the shards over its nodes.
+        """
+        backends = {
+            f"shard{i}": backend_class(client=client, key_prefix=cls.shard_prefix(f"shard{i}"), **options)
+            for i in range(shards)
+        }
+        return cls(backends, replicas=replicas, block_slice=block_slice)
+
+    @property
+    def shards(self):
+        return dict(self._shards)
+
+    def add_shard(self, name, backend):
+        """Start placing new tasks on `backend` too."""
+        with self._lock:
+            if name in self._shards:
+                raise ValueError(f"shard {name!r} already exists")
+            # swap in new objects so concurrent claims never see a half-built ring
+            shards = {**self._shards, name: backend}
+            self._ring = HashRing(shards, self._ring.replicas)
+            self._shards = shards
+
+    def _shard_name(self, task_id):
+        if isinstance(task_id, bytes):
+            task_id = task_id.decode()
+        return self._owners.get(task_id) or self._ring.get(task_id)
+
+    def _shard_for(self, task_id):
+        return self._shards[self._shard_name(task_id)]
+
+    def _by_shard(self, tasks):
+        grouped = defaultdict(list)
+        for task in tasks:
+            grouped[self._shard_name(task.id)].append(task)
+        return grouped
+
+    def _by_push_shard(self, tasks):
+        # duplicates must meet on one shard, so tasks with a dedup key go where
+        # the key hashes; get_task finds them through _locate's fallback
+        grouped = defaultdict(list)
+        for task in tasks:
+            name = self._ring.get(f"dedup:{task.dedup_key}") if task.dedup_key is not None else self._shard_name(task.id)
+            grouped[name].append(task)
+        return grouped
+
+    def _rotated(self):
+        # shard names starting one further along on every call
+        names = list(self._shards)
+        start = next(self._rotation) % len(names)
+        return names[start:] + names[:start]
+
+    def _track(self, name, tasks):
+        for task in tasks:
+            self._owners[task.id] = name
+        return tasks
+
+    def _forget(self, task):
+        self._owners.pop(task.id, None)
+
+    def push(self, task, eta=None, dedup_ttl=None):
+        self.push_many([task], eta=eta, dedup_ttl=dedup_ttl)
+
+    def push_many(self, tasks, eta=None, dedup_ttl=None):
+        for name, shard_tasks in self._by_push_shard(tasks).items():
+            self._shards[name].push_many(shard_tasks, eta=eta, dedup_ttl=dedup_ttl)
+
+    def pop(self, priority=None):
+        for name in self._rotated():
+            task = self._shards[name].pop(priority)
+            if task is not None:
+                return self._track(name, [task])[0]
+        return None
+
+    def pop_blocking(self, timeout=1.0):
+        task = self.pop()
+        deadline = time.monotonic() + timeout
+        for name in itertools.cycle(self._rotated()):
+            remaining = deadline - time.monotonic()
+            if task is not None or remaining <= 0:
+                return task
+            task = self._shards[name].pop_blocking(min(self._block_slice, remaining))
+            if task is not None:
+                self._track(name, [task])
+
+    def claim(self, timeout=None, policy=None):
+        tasks = self.claim_many(1, timeout=timeout, policy=policy)
+        return tasks[0] if tasks else None
+
+    def claim_many(self, count, timeout=None, policy=None):
+        """Claim up to `count` tasks spread fairly over the shards (see class docs)."""
+        names = self._rotated()
+        tasks = []
+        # first pass: each shard gets its share; second pass: top up from whoever has more
+        for index, name in enumerate(names):
+            share = math.ceil((count - len(tasks)) / (len(names) - index))
+            if share > 0:
+                tasks += self._track(name, self._shards[name].claim_many(share, policy=policy))
+        for name in names:
+            if len(tasks) >= count:
+                break
+            tasks += self._track(name, self._shards[name].claim_many(count - len(tasks), policy=policy))
+        if tasks or not timeout:
+            return tasks
+
+        deadline = time.monotonic() + timeout
+        for name in itertools.cycle(names):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            wait = remaining if len(names) == 1 else min(self._block_slice, remaining)
+            tasks = self._shards[name].claim_many(count, timeout=wait, policy=policy)
+            if tasks:
+                return self._track(name, tasks)
+
+    def release(self, tasks):
+        for name, shard_tasks in self._by_shard(tasks).items():
+            self._shards[name].release(shard_tasks)
+        for task in tasks:
+            self._forget(task)
+
+    def extend_lease(self, tasks, ttl=None):
+        for name, shard_tasks in self._by_shard(tasks).items():
+            self._shards[name].extend_lease(shard_tasks, ttl)
+
+    def reap_expired(self, batch_size=100):
+        return sum(shard.reap_expired(batch_size) for shard in self._shards.values())
+
+    def promote_due(self, batch_size=500):
+        return sum(shard.promote_due(batch_size) for shard in self._shards.values())
+
+    def _locate(self, task_id):
+        # the ring owner first; after a shard was added the task may still live on its old shard
+        owner = self._shard_name(task_id)
+        task = self._shards[owner].get_task(task_id)
+        if task is not None:
+            return owner, task
+        for name, shard in self._shards.items():
+            if name != owner:
+                task = shard.get_task(task_id)
+                if task is not None:
+                    return name, task
+        return owner, None
+
+    def get_task(self, task_id):
+        return self._locate(task_id)[1]
+
+    def update_task(self, task):
+        self._shard_for(task.id).update_task(task)
+
+    def mark_processing(self, task):
+        self._shard_for(task.id).mark_processing(task)
+
+    def mark_completed(self, task, result=None):
+        self._shard_for(task.id).mark_completed(task, result=result)
+        self._forget(task)
+
+    def mark_failed(self, task, error=None):
+        self._shard_for(task.id).mark_failed(task, error=error)
+        self._forget(task)
+
+    def wait_for_result(self, task_id, timeout=None):
+        name, _ = self._locate(task_id)
+        return self._shards[name].wait_for_result(task_id, timeout)
+
+    def purge_finished(self, older_than=0, ttl=None, batch_size=500):
+        return sum(shard.purge_finished(older_than, ttl, batch_size) for shard in self._shards.values())
+
+    def requeue(self, task, delay=None):
+        self._shard_for(task.id).requeue(task, delay=delay)
+        self._forget(task)
+
+    def get_queue_length(self, priority=None):
+        return sum(shard.get_queue_length(priority) for shard in self._shards.values())
+
+    def get_processing_count(self):
+        return sum(shard.get_processing_count() for shard in self._shards.values())
+
+    def get_stats(self):
+        """Stats of all shards added up; each shard's numbers are consistent on their own."""
+        stats = {}
+        for shard in self._shards.values():
+            _merge_stats(stats, shard.get_stats())
+        return stats
+
+    def close(self):
+        for shard in self._shards.values():
+            shard.close()
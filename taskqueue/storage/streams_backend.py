@@ -0,0 +1,423 @@
+import os
+import socket
+import time
+import uuid
+import redis
+from taskqueue.storage.base import storage_backend, _counters_from_fields
+from taskqueue.storage.connection import make_client
+from taskqueue.storage.redis_backend import RedisLayout, RedisBackend, PURGE_SCRIPT, LEASE_EXPIRED_ERROR
+from taskqueue.task import TaskStatus, priority_name, resolve_level, _to_str
+from taskqueue.codec import JSONCodec
+from taskqueue.scheduler import StrictPolicy
+
+# Same as PROMOTE_SCRIPT in redis_backend, but due ids are appended to streams.
+# KEYS: delayed zsets followed by their streams, in the same order
+# ARGV[1]: task key prefix, ARGV[2]: current time, ARGV[3]: batch size
+STREAMS_PROMOTE_SCRIPT = """
+local pairs_count = #KEYS / 2
+local promoted = 0
+for i = 1, pairs_count do
+    local due = redis.call('ZRANGEBYSCORE', KEYS[i], '-inf', ARGV[2], 'LIMIT', 0, ARGV[3])
+    if #due > 0 then
+        redis.call('ZREM', KEYS[i], unpack(due))
+        for _, task_id in ipairs(due) do
+            redis.call('XADD', KEYS[pairs_count + i], '*', 'id', task_id)
+            redis.call('HSET', ARGV[1] .. task_id, 'status', 'enqueued', 'updated_at', ARGV[2])
+        end
+        promoted = promoted + #due
+    end
+end
+return promoted
+"""
+
+
+class StreamsBackend(RedisLayout, storage_backend):
+    """Backend on Redis Streams with a consumer group per queue.
+
+    Each priority is a stream whose entries carry only the task id; the task
+    record is the same hash `RedisBackend` uses. Workers read with
+    XREADGROUP, so every entry is delivered to exactly one consumer and stays
+    in the group's pending list until it is acknowledged by
+    `mark_completed`/`mark_failed`/`requeue`. Entries left pending by a
+    crashed consumer for longer than `claim_idle` seconds are taken over with
+    XAUTOCLAIM and run again (at-least-once delivery). Delayed tasks wait in
+    zsets of their own and are appended to the streams by `promote_due`.
+    Large payloads can be kept out of the hash with `payload_threshold`, as
+    on `RedisBackend`.
+    """
+
+    STREAM_KEY = "task_queue:stream"
+    GROUP = "task_queue:workers"
+    DELAYED_KEY = "task_queue:stream:delayed" # kept apart from RedisBackend's, whose promoter pushes onto lists
+    KEY_NAMES = RedisLayout.KEY_NAMES + ('STREAM_KEY',)
+    PUSH_COMMAND = 'XADD'
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, codec=None, consumer=None, claim_idle=60.0, reclaim_interval=5.0, priorities=None, completed_ttl=None, failed_ttl=None, client=None, connection_pool=None, unix_socket_path=None, max_connections=None, key_prefix=None, payload_threshold=None, compression='auto'):
+        self._codec = codec or JSONCodec()
+        self._init_keys(key_prefix)
+        self._init_payloads(payload_threshold, compression)
+        self._init_levels(priorities) # one stream per level
+        self._completed_ttl = completed_ttl # seconds finished records are kept, None = forever
+        self._failed_ttl = failed_ttl
+        # connects lazily on a shared pool, like RedisBackend
+        self._redis, self._owns_client = make_client(
+            client, connection_pool, host=host, port=port, db=db, password=password,
+            unix_socket_path=unix_socket_path, max_connections=max_connections,
+        )
+
+        # unique per process so pending entries can be traced back to their owner
+        self._consumer = consumer or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._claim_idle_ms = int(claim_idle * 1000)
+        self._reclaim_interval = reclaim_interval
+        self._last_reclaim = 0.0
+        self._entries = {} # task id -> (stream, entry id) for tasks this consumer holds
+        self._groups_ready = False # consumer groups are created on first read
+
+        self._promote_script = self._redis.register_script(STREAMS_PROMOTE_SCRIPT)
+        self._purge_script = self._redis.register_script(PURGE_SCRIPT)
+
+    def _ensure_groups(self):
+        if self._groups_ready:
+            return
+        for stream in self._get_streams():
+            try:
+                self._redis.xgroup_create(stream, self.GROUP, id='0', mkstream=True)
+            except redis.ResponseError as e:
+                if "BUSYGROUP" not in str(e): # group already exists
+                    raise
+        self._groups_ready = True
+
+    def _get_stream(self, priority): # same clamping as RedisBackend's lists
+        return f"{self.STREAM_KEY}:{priority_name(resolve_level(priority, self.priorities))}"
+
+    _get_push_key = _get_stream
+
+    def _get_streams(self):
+        # highest priority first
+        return [self._get_stream(prior) for prior in self.priorities]
+
+    def _queue_add(self, pipe, task):
+        pipe.xadd(self._get_stream(task.priority), {'id': task.id})
+
+    def _queue_ack(self, pipe, task):
+        entry = self._entries.pop(task.id, None)
+        if entry is None:
+            # claimed through another backend instance; the hash remembers where
+            stream, entry_id = self._redis.hmget(self._get_task_key(task.id), 'stream', 'entry')
+            if not entry_id:
+                return
+            entry = (stream, entry_id)
+
+        stream, entry_id = entry
+        pipe.xack(stream, self.GROUP, entry_id)
+        pipe.xdel(stream, entry_id) # keep streams short, the hash holds the task
+
+    def push(self, task, eta=None, dedup_ttl=None):
+        self.push_many([task], eta=eta, dedup_ttl=dedup_ttl)
+
+    def push_many(self, tasks, eta=None, dedup_ttl=None):
+        if not tasks:
+            return
+
+        if any(task.dedup_key is not None for task in tasks):
+            pipe = self._redis.pipeline(transaction=False)
+            self._queue_dedup_push(pipe, tasks, eta, dedup_ttl)
+            self._apply_dedup(tasks, pipe.execute()[-1])
+            return
+
+        delayed = eta is not None and eta > time.time()
+        pipe = self._redis.pipeline(transaction=False)
+        self._queue_count(pipe, 'enqueued', tasks)
+        for task in tasks:
+            if delayed:
+                task.status = TaskStatus.SCHEDULED
+            self._queue_write_task(pipe, task)
+            if delayed:
+                pipe.zadd(self._get_delayed_key(task.priority), {task.id: eta})
+            else:
+                self._queue_add(pipe, task)
+        pipe.execute()
+
+    def promote_due(self, batch_size=500):
+        keys = self._get_delayed_keys() + self._get_streams()
+        return self._promote_script(keys=keys, args=[f"{self.TASK_KEY}:", time.time(), batch_size])
+
+    def _read_plan(self, count, policy):
+        """(stream, quota) pairs to read, in the order `policy` prefers."""
+        plan = policy.plan(self.priorities, count)
+        if not policy.age_step:
+            return [(self._get_stream(level), quota) for level, quota in plan]
+
+        # aging: rank each stream by its oldest undelivered entry, whose id
+        # is the millisecond time it was added
+        streams = [self._get_stream(level) for level, _ in plan]
+        pipe = self._redis.pipeline(transaction=False)
+        for stream in streams:
+            pipe.xinfo_groups(stream)
+        last_delivered = []
+        for groups in pipe.execute():
+            ids = [group['last-delivered-id'] for group in groups if _to_str(group['name']) == self.GROUP]
+            last_delivered.append(_to_str(ids[0]) if ids else '0-0')
+
+        pipe = self._redis.pipeline(transaction=False)
+        for stream, last_id in zip(streams, last_delivered):
+            pipe.xrange(stream, min=f"({last_id}", count=1)
+        now = time.time()
+        ranked = []
+        for (level, quota), stream, heads in zip(plan, streams, pipe.execute()):
+            rank = float('inf')
+            if heads:
+                added = int(_to_str(heads[0][0]).split('-')[0]) / 1000
+                rank = level - (now - added) / policy.age_step
+            ranked.append((rank, stream, quota))
+        ranked.sort(key=lambda item: item[0])
+        return [(stream, quota) for _, stream, quota in ranked]
+
+    def _read_new(self, count, timeout, plan=None):
+        # one XREADGROUP per stream, taking up to each stream's quota and then
+        # topping up in the same order; block on all of them at once only when
+        # every stream is empty
+        plan = plan or [(stream, count) for stream in self._get_streams()]
+        entries = []
+        drained = set() # streams that returned less than asked for
+        for stream, quota in plan + [(stream, count) for stream, _ in plan]:
+            wanted = min(quota, count - len(entries))
+            if wanted <= 0 or stream in drained:
+                continue
+            result = self._redis.xreadgroup(self.GROUP, self._consumer, {stream: '>'}, count=wanted)
+            read = 0
+            for stream_name, messages in result or []:
+                entries.extend((stream_name, entry_id, fields) for entry_id, fields in messages)
+                read += len(messages)
+            if read < wanted:
+                drained.add(stream)
+            if len(entries) >= count:
+                return entries
+
+        if not entries and timeout:
+            streams = {stream: '>' for stream, _ in plan}
+            result = self._redis.xreadgroup(self.GROUP, self._consumer, streams, count=1, block=int(timeout * 1000))
+            for stream_name, messages in result or []:
+                entries.extend((stream_name, entry_id, fields) for entry_id, fields in messages)
+        return entries
+
+    def _reclaim(self, count):
+        """Take over entries other consumers have held longer than claim_idle."""
+        entries = []
+        for stream in self._get_streams():
+            _, messages, *_ = self._redis.xautoclaim(stream, self.GROUP, self._consumer, self._claim_idle_ms, count=count - len(entries))
+            entries.extend((stream, entry_id, fields) for entry_id, fields in messages if fields)
+            if len(entries) >= count:
+                break
+        return entries
+
+    def claim(self, timeout=None, policy=None):
+        tasks = self.claim_many(1, timeout=timeout, policy=policy)
+        return tasks[0] if tasks else None
+
+    def claim_many(self, count, timeout=None, policy=None):
+        """Claim up to `count` tasks: reclaimed ones first, then new entries.
+
+        New entries are read stream by stream as `policy` plans (strict by
+        default); with aging, streams are visited oldest-first by rank.
+        """
+        self._ensure_groups()
+        reclaimed = []
+        now = time.monotonic()
+        if now - self._last_reclaim >= self._reclaim_interval:
+            self._last_reclaim = now
+            reclaimed = self._reclaim(count)
+
+        entries = reclaimed
+        if len(entries) < count:
+            wanted = count - len(entries)
+            plan = self._read_plan(wanted, policy or StrictPolicy())
+            entries = entries + self._read_new(wanted, None if reclaimed else timeout, plan)
+        if not entries:
+            return []
+
+        pipe = self._redis.pipeline(transaction=False)
+        for _, _, fields in entries:
+            pipe.hgetall(self._get_task_key(fields[b'id']))
+        records = pipe.execute()
+
+        tasks = []
+        pipe = self._redis.pipeline(transaction=False)
+        # entry ids are only unique within a stream; XREADGROUP names streams in bytes, XAUTOCLAIM as given
+        reclaimed_entries = {(_to_str(stream), _to_str(entry_id)) for stream, entry_id, _ in reclaimed}
+        for (stream, entry_id, _), fields in zip(entries, records):
+            if not fields:
+                # task record is gone, nothing to run
+                pipe.xack(stream, self.GROUP, entry_id)
+                pipe.xdel(stream, entry_id)
+                continue
+
+            task = self._task_from_fields(fields)
+            self._entries[task.id] = (stream, entry_id)
+            if (_to_str(stream), _to_str(entry_id)) in reclaimed_entries:
+                # its previous consumer died mid-task; that counts as an attempt
+                if not task.can_retry:
+                    task.status = TaskStatus.FAILED
+                    self._queue_ack(pipe, task)
+                    self._queue_count(pipe, 'failed', [task])
+                    self._queue_finish(pipe, task, error=LEASE_EXPIRED_ERROR)
+                    continue
+                task.increment_retry()
+                self._queue_count(pipe, 'retried', [task])
+
+            task.status = TaskStatus.PROCESSING
+            self._set_state(pipe, task)
+            pipe.hset(self._get_task_key(task.id), mapping={'stream': stream, 'entry': entry_id})
+            tasks.append(task)
+        pipe.execute()
+        return tasks
+
+    def _pop(self, streams, timeout):
+        # read one entry without touching the task status; it stays pending until acked
+        self._ensure_groups()
+        plan = [(stream, 1) for stream in streams] if streams else None
+        for stream, entry_id, fields in self._read_new(1, timeout, plan):
+            task = self.get_task(fields[b'id'])
+            if task:
+                self._entries[task.id] = (stream, entry_id)
+                return task
+        return None
+
+    def pop(self, priority=None):
+        streams = [self._get_stream(priority)] if priority is not None else None
+        return self._pop(streams, None)
+
+    def pop_blocking(self, timeout=1.0):
+        return self._pop(None, timeout)
+
+    def extend_lease(self, tasks, ttl=None):
+        """Reset the idle time of held entries so XAUTOCLAIM leaves them alone."""
+        entries_by_stream = {}
+        for task in tasks:
+            entry = self._entries.get(task.id)
+            if entry:
+                entries_by_stream.setdefault(entry[0], []).append(entry[1])
+
+        pipe = self._redis.pipeline(transaction=False)
+        for stream, entry_ids in entries_by_stream.items():
+            pipe.xclaim(stream, self.GROUP, self._consumer, 0, entry_ids, justid=True)
+        pipe.execute()
+
+    def release(self, tasks):
+        """Re-add unstarted tasks; streams are append-only, so they go to the back."""
+        if not tasks:
+            return
+
+        pipe = self._redis.pipeline(transaction=False)
+        for task in tasks:
+            task.status = TaskStatus.ENQUEUED
+            self._set_state(pipe, task)
+            self._queue_ack(pipe, task)
+            self._queue_add(pipe, task)
+        pipe.execute()
+
+    def get_task(self, task_id):
+        fields = self._redis.hgetall(self._get_task_key(task_id))
+        if not fields:
+            return None
+        return self._task_from_fields(fields)
+
+    def _fetch_payload(self, payload_key):
+        return self._redis.get(payload_key)
+
+    def update_task(self, task):
+        """Rewrite the full task record, payload included."""
+        pipe = self._redis.pipeline() # MULTI; stream/entry fields are kept
+        pipe.hdel(self._get_task_key(task.id), 'payload', 'payload_key')
+        pipe.delete(self._get_payload_key(task.id))
+        self._queue_write_task(pipe, task)
+        pipe.execute()
+
+    def requeue(self, task, delay=None):
+        pipe = self._redis.pipeline(transaction=False)
+        self._queue_ack(pipe, task)
+        self._queue_count(pipe, 'retried', [task])
+        if delay:
+            task.status = TaskStatus.SCHEDULED
+            pipe.zadd(self._get_delayed_key(task.priority), {task.id: time.time() + delay})
+        else:
+            task.status = TaskStatus.ENQUEUED  # reset status before pushing back
+            self._queue_add(pipe, task)
+        self._set_state(pipe, task)
+        pipe.execute()
+
+    def _finish(self, task, status, result=None, error=None):
+        task.status = status
+        pipe = self._redis.pipeline(transaction=False)
+        self._queue_ack(pipe, task)
+        self._queue_count(pipe, status, [task])
+        self._queue_finish(pipe, task, result, error)
+        pipe.execute()
+
+    def mark_processing(self, task):
+        # delivery through the group already tracks it as pending
+        task.status = TaskStatus.PROCESSING
+        pipe = self._redis.pipeline(transaction=False)
+        self._set_state(pipe, task)
+        pipe.execute()
+
+    def mark_completed(self, task, result=None):
+        self._finish(task, TaskStatus.COMPLETED, result=result)
+
+    def mark_failed(self, task, error=None):
+        self._finish(task, TaskStatus.FAILED, error=error)
+
+    # task records, done lists and purging work exactly as in RedisBackend
+    wait_for_result = RedisBackend.wait_for_result
+    purge_finished = RedisBackend.purge_finished
+
+    def _queue_stream_counts(self, pipe):
+        # XLEN counts undelivered + pending entries (acked ones are deleted)
+        self._ensure_groups() # XPENDING needs the groups
+        for stream in self._get_streams():
+            pipe.xlen(stream)
+            pipe.xpending(stream, self.GROUP)
+
+    def _stream_counts(self, results=None):
+        if results is None:
+            pipe = self._redis.pipeline(transaction=False)
+            self._queue_stream_counts(pipe)
+            results = pipe.execute()
+
+        counts = {}
+        for i, prior in enumerate(self.priorities):
+            length, pending = results[2 * i], results[2 * i + 1]['pending']
+            counts[prior] = (length - pending, pending)
+        return counts
+
+    def get_queue_length(self, priority=None):
+        counts = self._stream_counts()
+        if priority is not None:
+            return counts[resolve_level(priority, self.priorities)][0]
+        return sum(waiting for waiting, _ in counts.values())
+
+    def get_processing_count(self):
+        return sum(pending for _, pending in self._stream_counts().values())
+
+    def get_stats(self):
+        pipe = self._redis.pipeline() # MULTI: every count comes from the same instant
+        self._queue_stream_counts(pipe)
+        for delayed_key in self._get_delayed_keys():
+            pipe.zcard(delayed_key)
+        pipe.hgetall(self.COUNTERS_KEY)
+        results = pipe.execute()
+
+        levels = len(self.priorities)
+        counts = self._stream_counts(results[:2 * levels])
+        stats = {priority_name(prior): waiting for prior, (waiting, _) in counts.items()}
+        stats['processing'] = sum(pending for _, pending in counts.values())
+        stats['scheduled'] = sum(results[2 * levels:-1])
+        stats['total'] = sum(waiting for waiting, _ in counts.values())
+        stats.update(_counters_from_fields(results[-1]))
+        return stats
+
+    ping = RedisBackend.ping
+
+    def close(self):
+        if self._owns_client:
+            self._redis.close()
@@ -0,0 +1,155 @@
+import gc
+import logging
+import os
+import signal
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Supervisor:
+    """Runs a worker in `processes` forked children and keeps them running.
+
+    The worker (and every handler module it imported) is built once in this
+    process; children are forked from it, so they start in milliseconds and
+    share those pages copy-on-write. Nothing should have connected to Redis
+    before `run`: connection pools are per process and each child opens its
+    own.
+
+    A child that exits is restarted. One that exits within `min_uptime`
+    seconds of starting is restarted after a backoff doubling up to
+    `max_restart_delay` seconds, so a worker that can't start doesn't fork
+    in a tight loop.
+
+    SIGTERM or SIGINT stops the supervisor: each child gets SIGTERM, stops
+    claiming and finishes the tasks it holds. Children still busy after
+    `shutdown_timeout` seconds, or when a second signal arrives, are killed;
+    their leases expire and the tasks are reclaimed elsewhere.
+    """
+
+    def __init__(self, worker, processes=1, shutdown_timeout=30.0, min_uptime=5.0, max_restart_delay=60.0, check_interval=0.2):
+        if processes < 1:
+            raise ValueError("processes must be at least 1")
+        self._worker = worker # Worker or AsyncWorker, anything with run() and stop()
+        self._processes = processes
+        self._shutdown_timeout = shutdown_timeout
+        self._min_uptime = min_uptime
+        self._max_restart_delay = max_restart_delay
+        self._check_interval = check_interval # how often children are reaped and respawned
+        self._children = {} # pid -> slot
+        self._started = {} # slot -> monotonic start time of its current child
+        self._restart_at = {} # slot -> monotonic time before which it is not respawned
+        self._delays = {} # slot -> backoff applied to its last restart
+        self._stopping = False
+
+    def run(self):
+        """Fork the children and supervise them until SIGTERM/SIGINT.
+
+        Returns once every child has exited.
+        """
+        previous = {sig: signal.signal(sig, self._handle_signal) for sig in (signal.SIGTERM, signal.SIGINT)}
+        # everything imported so far lives as long as the process: keep the
+        # collector from writing to (and so copying) those pages in the children
+        gc.freeze()
+        logger.info("Supervisor (pid %s) starting %s worker processes", os.getpid(), self._processes)
+        try:
+            while not self._stopping:
+                self._reap()
+                self._spawn_missing()
+                time.sleep(self._check_interval)
+            self._drain()
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+        logger.info("Supervisor stopped")
+
+    def stop(self):
+        """Start a graceful shutdown, as SIGTERM does."""
+        self._stopping = True
+
+    def _handle_signal(self, signum, frame):
+        if self._stopping:
+            logger.warning("Got %s again, killing worker processes", signal.Signals(signum).name)
+            self._signal_children(signal.SIGKILL)
+            return
+        logger.info("Got %s, draining worker processes", signal.Signals(signum).name)
+        self._stopping = True
+
+    def _signal_children(self, sig):
+        for pid in list(self._children):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass # already gone, _reap collects it
+
+    def _drain(self):
+        self._signal_children(signal.SIGTERM)
+        deadline = time.monotonic() + self._shutdown_timeout
+        while self._children:
+            if time.monotonic() >= deadline:
+                logger.warning("%s worker processes still busy after %ss, killing them", len(self._children), self._shutdown_timeout)
+                self._signal_children(signal.SIGKILL)
+                deadline = float('inf')
+            self._reap()
+            if self._children:
+                time.sleep(self._check_interval)
+
+    def _reap(self):
+        """Collect exited children and schedule their replacement."""
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._children.clear()
+                return
+            if pid == 0:
+                return
+            slot = self._children.pop(pid, None)
+            if slot is None:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            if self._stopping:
+                logger.info("Worker process %s (pid %s) exited with %s", slot, pid, code)
+                continue
+
+            now = time.monotonic()
+            if now - self._started[slot] < self._min_uptime:
+                # crashing on startup: back off instead of forking in a loop
+                delay = min(max(self._delays.get(slot, 0) * 2, 1.0), self._max_restart_delay)
+            else:
+                delay = 0
+            self._delays[slot] = delay
+            self._restart_at[slot] = now + delay
+            logger.warning("Worker process %s (pid %s) exited with %s; restarting in %.1fs", slot, pid, code, delay)
+
+    def _spawn_missing(self):
+        running = set(self._children.values())
+        now = time.monotonic()
+        for slot in range(self._processes):
+            if slot not in running and now >= self._restart_at.get(slot, 0):
+                self._spawn(slot)
+
+    def _spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            self._run_child(slot) # never returns
+        self._children[pid] = slot
+        self._started[slot] = time.monotonic()
+        logger.info("Started worker process %s (pid %s)", slot, pid)
+
+    def _run_child(self, slot):
+        status = 1
+        try:
+            # Ctrl-C reaches the whole process group; the supervisor decides what happens
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, lambda signum, frame: self._worker.stop())
+            self._worker.run()
+            status = 0
+        except BaseException:
+            logger.exception("Worker process %s crashed", slot)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
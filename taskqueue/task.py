@@ -1,33 +1,133 @@
+from bisect import bisect_left
 from datetime import datetime, timezone
+import functools
 import json
+import time
 import uuid
+from taskqueue.codec import JSONCodec, get_codec
+
+
+def _to_str(value):
+    return value.decode() if isinstance(value, bytes) else value
+
 
 class TaskStatus:
     PENDING = 'pending'
     ENQUEUED = 'enqueued'
+    SCHEDULED = 'scheduled' # waiting for its eta or retry backoff
     COMPLETED = 'completed'
     FAILED = 'failed'
     PROCESSING = 'processing'
 
 
 class Priority:
-    """ level 1 to 3 """
+    """ level 1 to 3; any integer works as a level, lower runs first """
     High = 1
     Medium = 2
     Low = 3
 
+
+DEFAULT_PRIORITIES = (Priority.High, Priority.Medium, Priority.Low)
+_PRIORITY_NAMES = {Priority.High: 'high', Priority.Medium: 'medium', Priority.Low: 'low'}
+
+
+def priority_name(level):
+    """Name used in queue keys and stats: 'high'/'medium'/'low', else the number."""
+    return _PRIORITY_NAMES.get(level, str(level))
+
+
+def resolve_level(priority, levels):
+    """Map a task priority onto one of a backend's sorted `levels`.
+
+    Levels the backend doesn't have are clamped: anything between two levels
+    goes to the next lower one (the higher number), anything outside the
+    range to the nearest end.
+    """
+    if priority is None:
+        return levels[len(levels) // 2]
+    i = bisect_left(levels, priority)
+    return levels[min(i, len(levels) - 1)]
+
+def _unloaded_payload(payload_key):
+    raise ValueError(f"task payload is stored out of band under {_to_str(payload_key)!r} and this backend did not load it")
+
+def _to_epoch(value):
+    """Normalise a created_at value (epoch, datetime or ISO string) to epoch seconds."""
+    if value is None:
+        return time.time()
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).timestamp() # records written before epoch timestamps
+    return float(value)
+
+
 class Task:
+    # no per-instance __dict__: monitoring code may hold hundreds of thousands of these
+    __slots__ = ('id', 'name', 'priority', 'status', 'created_at', 'retry_count', 'max_retries', 'result', 'error', 'dedup_key', '_args', '_kwargs', '_raw_payload', '_payload_loader')
 
-    def __init__(self, name, id=None, args = None, kwargs = None, priority=Priority.High, status = TaskStatus.PENDING, created_at = None, retry_count=0, max_retries=3):
+    def __init__(self, name, id=None, args = None, kwargs = None, priority=Priority.High, status = TaskStatus.PENDING, created_at = None, retry_count=0, max_retries=3, raw_payload=None, result=None, error=None, dedup_key=None, payload_loader=None):
         self.id = id or str(uuid.uuid4())
         self.name = name
-        self.args = args or () # 'or' returns the first truthy value
-        self.kwargs = kwargs if kwargs is not None else {}
+        self._args = args or () # 'or' returns the first truthy value
+        self._kwargs = kwargs if kwargs is not None else {}
+        self._raw_payload = raw_payload # encoded args/kwargs, decoded on first access
+        self._payload_loader = payload_loader # fetches raw_payload stored out of band, on first access
         self.priority = priority
         self.retry_count = retry_count
         self.max_retries = max_retries
-        self.created_at = created_at or datetime.now(timezone.utc)
+        self.created_at = _to_epoch(created_at) # epoch seconds
         self.status = status
+        self.result = result # handler return value, once completed
+        self.error = error # description of the last failure, once failed
+        self.dedup_key = dedup_key # while queued or running, enqueues with the same key return this task
+
+    def _fetch_payload(self):
+        if self._payload_loader is not None:
+            self._raw_payload = self._payload_loader()
+            self._payload_loader = None
+            if self._raw_payload is None:
+                raise ValueError(f"payload of task {self.id} is gone")
+
+    def _load_payload(self):
+        self._fetch_payload()
+        if self._raw_payload is not None:
+            raw = self._raw_payload
+            self._args, self._kwargs = get_codec(raw).decode_payload(raw)
+            self._raw_payload = None
+
+    @property
+    def args(self):
+        self._load_payload()
+        return self._args
+
+    @args.setter
+    def args(self, value):
+        self._load_payload()
+        self._args = value
+
+    @property
+    def kwargs(self):
+        self._load_payload()
+        return self._kwargs
+
+    @kwargs.setter
+    def kwargs(self, value):
+        self._load_payload()
+        self._kwargs = value
+
+    def __getstate__(self):
+        # a loader holds a client, so fetch the bytes before crossing a process boundary
+        self._fetch_payload()
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+
+    @property
+    def created_datetime(self):
+        return datetime.fromtimestamp(self.created_at, timezone.utc)
 
     def to_json(self):
         data = {
@@ -37,7 +137,7 @@ class Task:
             'kwargs': self.kwargs,
             'priority': self.priority,
             'status': self.status,
-            'created_at': self.created_at.isoformat(),
+            'created_at': self.created_at,
             'retry_count': self.retry_count,
             'max_retries': self.max_retries,
         }
@@ -46,12 +146,53 @@ class Task:
     @staticmethod
     def from_json(json_str):
         data = json.loads(json_str)
-        data['created_at'] = datetime.fromisoformat(data['created_at'])
         # ensure retry fields are present
         data.setdefault('retry_count', 0)
         data.setdefault('max_retries', 3)
         return Task(**data)
     
+    def to_hash(self, codec=None):
+        """Split the task into hash fields for storage.
+
+        `data` and `payload` never change after the task is created, so status
+        transitions only need to rewrite `status` and `retry_count`.
+        """
+        codec = codec or JSONCodec()
+        fields = {
+            'data': codec.encode_data(self),
+            'payload': codec.encode_payload(self.args, self.kwargs),
+            'status': self.status,
+            'retry_count': self.retry_count,
+        }
+        if self.dedup_key is not None:
+            fields['dedup_key'] = self.dedup_key
+        return fields
+
+    @staticmethod
+    def from_hash(fields, load_payload=None):
+        """Rebuild a task from hash fields written by any codec.
+
+        A payload stored out of band (`payload_key`) is fetched with
+        `load_payload(payload_key)` the first time `args`/`kwargs` are read.
+        """
+        raw_data = fields['data']
+        data = get_codec(raw_data).decode_data(raw_data)
+        # records migrated from the old string layout keep everything in `data`
+        if 'payload' in fields:
+            data['raw_payload'] = fields['payload']
+        elif 'payload_key' in fields:
+            data['payload_loader'] = functools.partial(load_payload or _unloaded_payload, fields['payload_key'])
+        data['status'] = _to_str(fields.get('status', data.get('status', TaskStatus.PENDING)))
+        data['retry_count'] = int(fields.get('retry_count', data.get('retry_count', 0)))
+        data.setdefault('max_retries', 3)
+        if 'result' in fields:
+            data['result'] = json.loads(fields['result'])
+        if 'error' in fields:
+            data['error'] = _to_str(fields['error'])
+        if 'dedup_key' in fields:
+            data['dedup_key'] = _to_str(fields['dedup_key'])
+        return Task(**data)
+
     """ retrying if retry counts left """
     @property
     def can_retry(self):
@@ -1,29 +1,125 @@
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import logging
+import multiprocessing
+import queue
+import threading
 import time
 from taskqueue.task import Task, TaskStatus
 from taskqueue.storage.redis_backend import RedisBackend
-from taskqueue.scheduler import Scheduler
+from taskqueue.scheduler import Scheduler, Promoter, retry_delay
+from taskqueue.reaper import Reaper
+from taskqueue.metrics import WorkerMetrics
 
 logger = logging.getLogger(__name__)
 
+# Handlers available inside process-pool children, installed by _init_process.
+_process_handlers = {}
+
+
+def _init_process(handlers):
+    global _process_handlers
+    _process_handlers = handlers
+
+
+def _run_in_process(task_name, args, kwargs):
+    return _process_handlers[task_name](*args, **kwargs)
+
+
+def _run_batch_in_process(task_name, tasks):
+    return _process_handlers[task_name](tasks)
+
 
 class Worker:
-    def __init__(self, backend=None, redis_host='localhost', redis_port=6379, redis_db=0, redis_password=None, concurrency=1, poll_interval=1.0):
-        """Initialize the worker."""
-        if backend is not None:
-            self._backend = backend
-        else:
-            self._backend = RedisBackend(host=redis_host, port=redis_port, db=redis_db, password=redis_password)
+    def __init__(self, backend=None, redis_host='localhost', redis_port=6379, redis_db=0, redis_password=None, redis_unix_socket=None, concurrency=1, poll_interval=1.0, blocking=True, prefetch=0, execution="thread", heartbeat_interval=10.0, reap_interval=5.0, promote_interval=0.5, retry_backoff=1.0, retry_backoff_max=300.0, retry_jitter=True, policy=None):
+        """Initialize the worker.
+
+        `execution="process"` runs handlers in a pool of `concurrency` child
+        processes (for CPU-bound work) while claiming stays in this process.
+        When a child dies, the pool is replaced and every task it had in
+        flight runs again in a process of its own, so only a task that
+        crashes that one too is counted as failed.
+
+        Every `heartbeat_interval` seconds the worker extends the lease on the
+        tasks it holds; keep it well below the backend's lease TTL. With
+        `reap_interval` set, it also reclaims tasks of dead workers, and with
+        `promote_interval` set it moves delayed tasks onto their queues once due.
+
+        Failed tasks are retried after an exponential backoff starting at
+        `retry_backoff` seconds and capped at `retry_backoff_max`;
+        `retry_backoff=0` retries immediately.
+
+        `policy` is a `SchedulingPolicy` deciding how claims are shared
+        between priority levels; strict priority order by default.
+
+        Timings and counters are collected in `worker.metrics` (see
+        `WorkerMetrics`); `before_task`/`after_task` register hooks.
+
+        Without a `backend`, a `RedisBackend` is built on a blocking pool
+        sized to `concurrency`; it connects on first use.
+        """
+        if execution not in ("thread", "process"):
+            raise ValueError(f"execution must be 'thread' or 'process', not {execution!r}")
 
-        self._scheduler = Scheduler(self._backend)
+        # settings of the backend this worker builds itself, None when one was passed in
+        self._redis_settings = None if backend is not None else dict(host=redis_host, port=redis_port, db=redis_db, password=redis_password, unix_socket_path=redis_unix_socket)
+        self._policy = policy
+        self._reap_interval = reap_interval
+        self._promote_interval = promote_interval
+        self._use_backend(backend if backend is not None else self._default_backend(concurrency))
         self._handlers = {}
+        self._batch_limits = {} # batch task name -> (max_size, max_wait)
+        self._batches = {} # batch task name -> (flush deadline, claimed tasks waiting for it)
+        self._batches_lock = threading.Lock()
         self._concurrency = concurrency
         self._poll_interval = poll_interval
+        self._blocking = blocking # block on the backend instead of sleeping between polls
+        self._prefetch = prefetch # tasks claimed ahead of time per round trip, 0 disables
+        self._buffer = queue.Queue()
+        self._buffer_slots = threading.Semaphore(prefetch) # bounds the buffer to `prefetch` tasks
+        self._prefetch_thread = None
+        self._execution = execution
+        self._process_pool = None
+        self._process_pool_lock = threading.Lock()
+        self._claimed = {} # task id -> task, everything this worker holds a lease on
+        self._claimed_lock = threading.Lock()
+        self._heartbeat_interval = heartbeat_interval
+        self._retry_backoff = retry_backoff
+        self._retry_backoff_max = retry_backoff_max
+        self._retry_jitter = retry_jitter
+        self._maintenance_thread = None
+        self._maintenance_stop = threading.Event()
+        self.metrics = WorkerMetrics()
+        self._before_hooks = []
+        self._after_hooks = []
         self._executor = None
         self._running = False
         self._shutdown_requested = False
 
+    def _default_backend(self, concurrency):
+        # one connection per handler thread plus the claim, prefetch and maintenance threads
+        return RedisBackend(**self._redis_settings, max_connections=concurrency + 3)
+
+    def _use_backend(self, backend):
+        self._backend = backend
+        self._scheduler = Scheduler(backend, self._policy)
+        self._reaper = Reaper(backend, interval=self._reap_interval) if self._reap_interval else None
+        self._promoter = Promoter(backend, interval=self._promote_interval) if self._promote_interval else None
+
+    def set_concurrency(self, concurrency):
+        """Change how many tasks run at once; only before `run`.
+
+        A backend the worker built itself is rebuilt with a pool to match
+        (it has not connected yet); a backend passed in is left as is.
+        """
+        if self._running:
+            raise RuntimeError("cannot change the concurrency of a running worker")
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self._concurrency = concurrency
+        if self._redis_settings is not None:
+            self._use_backend(self._default_backend(concurrency))
+
     def task(self, name=None):
         def decorator(func):
             task_name = name or func.__name__
@@ -37,49 +133,376 @@ class Worker:
         self._handlers[name] = handler
         logger.debug("Task handler '%s' registered.", name)
 
+    def batch_task(self, name=None, max_size=100, max_wait=0.05):
+        """Decorator form of `register_batch`."""
+        def decorator(func):
+            self.register_batch(name or func.__name__, func, max_size=max_size, max_wait=max_wait)
+            return func
+
+        return decorator
+
+    def register_batch(self, name, handler, max_size=100, max_wait=0.05):
+        """Register a handler that receives a list of up to `max_size` tasks at once.
+
+        Claimed tasks of this name are collected until `max_size` are waiting
+        or the oldest has waited `max_wait` seconds, then `handler(tasks)` is
+        called once with the `Task` objects. It may return a list with one
+        entry per task: the task's result, or an exception instance to fail
+        just that task (it is retried like any other failure). Returning
+        anything else completes every task with that result; raising fails
+        them all.
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self._handlers[name] = handler
+        self._batch_limits[name] = (max_size, max_wait)
+        logger.debug("Batch task handler '%s' registered (max_size=%s, max_wait=%s).", name, max_size, max_wait)
+
+    def before_task(self, hook):
+        """Register `hook(task)`, called before each handler runs. Usable as a decorator."""
+        self._before_hooks.append(hook)
+        return hook
+
+    def after_task(self, hook):
+        """Register `hook(task, outcome, error)`, called once a task is settled.
+
+        `outcome` is 'completed', 'retried' or 'failed'; `error` is the
+        exception the handler raised, or None. Usable as a decorator.
+        """
+        self._after_hooks.append(hook)
+        return hook
+
+    def _run_hooks(self, hooks, *args):
+        for hook in hooks:
+            try:
+                hook(*args)
+            except Exception as e:
+                logger.error("Task hook %r failed: %s", hook, e)
+
+    def _timed(self, operation, call, *args, **kwargs):
+        # records the backend round trip under `operation`
+        start = time.perf_counter()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            self.metrics.observe_backend(operation, time.perf_counter() - start)
+
     def _process_task(self, task):
-        """Process one task."""
+        """Process one task already claimed (marked processing) by the backend."""
         handler = self._handlers.get(task.name)
         if not handler:
             raise ValueError(f"Registration for task '{task.name}' not found.")
 
+        self.metrics.observe_task(task.name, 'queue_wait', time.time() - task.created_at)
+        self._run_hooks(self._before_hooks, task)
+        result = error = None
+        logger.debug("Processing task (%s)", task.name)
+        started = time.perf_counter()
         try:
-            logger.info(f"Processing task ({task.name})")
-            self._backend.mark_processing(task)
-            handler(*task.args, **task.kwargs)
-            self._backend.mark_completed(task)
-            logger.info(f"Task ({task.name}) completion successful.")
+            result = self._call_handler(handler, task)
+        except Exception as e:
+            error = e
+        finally:
+            self.metrics.observe_task(task.name, 'run', time.perf_counter() - started)
+        self._settle(task, result, error)
+
+    def _process_batch(self, name, tasks):
+        """Run a batch handler once for `tasks` and settle each task on its own."""
+        now = time.time()
+        for task in tasks:
+            self.metrics.observe_task(name, 'queue_wait', now - task.created_at)
+            self._run_hooks(self._before_hooks, task)
 
+        logger.debug("Processing batch of %s tasks (%s)", len(tasks), name)
+        started = time.perf_counter()
+        try:
+            results = self._call_batch_handler(self._handlers[name], name, tasks)
         except Exception as e:
-            logger.error("Task (%s) failed. Error: %s", task.name, e)
+            results = [e] * len(tasks)
+        finally:
+            self.metrics.observe_task(name, 'run', time.perf_counter() - started)
+        self.metrics.incr('batches')
+
+        if not isinstance(results, (list, tuple)):
+            results = [results] * len(tasks)
+        elif len(results) != len(tasks):
+            error = ValueError(f"batch handler returned {len(results)} results for {len(tasks)} tasks")
+            results = [error] * len(tasks)
+
+        for task, result in zip(tasks, results):
+            if isinstance(result, BaseException):
+                self._settle(task, None, result)
+            else:
+                self._settle(task, result, None)
+
+    def _settle(self, task, result, error):
+        """Complete, retry or fail a task whose handler returned `result` or raised `error`."""
+        if error is None:
+            try:
+                self._timed('mark_completed', self._backend.mark_completed, task, result=result)
+                outcome = 'completed'
+                logger.debug("Task (%s) completion successful.", task.name)
+            except Exception as e:
+                error = e # could not record it; treat like a handler failure
+
+        if error is not None:
+            logger.error("Task (%s) failed. Error: %s", task.name, error)
             if task.can_retry:
                 task.increment_retry() 
-                logger.info(f"requeuing task ({task.name})")
-                logger.info(f"retries left: {task.retry_count+1}/{task.max_retries}")
-                self._backend.requeue(task)
+                delay = retry_delay(task.retry_count, self._retry_backoff, self._retry_backoff_max, self._retry_jitter)
+                logger.info("Requeuing task (%s) in %.2fs, retry %s/%s", task.name, delay, task.retry_count, task.max_retries)
+                self._timed('requeue', self._backend.requeue, task, delay=delay)
+                outcome = 'retried'
             else:
-                logger.warning(f"Max retries reached for task ({task.name})")
-                self._backend.mark_failed(task)
+                logger.warning("Max retries reached for task (%s)", task.name)
+                self._timed('mark_failed', self._backend.mark_failed, task, error=f"{type(error).__name__}: {error}")
+                outcome = 'failed'
+
+        self.metrics.incr(outcome)
+        if outcome != 'retried':
+            self.metrics.observe_task(task.name, 'end_to_end', time.time() - task.created_at)
+        self._run_hooks(self._after_hooks, task, outcome, error)
+
+    def _call_handler(self, handler, task):
+        if self._execution == "thread":
+            return handler(*task.args, **task.kwargs)
+
+        # only the name and arguments cross the process boundary
+        pool = self._process_pool
+        try:
+            return pool.submit(_run_in_process, task.name, task.args, task.kwargs).result()
+        except BrokenProcessPool:
+            # a child died (OOM, segfault...); swap in a fresh pool and rerun
+            # this task on its own, where a crash can only be its own fault
+            self._replace_process_pool(pool)
+            return self._run_isolated(_run_in_process, task.name, task.args, task.kwargs)
+
+    def _call_batch_handler(self, handler, name, tasks):
+        if self._execution == "thread":
+            return handler(tasks)
+
+        pool = self._process_pool
+        try:
+            return pool.submit(_run_batch_in_process, name, tasks).result()
+        except BrokenProcessPool:
+            self._replace_process_pool(pool)
+            return self._run_isolated(_run_batch_in_process, name, tasks)
+
+    def _run_isolated(self, fn, *args):
+        """Run `fn` in a single-use process; BrokenProcessPool here fails just this call."""
+        logger.warning("Rerunning a task interrupted by a crashed process on its own")
+        with self._create_process_pool(max_workers=1) as pool:
+            return pool.submit(fn, *args).result()
+
+    def _add_to_batch(self, task):
+        """Queue a claimed task for its batch; returns the batch if it is now full."""
+        max_size, max_wait = self._batch_limits[task.name]
+        with self._batches_lock:
+            deadline, tasks = self._batches.setdefault(task.name, (time.monotonic() + max_wait, []))
+            tasks.append(task)
+            if len(tasks) >= max_size:
+                del self._batches[task.name]
+                return tasks
+        return None
+
+    def _take_due_batches(self, force=False):
+        now = time.monotonic()
+        with self._batches_lock:
+            due = [name for name, (deadline, _) in self._batches.items() if force or deadline <= now]
+            return [(name, self._batches.pop(name)[1]) for name in due]
+
+    def _run_batch(self, name, tasks):
+        try:
+            self._process_batch(name, tasks)
+        finally:
+            self._untrack(tasks)
+
+    def _run_due_batches(self, force=False):
+        for name, tasks in self._take_due_batches(force):
+            self._run_batch(name, tasks)
+
+    def _wait_timeout(self):
+        # wait for new work no longer than until the next batch is due
+        with self._batches_lock:
+            deadlines = [deadline for deadline, _ in self._batches.values()]
+        if not deadlines:
+            return self._poll_interval
+        return max(0.0, min(self._poll_interval, min(deadlines) - time.monotonic()))
+
+    def _create_process_pool(self, max_workers=None):
+        # fork so children inherit imported handler modules (and closures) without pickling
+        start_methods = multiprocessing.get_all_start_methods()
+        mp_context = multiprocessing.get_context("fork") if "fork" in start_methods else None
+        return ProcessPoolExecutor(
+            max_workers=max_workers or self._concurrency,
+            mp_context=mp_context,
+            initializer=_init_process,
+            initargs=(self._handlers,),
+        )
+
+    def _replace_process_pool(self, broken_pool):
+        with self._process_pool_lock:
+            # several threads can see the same broken pool; only replace it once
+            if self._process_pool is not broken_pool:
+                return
+            logger.warning("Process pool broken, starting a new one")
+            broken_pool.shutdown(wait=False)
+            self._process_pool = self._create_process_pool()
+
+    def _prefetch_loop(self):
+        """Claim tasks in batches into the local buffer drained by _worker_loop."""
+        while self._running:
+            if not self._buffer_slots.acquire(timeout=self._poll_interval):
+                continue
+            # grab every free slot so a single claim fills the buffer
+            count = 1
+            while count < self._prefetch and self._buffer_slots.acquire(blocking=False):
+                count += 1
+
+            tasks = []
+            try:
+                timeout = self._poll_interval if self._blocking else None
+                tasks = self._claim(count, timeout)
+            except Exception as e:
+                logger.error("Error found in prefetch loop: %s", e)
+                time.sleep(self._poll_interval)
+
+            # every buffered task holds one of the `count` slots taken above
+            tasks = self._keep(tasks, count)
+            self._track(tasks)
+            for task in tasks:
+                self._buffer.put(task)
+            for _ in range(count - len(tasks)):
+                self._buffer_slots.release()
+
+            if not tasks and not self._blocking:
+                time.sleep(self._poll_interval)
+
+    def _next_task(self):
+        timeout = self._wait_timeout()
+        if self._prefetch:
+            try:
+                task = self._buffer.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            self._buffer_slots.release()
+            return task
+
+        if self._blocking:
+            # poll_interval doubles as the block timeout so shutdown is still noticed
+            tasks = self._claim(1, timeout)
+        else:
+            tasks = self._claim(1, None)
+            if not tasks:
+                time.sleep(timeout)
+
+        if tasks:
+            # only the task about to run is tracked; a tracked task is heartbeated forever
+            tasks = self._keep(tasks, 1)
+            self._track(tasks)
+            return tasks[0]
+        return None
+
+    def _claim(self, count, timeout):
+        start = time.perf_counter()
+        tasks = self._scheduler.claim_next_tasks(count, timeout=timeout)
+        if not tasks:
+            # a blocking claim that came back empty only measured the timeout
+            self.metrics.incr('empty_polls')
+            return tasks
+
+        self.metrics.observe_backend('claim', time.perf_counter() - start)
+        self.metrics.incr('claims')
+        self.metrics.incr('claimed_tasks', len(tasks))
+        return tasks
+
+    def _keep(self, tasks, count):
+        """The first `count` tasks; any more the backend handed over go straight back."""
+        if len(tasks) <= count:
+            return tasks
+        logger.warning("Claim of %s returned %s tasks, releasing the rest", count, len(tasks))
+        try:
+            self._timed('release', self._backend.release, tasks[count:])
+        except Exception as e:
+            logger.error("Failed to release over-claimed tasks: %s", e)
+        return tasks[:count]
+
+    def _track(self, tasks):
+        with self._claimed_lock:
+            for task in tasks:
+                self._claimed[task.id] = task
+
+    def _untrack(self, tasks):
+        with self._claimed_lock:
+            for task in tasks:
+                self._claimed.pop(task.id, None)
+
+    def _maintenance_loop(self):
+        """Heartbeat held tasks and run the embedded reaper and promoter."""
+        next_heartbeat = next_reap = next_promote = time.monotonic()
+        while not self._maintenance_stop.is_set():
+            now = time.monotonic()
+            if self._heartbeat_interval and now >= next_heartbeat:
+                next_heartbeat = now + self._heartbeat_interval
+                with self._claimed_lock:
+                    held = list(self._claimed.values())
+                try:
+                    self._timed('extend_lease', self._backend.extend_lease, held)
+                except Exception as e:
+                    logger.error("Failed to extend task leases: %s", e)
+
+            if self._reaper and now >= next_reap:
+                next_reap = now + self._reap_interval
+                try:
+                    self._timed('reap', self._reaper.run_once)
+                except Exception as e:
+                    logger.error("Error found in reaper: %s", e)
+
+            if self._promoter and now >= next_promote:
+                next_promote = now + self._promote_interval
+                try:
+                    self._timed('promote', self._promoter.run_once)
+                except Exception as e:
+                    logger.error("Error found in promoter: %s", e)
+
+            intervals = [i for i in (self._heartbeat_interval, self._reaper and self._reap_interval, self._promoter and self._promote_interval) if i]
+            self._maintenance_stop.wait(min(intervals))
 
     def _worker_loop(self):
         while self._running:
             try:
-                task = self._scheduler.get_next_task()
+                self._run_due_batches()
+                task = self._next_task()
                 if not task:
-                    time.sleep(self._poll_interval)
                     continue
 
-                if task.name not in self._handlers:
-                    logger.error("No handlers for task '%s'. Moving on", task.name)
-                    self._backend.mark_failed(task)
+                if task.name in self._batch_limits:
+                    batch = self._add_to_batch(task)
+                    if batch:
+                        self._run_batch(task.name, batch)
                     continue
 
-                self._process_task(task)
+                try:
+                    if task.name not in self._handlers:
+                        logger.error("No handlers for task '%s'. Moving on", task.name)
+                        self._timed('mark_failed', self._backend.mark_failed, task, error=f"no handler registered for '{task.name}'")
+                        self.metrics.incr('unhandled')
+                        continue
+
+                    self._process_task(task)
+                finally:
+                    self._untrack([task])
 
             except Exception as e:
                 logger.error("Error found in worker loop: %s", e)
                 time.sleep(self._poll_interval)
 
+        # claimed tasks still waiting for a batch run now rather than sit until their lease expires
+        try:
+            self._run_due_batches(force=True)
+        except Exception as e:
+            logger.error("Error running remaining batches: %s", e)
+
     def run(self):
         if self._running:
             logger.warning("Worker is already running.")
@@ -91,6 +514,18 @@ class Worker:
         logger.info("Worker started with concurrency: %s", self._concurrency)
         logger.info("Registered task handlers : %s", list(self._handlers.keys()))
 
+        if self._execution == "process":
+            self._process_pool = self._create_process_pool()
+
+        if self._heartbeat_interval or self._reaper or self._promoter:
+            self._maintenance_stop.clear()
+            self._maintenance_thread = threading.Thread(target=self._maintenance_loop, name="taskqueue-maintenance", daemon=True)
+            self._maintenance_thread.start()
+
+        if self._prefetch:
+            self._prefetch_thread = threading.Thread(target=self._prefetch_loop, name="taskqueue-prefetch")
+            self._prefetch_thread.start()
+
         try:
             if self._concurrency == 1:
                 self._worker_loop()
@@ -110,6 +545,10 @@ class Worker:
         finally:
             self._shutdown()
 
+    def stop(self):
+        """Ask the worker loops to exit; tasks already running are allowed to finish."""
+        self._running = False
+
     def _shutdown(self):
         logger.info("Shutting worker down")
         self._running = False
@@ -118,9 +557,40 @@ class Worker:
             self._executor.shutdown(wait=True)
             self._executor = None
 
+        if self._prefetch_thread and self._prefetch_thread is not threading.current_thread():
+            self._prefetch_thread.join()
+            self._prefetch_thread = None
+        self._release_prefetched()
+
+        if self._process_pool:
+            self._process_pool.shutdown(wait=True)
+            self._process_pool = None
+
+        self._maintenance_stop.set()
+        if self._maintenance_thread and self._maintenance_thread is not threading.current_thread():
+            self._maintenance_thread.join()
+            self._maintenance_thread = None
+
         try:
             self._backend.close()
         except Exception:
             pass
 
         logger.info("Worker shutdown complete")
+
+    def _release_prefetched(self):
+        """Give buffered tasks that never ran back to the backend."""
+        tasks = []
+        while True:
+            try:
+                tasks.append(self._buffer.get_nowait())
+            except queue.Empty:
+                break
+
+        if tasks:
+            logger.info("Releasing %s prefetched tasks", len(tasks))
+            try:
+                self._timed('release', self._backend.release, tasks)
+            except Exception as e:
+                logger.error("Failed to release prefetched tasks: %s", e)
+            self._untrack(tasks)
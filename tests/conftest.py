@@ -0,0 +1,30 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from taskqueue.storage.redis_backend import RedisBackend
+
+
+@pytest.fixture
+def server():
+    # one in-memory server; every client made on it sees the same keys
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def make_backend(server):
+    backends = []
+
+    def make(**options):
+        backend = RedisBackend(client=fakeredis.FakeRedis(server=server), **options)
+        backends.append(backend)
+        return backend
+
+    yield make
+    for backend in backends:
+        backend.close()
+
+
+@pytest.fixture
+def backend(make_backend):
+    return make_backend()
@@ -0,0 +1,11 @@
+import redis.asyncio as aioredis
+
+from taskqueue.async_worker import AsyncWorker
+
+
+def test_default_backend_pool_is_bounded_by_max_in_flight():
+    worker = AsyncWorker(max_in_flight=50)
+
+    pool = worker._backend._redis.connection_pool
+    assert isinstance(pool, aioredis.BlockingConnectionPool)
+    assert pool.max_connections == 52
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+
+import fakeredis
+
+from taskqueue.storage.async_redis_backend import AsyncRedisBackend
+from taskqueue.task import Task, Priority
+from taskqueue.worker import Worker
+
+
+def _claim_in_thread(backend, count, timeout, results):
+    thread = threading.Thread(target=lambda: results.append(backend.claim_many(count, timeout=timeout)))
+    thread.start()
+    return thread
+
+
+def test_idle_claim_wakes_for_any_level(backend):
+    results = []
+    thread = _claim_in_thread(backend, 1, 5, results)
+    time.sleep(0.2)
+    start = time.monotonic()
+    backend.push(Task("low", priority=Priority.Low))
+    thread.join(5)
+
+    assert [task.name for task in results[0]] == ["low"]
+    assert time.monotonic() - start < 1
+    assert backend.get_processing_count() == 1
+
+
+def test_waiting_claims_never_take_more_than_asked(backend):
+    # several threads on one backend, like Worker threads sharing it
+    results = []
+    threads = [_claim_in_thread(backend, 1, 5, results) for _ in range(8)]
+    time.sleep(0.2)
+    backend.push_many([Task(f"t{i}") for i in range(8)])
+    for thread in threads:
+        thread.join(5)
+
+    assert [len(tasks) for tasks in results] == [1] * 8
+    assert len({tasks[0].id for tasks in results}) == 8
+    assert backend.get_processing_count() == 8
+
+
+def test_partial_claim_leaves_the_rest_queued(backend):
+    backend.push_many([Task(f"t{i}") for i in range(5)])
+
+    claimed = backend.claim_many(2)
+
+    assert [task.name for task in claimed] == ["t0", "t1"]
+    assert backend.get_queue_length() == 3
+    assert backend.get_processing_count() == 2
+    # one wake-up token left per queued task
+    assert backend._redis.llen(backend.READY_KEY) == 3
+
+
+def test_wait_outlives_a_token_without_a_task(backend):
+    results = []
+    thread = _claim_in_thread(backend, 1, 5, results)
+    time.sleep(0.1)
+    # as if another worker claimed the task this token was for
+    backend._redis.lpush(backend.READY_KEY, 1)
+    time.sleep(0.2)
+    backend.push(Task("b"))
+    thread.join(5)
+
+    assert [task.name for task in results[0]] == ["b"]
+
+
+def test_worker_releases_tasks_it_will_not_run(backend):
+    backend.push_many([Task("a"), Task("b")])
+    claim_many = backend.claim_many
+    backend.claim_many = lambda count, timeout=None, policy=None: claim_many(count + 1, timeout, policy)
+    worker = Worker(backend=backend, blocking=False, heartbeat_interval=None, reap_interval=None, promote_interval=None)
+
+    task = worker._next_task()
+
+    assert task.name == "a"
+    assert list(worker._claimed) == [task.id]
+    assert backend.get_processing_count() == 1
+    assert backend.get_queue_length() == 1
+
+
+def test_async_idle_claim_wakes_for_any_level(server):
+    async def scenario():
+        backend = AsyncRedisBackend(client=fakeredis.aioredis.FakeRedis(server=server))
+        waiter = asyncio.ensure_future(backend.claim_many(1, timeout=5))
+        await asyncio.sleep(0.2)
+        await backend.push(Task("low", priority=Priority.Low))
+        tasks = await asyncio.wait_for(waiter, 2)
+        await backend.close()
+        return tasks
+
+    assert [task.name for task in asyncio.run(scenario())] == ["low"]
+
+
+def test_prefetch_never_buffers_more_than_its_slots(backend):
+    backend.push_many([Task(f"t{i}") for i in range(6)])
+    claim_many = backend.claim_many
+    backend.claim_many = lambda count, timeout=None, policy=None: claim_many(count + 2, timeout, policy)
+    worker = Worker(backend=backend, prefetch=2, heartbeat_interval=None, reap_interval=None, promote_interval=None, poll_interval=0.1)
+    worker._running = True
+    thread = threading.Thread(target=worker._prefetch_loop)
+    thread.start()
+    time.sleep(0.3)
+    worker._running = False
+    thread.join(5)
+
+    assert worker._buffer.qsize() == 2
+    assert len(worker._claimed) == 2
+    assert backend.get_processing_count() == 2
+    assert backend.get_queue_length() == 4
@@ -0,0 +1,58 @@
+import threading
+
+import fakeredis
+
+from taskqueue.storage.streams_backend import StreamsBackend
+from taskqueue.task import Task, TaskStatus
+
+
+def test_finished_task_always_carries_its_result(make_backend):
+    backend, reader = make_backend(), make_backend()
+    tasks = [Task("square", args=(i,)) for i in range(200)]
+    backend.push_many(tasks)
+    seen_without_result = []
+    done = threading.Event()
+
+    def read():
+        while not done.is_set():
+            for task in tasks:
+                stored = reader.get_task(task.id)
+                if stored.status == TaskStatus.COMPLETED and stored.result is None:
+                    seen_without_result.append(task.id)
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    for claimed in backend.claim_many(len(tasks)):
+        backend.mark_completed(claimed, result=claimed.args[0] ** 2 + 1)
+    done.set()
+    thread.join()
+
+    assert seen_without_result == []
+
+
+def test_wait_for_result_right_after_completion(backend):
+    task = Task("add")
+    backend.push(task)
+    backend.mark_completed(backend.claim(), result=38)
+
+    assert backend.wait_for_result(task.id, timeout=0).result == 38
+
+
+def test_failed_task_carries_its_error(backend):
+    task = Task("boom")
+    backend.push(task)
+    backend.mark_failed(backend.claim(), error="ValueError: boom")
+
+    stored = backend.wait_for_result(task.id, timeout=0)
+    assert stored.status == TaskStatus.FAILED
+    assert stored.error == "ValueError: boom"
+
+
+def test_streams_backend_writes_result_with_status(server):
+    backend = StreamsBackend(client=fakeredis.FakeRedis(server=server))
+    task = Task("add")
+    backend.push(task)
+    backend.mark_completed(backend.claim(), result=38)
+
+    fields = backend._redis.hmget(backend._get_task_key(task.id), 'status', 'result')
+    assert fields == [TaskStatus.COMPLETED.encode(), b'38']
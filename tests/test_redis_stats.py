@@ -0,0 +1,11 @@
+from taskqueue.task import Task
+
+
+def test_counters_use_the_level_a_task_is_queued_on(backend):
+    backend.push_many([Task("a", priority=0), Task("b", priority=99)])
+
+    stats = backend.get_stats()
+    by_priority = {level: counts['enqueued'] for level, counts in stats['by_priority'].items()}
+    queued = {level: count for level, count in stats.items() if level in by_priority}
+    assert by_priority == queued
+    assert sum(by_priority.values()) == 2
@@ -0,0 +1,38 @@
+from taskqueue.task import Task, TaskStatus
+
+
+def _baseline_processing(backend, task):
+    # what a worker from before hashes and leases left behind when it died mid-task
+    task.status = TaskStatus.PROCESSING
+    backend._redis.set(backend._get_task_key(task.id), task.to_json())
+    backend._redis.sadd(backend.PROCESSING_KEY, task.id)
+
+
+def test_reap_requeues_tasks_of_a_dead_baseline_worker(backend):
+    old = Task("old", args=(1,))
+    _baseline_processing(backend, old)
+    # reaped in the same batch, so a failure on `old` would hold it up too
+    current = Task("current", status=TaskStatus.PROCESSING)
+    backend.update_task(current)
+    backend._redis.sadd(backend.PROCESSING_KEY, current.id)
+
+    assert backend.reap_expired() == 2
+
+    assert backend.get_processing_count() == 0
+    requeued = backend.get_task(old.id)
+    assert requeued.status == TaskStatus.ENQUEUED
+    assert requeued.retry_count == 1
+    assert list(requeued.args) == [1]
+    assert {task.name for task in backend.claim_many(3)} == {"old", "current"}
+
+
+def test_claim_and_stats_on_the_baseline_layout(backend):
+    _baseline_processing(backend, Task("stuck"))
+    queued = Task("queued")
+    backend._redis.set(backend._get_task_key(queued.id), queued.to_json())
+    backend._redis.lpush(backend._get_queue_key(queued.priority), queued.id)
+
+    assert backend.get_stats()['processing'] == 1
+    claimed = backend.claim()
+    assert claimed.name == "queued"
+    assert backend.get_processing_count() == 2